@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Time writing docker-compose.yml and the generated scripts for large topologies"""
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+from bench_routing import configs
+
+from toposim import generate_docker_compose, generate_scripts
+from toposim.application import application_registry
+from toposim.artifacts import Artifacts
+from toposim.topology import Node, Topology
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--family", action="append", choices=configs.keys(), help="default: all"
+    )
+    parser.add_argument("--app", default="galois", choices=application_registry.keys())
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=0.5,
+        help="Fail if writing docker-compose.yml takes longer than this (seconds)",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'family':<10} {'nodes':>6} {'networks':>9} {'compose (s)':>12} {'all files (s)':>14}"
+    )
+    over_budget = []
+    for family in args.family or configs.keys():
+        # Only the largest (~1000 node) topology of every family
+        builder, params = configs[family][-1]
+        config = builder(*params)
+        links, dummies = config["links"], config["dummyNodes"]
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stderr(devnull):
+                nodes = {k: Node(k, l, k in dummies) for k, l in links.items()}
+                topo = Topology("bench", nodes)
+        app = application_registry[args.app]()
+        app.initialize(topo)
+
+        compose_time = float("inf")
+        total_time = float("inf")
+        with tempfile.TemporaryDirectory() as tmp:
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                generate_docker_compose(app, topo, Artifacts())
+                compose_time = min(compose_time, time.perf_counter() - start)
+
+                with open(os.devnull, "w") as devnull:
+                    with contextlib.redirect_stderr(devnull):
+                        start = time.perf_counter()
+                        out = Artifacts()
+                        generate_scripts(app, topo, out)
+                        out.write_to(tmp)
+                        total_time = min(total_time, time.perf_counter() - start)
+        print(
+            f"{family:<10} {len(links):>6} {len(topo.networks):>9} "
+            f"{compose_time:>12.4f} {total_time:>14.4f}"
+        )
+        if compose_time > args.budget:
+            over_budget.append(family)
+
+    if over_budget:
+        print(
+            f"docker-compose.yml took longer than {args.budget}s for: {', '.join(over_budget)}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""Compare port forwarding with direct forwarding between nodes.
+
+Without arguments, every topology family is built in both modes (with links as
+docker bridges and as veth pairs) and the number of containers, docker
+networks, interfaces and routes is reported. With `--live`, the given generated
+directories must be running (`toposim up`, `setup_networking`) and the memory
+used by their containers, and the ping latency and iperf3 throughput between
+two nodes are measured as well.
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import re
+import subprocess
+import time
+
+from bench_routing import configs
+
+from toposim import load_topology
+from toposim.docker import Docker
+from toposim.netns import container_pids
+from toposim.topology import BACKENDS, FORWARDING_MODES, Node, Topology
+
+
+def count(topo: Topology) -> dict:
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stderr(devnull):
+            routes = topo.container_routes()
+    return {
+        "containers": len(topo.containers),
+        "networks": len(topo.bridge_networks),
+        "interfaces": sum(len(c.networks) for c in topo.containers.values()),
+        "routes": sum(len(r) for r in routes.values()),
+    }
+
+
+def offline(families: list):
+    print(
+        f"{'family':<10} {'mode':<7} {'backend':<7} {'nodes':>6} {'containers':>11} "
+        f"{'docker networks':>16} {'interfaces':>11} {'routes':>8}"
+    )
+    for family in families:
+        # Only the largest (~1000 node) topology of every family
+        builder, params = configs[family][-1]
+        config = builder(*params)
+        links, dummies = config["links"], config["dummyNodes"]
+        for mode, backend in itertools.product(FORWARDING_MODES, BACKENDS):
+            with open(os.devnull, "w") as devnull:
+                with contextlib.redirect_stderr(devnull):
+                    nodes = {k: Node(k, l, k in dummies) for k, l in links.items()}
+                    topo = Topology("bench", nodes, forwarding=mode, backend=backend)
+            c = count(topo)
+            print(
+                f"{family:<10} {mode:<7} {backend:<7} {len(topo.nodes):>6} "
+                f"{c['containers']:>11} {c['networks']:>16} {c['interfaces']:>11} "
+                f"{c['routes']:>8}"
+            )
+
+
+def memory_usage(docker: Docker, container: str) -> int:
+    stats = docker.request(
+        "GET", f"/containers/{container}/stats", params={"stream": "false"}
+    )
+    mem = stats["memory_stats"]
+    # Same as `docker stats`: page cache that can be reclaimed is not counted
+    return mem.get("usage", 0) - mem.get("stats", {}).get("inactive_file", 0)
+
+
+def nsenter(pid: int, args: list) -> list:
+    return ["nsenter", "-t", str(pid), "-n"] + args
+
+
+def ping(pid: int, ip: str, count: int) -> float:
+    """Average round trip time in ms"""
+    res = subprocess.run(
+        nsenter(pid, ["ping", "-q", "-i", "0.2", "-c", str(count), ip]),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    match = re.search(r"= [\d.]+/([\d.]+)/", res.stdout)
+    assert match, res.stdout
+    return float(match.group(1))
+
+
+def iperf(src_pid: int, dst_pid: int, ip: str, seconds: int) -> float:
+    """TCP throughput in Mbit/s"""
+    server = subprocess.Popen(
+        nsenter(dst_pid, ["iperf3", "-s", "-1", "-B", ip]),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        time.sleep(0.5)
+        res = subprocess.run(
+            nsenter(src_pid, ["iperf3", "-c", ip, "-t", str(seconds), "-J"]),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    finally:
+        server.wait(timeout=5)
+    return json.loads(res.stdout)["end"]["sum_received"]["bits_per_second"] / 1e6
+
+
+def live(directories: list, pair: list, pings: int, seconds: int):
+    docker = Docker()
+    print(
+        f"{'directory':<20} {'mode':<7} {'backend':<7} {'containers':>11} "
+        f"{'memory (MiB)':>13} {'ping (ms)':>10} {'iperf (Mbit/s)':>15}"
+    )
+    for directory in directories:
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stderr(devnull):
+                topo = load_topology(directory)
+        pids = container_pids(topo)
+        memory = sum(memory_usage(docker, c) for c in topo.containers)
+        if pair:
+            src, dst = (f"{topo.prefix}_{n}" for n in pair)
+        else:
+            src, dst = list(topo.nodes)[0], list(topo.nodes)[-1]
+        ip = topo.nodes[dst].ip
+        rtt = ping(pids[src], ip, pings)
+        throughput = iperf(pids[src], pids[dst], ip, seconds)
+        print(
+            f"{directory:<20} {topo.forwarding:<7} {topo.backend:<7} "
+            f"{len(topo.containers):>11} {memory / (1 << 20):>13.1f} {rtt:>10.3f} "
+            f"{throughput:>15.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--family", action="append", choices=configs.keys(), help="default: all"
+    )
+    parser.add_argument(
+        "--live",
+        nargs="+",
+        metavar="DIR",
+        help="Measure running clusters generated in these directories",
+    )
+    parser.add_argument(
+        "--pair",
+        nargs=2,
+        metavar=("SRC", "DST"),
+        help="Nodes to measure between (default: the first and last node)",
+    )
+    parser.add_argument("--pings", type=int, default=20)
+    parser.add_argument("--seconds", type=int, default=5, help="iperf3 duration")
+    args = parser.parse_args()
+
+    if args.live:
+        live(args.live, args.pair, args.pings, args.seconds)
+    else:
+        offline(args.family or list(configs.keys()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Time route generation and aggregation for synthetic topologies of increasing size"""
+
+import argparse
+import contextlib
+import os
+import time
+
+from toposim.generators import dragonfly, fat_tree, hypercube, slimfly, torus
+from toposim.graph import TopologyGraph
+from toposim.topology import Node, Topology, compute_routes
+
+# Parameters chosen so that each family spans roughly 10 -> 1000 nodes
+configs = {
+    "ring": [(torus, ((n,), 0)) for n in (10, 100, 300, 1000)],
+    "torus": [(torus, ((n, n), 1)) for n in (2, 4, 10, 22)],
+    "hypercube": [(hypercube, (d, 1)) for d in (2, 4, 6, 9)],
+    "fat-tree": [(fat_tree, (k,)) for k in (2, 4, 8, 14)],
+    "dragonfly": [
+        (dragonfly, args) for args in ((2, 1, 1), (4, 2, 2), (6, 3, 3), (8, 4, 3))
+    ],
+    "slimfly": [(slimfly, args) for args in ((3, 1), (5, 2), (7, 3), (11, 3))],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--family", action="append", choices=configs.keys(), help="default: all"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'family':<10} {'nodes':>6} {'links':>7} {'routes (s)':>11} "
+        f"{'topology (s)':>13} {'aggregate (s)':>14} {'port routes':>12} {'aggregated':>11}"
+    )
+    for family in args.family or configs.keys():
+        for builder, params in configs[family]:
+            config = builder(*params)
+            links, dummies = config["links"], config["dummyNodes"]
+            num_links = sum(len(l) for l in links.values()) // 2
+
+            def make_nodes():
+                return {k: Node(k, l, k in dummies) for k, l in links.items()}
+
+            route_time = float("inf")
+            topo_time = float("inf")
+            aggregate_time = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                compute_routes(TopologyGraph.from_links(links, dummies))
+                route_time = min(route_time, time.perf_counter() - start)
+
+                nodes = make_nodes()
+                with open(os.devnull, "w") as devnull:
+                    with contextlib.redirect_stderr(devnull):
+                        start = time.perf_counter()
+                        topo = Topology("bench", nodes)
+                        topo_time = min(topo_time, time.perf_counter() - start)
+
+                        start = time.perf_counter()
+                        routes = topo.container_routes()
+                        aggregate_time = min(
+                            aggregate_time, time.perf_counter() - start
+                        )
+            num_routes = sum(len(r) for r in topo.link_to_fwd_ips.values())
+            num_aggregated = sum(len(routes[p.name]) for p in topo.ports.values())
+            print(
+                f"{family:<10} {len(links):>6} {num_links:>7} {route_time:>11.4f} "
+                f"{topo_time:>13.4f} {aggregate_time:>14.4f} {num_routes:>12} {num_aggregated:>11}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""Time generating many variants of a config, as a parameter sweep would.
+
+Every variant is generated four ways: one `toposim` process per variant (how
+sweeps used to call it), one `generate` call after another in this process,
+`generate` from a pool of threads, and `generate_many` with a pool of
+processes. Variants differ in the options
+that don't change the nodes (ecmp, forwarding mode and backend).
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from toposim import generate, generate_many
+
+DEFAULT_CONFIG = Path(__file__).parent.parent / "slimfly_3_related" / "slimfly_3.json"
+
+
+def variants(config: dict, count: int) -> list:
+    options = itertools.cycle(
+        itertools.product([False, True], ["port", "direct"], ["bridge", "veth"])
+    )
+    res = []
+    for _, (ecmp, forwarding, backend) in zip(range(count), options):
+        res.append(
+            {**config, "ecmp": ecmp, "forwarding": forwarding, "backend": backend}
+        )
+    return res
+
+
+def write_configs(directory: str, configs: list) -> list:
+    kwargs = []
+    for i, config in enumerate(configs):
+        filename = os.path.join(directory, f"config{i}.json")
+        with open(filename, "w") as f:
+            json.dump(config, f)
+        kwargs.append(
+            {
+                "prefix": f"sweep{i}",
+                "filename": filename,
+                "app_name": config.get("app", "galois"),
+                "subnet32": "10",
+                "directory": os.path.join(directory, "out", f"sweep{i}"),
+            }
+        )
+    return kwargs
+
+
+def timed(directory: str, fn) -> float:
+    try:
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stderr(devnull):
+                start = time.perf_counter()
+                fn()
+                return time.perf_counter() - start
+    finally:
+        shutil.rmtree(os.path.join(directory, "out"), ignore_errors=True)
+
+
+def per_process(kwargs: list):
+    for k in kwargs:
+        out = os.path.dirname(k["directory"])
+        os.makedirs(out, exist_ok=True)
+        subprocess.run(
+            [sys.executable, "-m", "toposim", k["prefix"], k["filename"]]
+            + ["--app", k["app_name"], "--subnet32", k["subnet32"]],
+            cwd=out,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+
+def sequential(kwargs: list):
+    for k in kwargs:
+        generate(**k)
+
+
+def threads(kwargs: list, jobs: int):
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(lambda k: generate(**k), kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--config", default=str(DEFAULT_CONFIG))
+    parser.add_argument("--count", type=int, default=32, help="Number of variants")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+    with tempfile.TemporaryDirectory() as tmp:
+        kwargs = write_configs(tmp, variants(config, args.count))
+        results = [
+            ("process per config", timed(tmp, lambda: per_process(kwargs))),
+            ("sequential generate", timed(tmp, lambda: sequential(kwargs))),
+            (
+                f"threads (-j {args.jobs})",
+                timed(tmp, lambda: threads(kwargs, args.jobs)),
+            ),
+            (
+                f"generate_many (-j {args.jobs})",
+                timed(tmp, lambda: generate_many(kwargs, args.jobs)),
+            ),
+        ]
+
+    print(f"{'method':<24} {'total (s)':>10} {'configs/s':>10}")
+    for name, elapsed in results:
+        print(f"{name:<24} {elapsed:>10.3f} {args.count / elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
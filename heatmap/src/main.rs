@@ -1,4 +1,5 @@
 use std::collections::HashMap;
+use std::fmt;
 use std::fs::File;
 use std::io::{prelude::*, BufWriter, Seek, SeekFrom};
 use std::net::Ipv4Addr;
@@ -10,7 +11,8 @@ use clap::Parser;
 use glob::glob;
 use pcap_parser::{traits::PcapReaderIterator, *};
 use pnet::packet::{ethernet::EthernetPacket, ipv4::Ipv4Packet, Packet};
-use serde::{Deserialize, Serialize};
+use serde::de::{MapAccess, Visitor};
+use serde::{Deserialize, Deserializer, Serialize, Serializer};
 use threadpool::ThreadPool;
 use tqdm::pbar;
 
@@ -29,12 +31,48 @@ struct Args {
     nprocs: usize,
 }
 
+/// Group name -> nodes of the group, in the order of the config (which is the
+/// order of the rows and columns of the matrices)
+#[derive(Debug)]
+struct Groups(Vec<(String, Vec<String>)>);
+
+impl<'de> Deserialize<'de> for Groups {
+    fn deserialize<D: Deserializer<'de>>(deserializer: D) -> Result<Groups, D::Error> {
+        struct GroupsVisitor;
+
+        impl<'de> Visitor<'de> for GroupsVisitor {
+            type Value = Groups;
+
+            fn expecting(&self, f: &mut fmt::Formatter) -> fmt::Result {
+                f.write_str("a map of group names to lists of node names")
+            }
+
+            fn visit_map<A: MapAccess<'de>>(self, mut map: A) -> Result<Groups, A::Error> {
+                let mut groups = vec![];
+                while let Some(entry) = map.next_entry()? {
+                    groups.push(entry);
+                }
+                Ok(Groups(groups))
+            }
+        }
+
+        deserializer.deserialize_map(GroupsVisitor)
+    }
+}
+
+impl Serialize for Groups {
+    fn serialize<S: Serializer>(&self, serializer: S) -> Result<S::Ok, S::Error> {
+        serializer.collect_map(self.0.iter().map(|(k, v)| (k, v)))
+    }
+}
+
 /// TopoSim config
 #[derive(Debug, Serialize, Deserialize)]
 struct Config {
     links: HashMap<String, Vec<String>>,
     #[serde(rename = "dummyNodes")]
     dummy_nodes: Option<Vec<String>>,
+    groups: Option<Groups>,
 }
 
 impl Config {
@@ -43,18 +81,33 @@ impl Config {
     }
 
     /// Get all hosts that are not dummyNodes
-    fn get_hosts(self) -> Vec<String> {
+    fn get_hosts(&self) -> Vec<String> {
         let mut hosts = vec![];
-        for (k, _v) in self.links {
+        for k in self.links.keys() {
             if let Some(dummy_nodes) = &self.dummy_nodes {
-                if dummy_nodes.contains(&k) {
+                if dummy_nodes.contains(k) {
                     continue;
                 }
             }
-            hosts.push(k);
+            hosts.push(k.clone());
         }
         hosts
     }
+
+    /// Get the number of groups and the index of the group of every host
+    fn get_host_groups(&self) -> (usize, HashMap<String, usize>) {
+        let groups = self
+            .groups
+            .as_ref()
+            .expect("the config has no \"groups\" key (see `toposim gen`)");
+        let mut host_group = HashMap::new();
+        for (i, (_name, members)) in groups.0.iter().enumerate() {
+            for h in members {
+                host_group.insert(h.clone(), i);
+            }
+        }
+        (groups.0.len(), host_group)
+    }
 }
 
 // Structs for parsing docker-compose.yml files
@@ -108,11 +161,18 @@ fn get_ips_to_ids(args: &Args, hosts: &Vec<String>) -> HashMap<u32, String> {
     ip_to_id
 }
 
-/// Get group no for a given ip
-fn get_group(ip_to_id: &HashMap<u32, String>, ip: u32) -> usize {
-    let name = &ip_to_id[&ip][1..];
-    let id: u64 = name.parse().unwrap();
-    ((id - 1) / 9) as usize
+/// Construct mapping from ip addrs to the index of the host's group
+fn get_ips_to_groups(
+    ip_to_id: &HashMap<u32, String>,
+    host_group: &HashMap<String, usize>,
+) -> HashMap<u32, usize> {
+    ip_to_id
+        .iter()
+        .map(|(ip, h)| match host_group.get(h) {
+            Some(g) => (*ip, *g),
+            None => panic!("host {} is not in any group of the config", h),
+        })
+        .collect()
 }
 
 /// Type alias for traffix matrix (ip src -> (ip dst -> bytes sent))
@@ -206,7 +266,9 @@ fn main() {
 
     let config = Config::from_args(&args);
     let hosts = config.get_hosts();
+    let (num_groups, host_group) = config.get_host_groups();
     let ip_to_id = get_ips_to_ids(&args, &hosts);
+    let ip_to_group = get_ips_to_groups(&ip_to_id, &host_group);
 
     Command::new("mkdir")
         .args(["-p", &args.output_dir.to_string_lossy()])
@@ -245,16 +307,15 @@ fn main() {
     let res: Arc<Vec<Vec<HeatMap>>> = Arc::new(res);
     for i in 0..max_len {
         let res = res.clone();
-        let ip_to_id = ip_to_id.clone();
+        let ip_to_group = ip_to_group.clone();
         let output_dir = args.output_dir.clone();
         pool.execute(move || {
             let host_matrix = merge_traffic_matrices(i, res);
-            const NUM_GROUPS: usize = 6;
-            let mut group_matrix = [[0u64; NUM_GROUPS]; NUM_GROUPS];
+            let mut group_matrix = vec![vec![0u64; num_groups]; num_groups];
 
             for (src, dstmap) in host_matrix {
                 for (dst, v) in dstmap {
-                    group_matrix[get_group(&ip_to_id, src)][get_group(&ip_to_id, dst)] += v;
+                    group_matrix[ip_to_group[&src]][ip_to_group[&dst]] += v;
                 }
             }
 
@@ -262,11 +323,11 @@ fn main() {
             out.push(format!("matrix-ts{}.txt", i));
 
             let mut f = BufWriter::new(File::create(out).unwrap());
-            for i in 0..NUM_GROUPS {
-                for j in 0..NUM_GROUPS {
+            for i in 0..num_groups {
+                for j in 0..num_groups {
                     f.write_all(&group_matrix[i][j].to_string().into_bytes())
                         .unwrap();
-                    if j != (NUM_GROUPS - 1) {
+                    if j != (num_groups - 1) {
                         f.write_all(b" ").unwrap();
                     }
                 }
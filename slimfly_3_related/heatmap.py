@@ -5,87 +5,40 @@ import matplotlib.pyplot as plt
 from scapy.all import PcapReader
 from collections import defaultdict
 import glob
+import json
 import multiprocessing as mp
 
-# ip_to_id = {
-# "174.30.0.2":"h15",
-# "174.34.0.2":"h17",
-# "174.18.0.2":"h9",
-# "174.28.0.2":"h14",
-# "174.32.0.2":"h16",
-# "174.36.0.2":"h18",
-# "174.16.0.2":"h8",
-# "174.10.0.2":"h5",
-# "174.6.0.2":"h3",
-# "174.4.0.2":"h2",
-# "174.22.0.2":"h11",
-# "174.20.0.2":"h10",
-# "174.14.0.2":"h7",
-# "174.12.0.2":"h6",
-# "174.2.0.2":"h1",
-# "174.8.0.2":"h4",
-# "174.26.0.2":"h13",
-# "174.24.0.2":"h12",
-# }
+from toposim import load_metadata, load_topology
 
+label = sys.argv[1]
+
+# Addresses, routers and groups of every host, from the directory toposim
+# generated the topology into (configs written by `toposim gen` have a "groups"
+# key)
+topology_dir = sys.argv[3] if len(sys.argv) > 3 else "."
+# The config currently applied (`toposim reconfigure` keeps every config)
+config_file = load_metadata(topology_dir).get("history", ["topology.json"])[-1]
+with open(os.path.join(topology_dir, config_file)) as f:
+    config = json.load(f)
+topo = load_topology(topology_dir)
+# Every address of every host (hosts that forward directly have one per link)
 ip_to_id = {
-    "174.30.0.2":"h22",
-    "174.7.0.2":"h5",
-    "174.43.0.2":"h32",
-    "174.68.0.2":"h51",
-    "174.3.0.2":"h2",
-    "174.34.0.2":"h25",
-    "174.47.0.2":"h35",
-    "174.38.0.2":"h28",
-    "174.39.0.2":"h29",
-    "174.18.0.2":"h13",
-    "174.19.0.2":"h14",
-    "174.58.0.2":"h43",
-    "174.28.0.2":"h21",
-    "174.40.0.2":"h30",
-    "174.32.0.2":"h24",
-    "174.42.0.2":"h31",
-    "174.36.0.2":"h27",
-    "174.66.0.2":"h49",
-    "174.64.0.2":"h48",
-    "174.71.0.2":"h53",
-    "174.72.0.2":"h54",
-    "174.16.0.2":"h12",
-    "174.15.0.2":"h11",
-    "174.10.0.2":"h7",
-    "174.31.0.2":"h23",
-    "174.6.0.2":"h4",
-    "174.4.0.2":"h3",
-    "174.44.0.2":"h33",
-    "174.46.0.2":"h34",
-    "174.63.0.2":"h47",
-    "174.62.0.2":"h46",
-    "174.60.0.2":"h45",
-    "174.50.0.2":"h37",
-    "174.70.0.2":"h52",
-    "174.22.0.2":"h16",
-    "174.54.0.2":"h40",
-    "174.20.0.2":"h15",
-    "174.55.0.2":"h41",
-    "174.14.0.2":"h10",
-    "174.12.0.2":"h9",
-    "174.11.0.2":"h8",
-    "174.35.0.2":"h26",
-    "174.2.0.2":"h1",
-    "174.48.0.2":"h36",
-    "174.67.0.2":"h50",
-    "174.8.0.2":"h6",
-    "174.52.0.2":"h39",
-    "174.27.0.2":"h20",
-    "174.26.0.2":"h19",
-    "174.51.0.2":"h38",
-    "174.24.0.2":"h18",
-    "174.56.0.2":"h42",
-    "174.23.0.2":"h17",
-    "174.59.0.2":"h44",
+    ip: name[len(topo.prefix) + 1 :]
+    for name, node in topo.nodes.items()
+    for ip in node.ips
+}
+routers = config["dummyNodes"]
+router_index = {r: i for i, r in enumerate(routers)}
+host_router = {
+    h: router_index[l[0]] for h, l in config["links"].items() if h not in router_index
+}
+groups = list(config["groups"])
+host_group = {
+    h: i
+    for i, members in enumerate(config["groups"].values())
+    for h in members
+    if h not in router_index
 }
-
-label = sys.argv[1]
 
 def default_dict_int():
     return defaultdict(int)
@@ -163,11 +116,7 @@ def create_router_heatmap(traffic_matrix):
         names.update(traffic_matrix[src].keys())
     names = sorted(names, key=lambda x: int(x[1:]))
 
-    # Create an index mapping for IP addresses
-    ip_index = {ip: idx for idx, ip in enumerate(names)}
-
-    hosts_per_router = 3 # hosts per router
-    num_routers = 18 # routers
+    num_routers = len(routers)
 
     # Initialize the traffic matrix
     matrix = np.zeros((num_routers, num_routers), dtype=int)
@@ -175,7 +124,7 @@ def create_router_heatmap(traffic_matrix):
     # Populate the traffic matrix
     for src, dst_dict in traffic_matrix.items():
         for dst, count in dst_dict.items():
-            matrix[ip_index[src] // hosts_per_router][ip_index[dst] // hosts_per_router] += count
+            matrix[host_router[src]][host_router[dst]] += count
 
     router_names = [f'R{i}' for i in range(num_routers)]
 
@@ -203,11 +152,7 @@ def create_group_heatmap(traffic_matrix):
         names.update(traffic_matrix[src].keys())
     names = sorted(names, key=lambda x: int(x[1:]))
 
-    # Create an index mapping for IP addresses
-    ip_index = {ip: idx for idx, ip in enumerate(names)}
-
-    hosts_per_group = 9 # hosts per group
-    num_groups = 6 # groups
+    num_groups = len(groups)
 
     # Initialize the traffic matrix
     matrix = np.zeros((num_groups, num_groups), dtype=int)
@@ -215,7 +160,7 @@ def create_group_heatmap(traffic_matrix):
     # Populate the traffic matrix
     for src, dst_dict in traffic_matrix.items():
         for dst, count in dst_dict.items():
-            matrix[ip_index[src] // hosts_per_group][ip_index[dst] // hosts_per_group] += count
+            matrix[host_group[src]][host_group[dst]] += count
 
     group_names = [f'G{i}' for i in range(num_groups)]
 
@@ -0,0 +1,37 @@
+from toposim.artifacts import Artifacts
+
+
+def bundle(files):
+    out = Artifacts()
+    for path, content in files.items():
+        out.write(path, content)
+    return out
+
+
+def test_write_to_prunes_stale_files(tmp_path):
+    directory = tmp_path / "topo"
+    bundle(
+        {
+            "setup_networking": "old",
+            "networking/a.links": "old",
+            "networking/a.routes": "old",
+            "networking/b.iptables": "old",
+        }
+    ).write_to(directory)
+    (directory / "notes.txt").write_text("kept")
+
+    bundle({"setup_networking": "new", "networking/a.routes": "new"}).write_to(
+        directory, prune=["networking"]
+    )
+    assert sorted(p.name for p in (directory / "networking").iterdir()) == ["a.routes"]
+    assert (directory / "networking/a.routes").read_text() == "new"
+    assert (directory / "setup_networking").read_text() == "new"
+    # Files outside of the pruned directories are left alone
+    assert (directory / "notes.txt").read_text() == "kept"
+
+
+def test_write_to_keeps_stale_files_without_prune(tmp_path):
+    directory = tmp_path / "topo"
+    bundle({"networking/a.links": "old"}).write_to(directory)
+    bundle({"networking/a.routes": "new"}).write_to(directory)
+    assert (directory / "networking/a.links").exists()
@@ -0,0 +1,40 @@
+import numpy as np
+
+from toposim.controller import Controller, format_replay, replay
+from toposim.ocs import OCSTopology, popcount
+
+
+def test_decision_counts_switching_cost():
+    topo = OCSTopology.slimfly()
+    rng = np.random.default_rng(0)
+    switch_cost = 2e5
+    states = np.arange(topo.num_states)
+    for _ in range(50):
+        matrix = rng.integers(0, 10**6, (6, 6))
+        controller = Controller(
+            topo, half_life=0, hysteresis=0, switch_cost=switch_cost
+        )
+        controller.state = int(rng.integers(topo.num_states))
+        previous = controller.state
+        costs = topo.costs(matrix[None])[0]
+        net = costs + switch_cost * popcount(states ^ previous)
+        decision = controller.update(matrix)
+        expected = int(net.argmin()) if net.min() < costs[previous] else previous
+        assert decision.state == expected
+
+
+def test_replay_of_empty_trace():
+    topo = OCSTopology.slimfly()
+    result = replay(Controller(topo), np.zeros((0, 6, 6)))
+    assert result.report(topo)["timesteps"] == 0
+    assert "max 0.000 ms" in format_replay(result)
+
+
+def test_traffic_is_an_average_per_interval():
+    topo = OCSTopology.slimfly()
+    matrix = np.random.default_rng(0).integers(0, 10**6, (6, 6)).astype(float)
+    for half_life in (0, 1, 4):
+        controller = Controller(topo, half_life=half_life)
+        for _ in range(100):
+            controller.update(matrix)
+        assert np.allclose(controller.traffic, matrix)
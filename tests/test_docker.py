@@ -0,0 +1,32 @@
+import pytest
+
+from toposim.docker import Docker
+
+DIGEST = "sha256:" + "0" * 64
+
+
+@pytest.mark.parametrize(
+    "image, params",
+    [
+        ("ubuntu", {"fromImage": "ubuntu", "tag": "latest"}),
+        ("busybox:1.36", {"fromImage": "busybox", "tag": "1.36"}),
+        (
+            "registry.k8s.io/pause:3.9",
+            {"fromImage": "registry.k8s.io/pause", "tag": "3.9"},
+        ),
+        ("registry:5000/name", {"fromImage": "registry:5000/name", "tag": "latest"}),
+        ("registry:5000/name:v1", {"fromImage": "registry:5000/name", "tag": "v1"}),
+        (f"repo@{DIGEST}", {"fromImage": f"repo@{DIGEST}"}),
+        (f"registry:5000/repo@{DIGEST}", {"fromImage": f"registry:5000/repo@{DIGEST}"}),
+    ],
+)
+def test_pull_splits_the_tag(monkeypatch, image, params):
+    requests = []
+
+    def request(self, method, path, body=None, params=None, ok=()):
+        requests.append((method, path, params))
+        return [{"status": "Pulled"}]
+
+    monkeypatch.setattr(Docker, "request", request)
+    Docker().pull(image)
+    assert requests == [("POST", "/images/create", params)]
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from toposim.flows import load_matrices, simulate
+from toposim.graph import TopologyGraph
+from toposim.topology import routing_table
+
+# a - b - c, with a router r between b and c
+LINE = {"a": ["b"], "b": ["a", "r"], "r": ["b", "c"], "c": ["r"]}
+
+DIAMOND = {
+    "a": ["b", "c"],
+    "b": ["a", "d"],
+    "c": ["a", "d"],
+    "d": ["b", "c"],
+}
+
+
+def arc_bytes(result, u: str, v: str) -> np.ndarray:
+    graph = result.graph
+    arc = graph.arc_index(np.array([graph.ids[u]]), np.array([graph.ids[v]]))[0]
+    return result.arc_bytes[:, arc]
+
+
+def test_host_traffic_crosses_every_link_of_its_path():
+    graph = TopologyGraph.from_links(LINE, ["r"])
+    # Hosts a, b and c in config order
+    matrices = np.zeros((2, 3, 3))
+    matrices[0, 0, 2] = 100
+    matrices[1, 2, 1] = 40
+    result = simulate(graph, routing_table(graph, False), matrices, 10, 1000)
+    assert result.offered.tolist() == [100, 40]
+    assert arc_bytes(result, "a", "b").tolist() == [100, 0]
+    assert arc_bytes(result, "b", "r").tolist() == [100, 0]
+    assert arc_bytes(result, "r", "c").tolist() == [100, 0]
+    assert arc_bytes(result, "c", "r").tolist() == [0, 40]
+    assert arc_bytes(result, "r", "b").tolist() == [0, 40]
+    assert result.arc_bytes.sum(axis=1).tolist() == [300, 80]
+    assert result.completion_time.tolist() == [0.1, 0.04]
+    assert result.report()["intervals"][0]["busiest"] == ["a", "b"]
+
+
+@pytest.mark.parametrize("ecmp", [False, True])
+def test_ecmp_splits_traffic_between_equal_cost_paths(ecmp):
+    graph = TopologyGraph.from_links(DIAMOND)
+    matrices = np.zeros((1, 4, 4))
+    matrices[0, 0, 3] = 100
+    result = simulate(graph, routing_table(graph, ecmp), matrices, 1, 1000)
+    via_b = arc_bytes(result, "a", "b")[0], arc_bytes(result, "b", "d")[0]
+    via_c = arc_bytes(result, "a", "c")[0], arc_bytes(result, "c", "d")[0]
+    if ecmp:
+        assert via_b == via_c == (50, 50)
+    else:
+        # The first of a's links
+        assert via_b == (100, 100) and via_c == (0, 0)
+
+
+def test_group_traffic_is_spread_over_pairs_of_hosts():
+    graph = TopologyGraph.from_links(LINE, ["r"])
+    groups = {"g0": ["a", "b"], "g1": ["r", "c"]}
+    matrices = np.array([[[0, 60], [0, 0]]], dtype=float)
+    result = simulate(graph, routing_table(graph, False), matrices, 1, 1000, groups)
+    # Half of the traffic from a to c (3 hops), half from b to c (2 hops)
+    assert arc_bytes(result, "a", "b").tolist() == [30]
+    assert arc_bytes(result, "b", "r").tolist() == [60]
+    assert arc_bytes(result, "r", "c").tolist() == [60]
+    assert result.arc_bytes.sum() == 150
+
+
+def test_groups_without_hosts_are_rejected():
+    graph = TopologyGraph.from_links(LINE, ["r"])
+    groups = {"g0": ["a", "b", "c"], "g1": ["r"]}
+    with pytest.raises(Exception, match='groups\\["g1"\\] has no non-dummy nodes'):
+        simulate(
+            graph, routing_table(graph, False), np.zeros((1, 2, 2)), 1, 1000, groups
+        )
+
+
+def test_load_matrices(tmp_path):
+    for t in range(3):
+        np.savetxt(tmp_path / f"matrix-ts{t}.txt", np.full((2, 2), t))
+    assert load_matrices(str(tmp_path))[:, 0, 0].tolist() == [0, 1, 2]
+    (tmp_path / "matrix-ts1.txt").unlink()
+    with pytest.raises(Exception, match=r"Missing matrices for intervals \[1\]"):
+        load_matrices(str(tmp_path))
@@ -0,0 +1,50 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from toposim.graph import TopologyGraph
+
+ROOT = Path(__file__).parent.parent
+
+
+def load_example() -> dict:
+    with open(ROOT / "example.json") as f:
+        return json.load(f)
+
+
+def test_from_links():
+    data = load_example()
+    graph = TopologyGraph.from_links(data["links"], data["dummyNodes"])
+    assert graph.names == list(data["links"])
+    assert graph.num_links == sum(map(len, data["links"].values())) // 2
+    for n, neighbors in data["links"].items():
+        ids = graph.neighbors(graph.ids[n]).tolist()
+        # Neighbors stay in the order of the config
+        assert [graph.names[i] for i in ids] == neighbors
+    assert [graph.names[i] for i in np.flatnonzero(graph.is_dummy)] == ["r1", "r2"]
+
+
+@pytest.mark.parametrize(
+    "links, dummies, message",
+    [
+        ({"a": ["b"], "b": ["a", "c"]}, [], 'links["b"][1]: unknown node "c"'),
+        ({"a": ["a", "b"], "b": ["a"]}, [], 'links["a"]: "a" is linked to itself'),
+        (
+            {"a": ["b", "b"], "b": ["a", "a"]},
+            [],
+            'links["a"]: "b" is listed more than once',
+        ),
+        (
+            {"a": ["b", "c"], "b": ["a"], "c": []},
+            [],
+            'links["a"] lists "c", but links["c"] does not list "a"',
+        ),
+        ({"a": ["b"], "b": ["a"]}, ["b", "r"], 'dummyNodes[1]: unknown node "r"'),
+    ],
+)
+def test_from_links_errors(links, dummies, message):
+    with pytest.raises(Exception) as e:
+        TopologyGraph.from_links(links, dummies)
+    assert str(e.value) == message
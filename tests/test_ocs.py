@@ -0,0 +1,51 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from toposim.ocs import OCSTopology, evaluate_schedule, plan_schedule
+
+
+def brute_force(costs, states, switch_cost, downtime, initial):
+    """The cheapest of every schedule of the states"""
+    return min(
+        evaluate_schedule(
+            costs, states, np.array(schedule), switch_cost, downtime, initial
+        ).cost
+        for schedule in itertools.product(states, repeat=len(costs))
+    )
+
+
+@pytest.mark.parametrize("switch_cost", [0, 1e6, 1e7])
+@pytest.mark.parametrize("downtime", [0, 0.3])
+@pytest.mark.parametrize(
+    "states",
+    [
+        # Every state of the 3 switches, relaxed one switch at a time
+        list(range(8)),
+        # A subset, compared pairwise
+        [0, 3, 5, 6],
+    ],
+)
+def test_plan_schedule_is_optimal(states, downtime, switch_cost):
+    topo = OCSTopology.slimfly()
+    assert len(topo.switches) == 3
+    rng = np.random.default_rng(0)
+    matrices = rng.integers(0, 10**6, (3, 6, 6))
+    costs = topo.costs(matrices, states)
+    for initial in (0, 3):
+        args = (switch_cost, downtime, initial)
+        schedule = plan_schedule(costs, states, *args)
+        assert schedule.cost == pytest.approx(brute_force(costs, states, *args))
+        # The reported schedule costs what it claims
+        expected = evaluate_schedule(costs, states, schedule.states, *args)
+        assert schedule.cost == pytest.approx(expected.cost)
+
+
+def test_plan_schedule_without_switching_cost_picks_the_best_state():
+    topo = OCSTopology.slimfly()
+    matrices = np.random.default_rng(1).integers(0, 10**6, (10, 6, 6))
+    costs = topo.costs(matrices)
+    schedule = plan_schedule(costs)
+    assert np.array_equal(schedule.states, costs.argmin(axis=1))
+    assert schedule.cost == pytest.approx(costs.min(axis=1).sum())
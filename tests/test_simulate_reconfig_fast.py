@@ -0,0 +1,57 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from toposim.flows import load_matrices
+from toposim.ocs import OCSTopology
+
+spec = importlib.util.spec_from_file_location(
+    "simulate_reconfig_fast",
+    Path(__file__).parent.parent / "heatmap" / "simulate_reconfig_fast.py",
+)
+fast = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(fast)
+
+
+def write_trace(directory: Path, num_groups: int, steps: int) -> np.ndarray:
+    rng = np.random.default_rng(num_groups)
+    matrices = rng.integers(0, 10**6, (steps, num_groups, num_groups))
+    for t, matrix in enumerate(matrices):
+        np.savetxt(directory / f"matrix-ts{t}.txt", matrix, fmt="%d")
+    return matrices
+
+
+@pytest.mark.parametrize("topo", [OCSTopology.pairs(4), OCSTopology.slimfly()])
+def test_cpu_costs_match_path_walk(tmp_path, topo):
+    expected = write_trace(tmp_path, topo.num_groups, 2)
+    traffic = load_matrices(str(tmp_path))
+    assert np.array_equal(traffic, expected)
+
+    states = topo.candidate_states(traffic)
+    permutations = fast.relabelings(topo, states, traffic)
+    assert len(permutations) == fast.factorial(topo.num_groups)
+    assert np.array_equal(permutations[0], np.arange(topo.num_groups))
+
+    output = fast.cpu_costs(traffic, permutations, topo.state_hops(states))
+    walked = fast.python_costs(traffic, permutations, topo.next_hops(states))
+    assert np.array_equal(output, walked)
+
+
+@pytest.mark.parametrize("topo", [OCSTopology.pairs(4), OCSTopology.slimfly()])
+def test_cpu_costs_match_routed_paths(tmp_path, topo):
+    """Costs equal the bytes on every link when the traffic is routed over the
+    paths of toposim's routing tables (as simulate_reconfig.py counts them)"""
+    write_trace(tmp_path, topo.num_groups, 3)
+    traffic = load_matrices(str(tmp_path)).astype(np.int64)
+    states = topo.candidate_states(traffic)
+    permutations = fast.relabelings(topo, states, traffic)
+    output = fast.cpu_costs(traffic, permutations, topo.state_hops(states))
+
+    for r in [0, 1, len(permutations) // 2, len(permutations) - 1]:
+        p = permutations[r]
+        relabeled = traffic[:, p[:, None], p[None, :]]
+        loads = topo.link_loads(relabeled).sum(axis=(2, 3))
+        assert np.allclose(output[:, r, :], loads)
+        assert np.array_equal(output[:, r, :], topo.costs(relabeled))
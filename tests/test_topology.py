@@ -0,0 +1,224 @@
+import json
+from collections import deque
+from ipaddress import IPv4Network
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from toposim import build_topology
+from toposim.topology import SubnetAllocator, Topology, aggregate_routes
+
+ROOT = Path(__file__).parent.parent
+
+
+def load_slimfly() -> dict:
+    with open(ROOT / "slimfly_3_related" / "slimfly_3.json") as f:
+        return json.load(f)
+
+
+# Two equal-cost paths from a to d (and from b to c)
+DIAMOND = {
+    "links": {
+        "a": ["b", "c"],
+        "b": ["a", "d"],
+        "c": ["a", "d"],
+        "d": ["b", "c"],
+    }
+}
+
+# Two equal-cost paths between opposite nodes, one between the others
+RING = {
+    "links": {
+        "a": ["b", "f"],
+        "b": ["a", "c"],
+        "c": ["b", "d"],
+        "d": ["c", "e"],
+        "e": ["d", "f"],
+        "f": ["e", "a"],
+    }
+}
+
+CONFIGS = {"slimfly": load_slimfly(), "diamond": DIAMOND, "ring": RING}
+
+
+def build(data: dict, ecmp: bool) -> Topology:
+    return build_topology("t", {**data, "ecmp": ecmp}, "174.0.0.0/8")
+
+
+def distances(links: dict, src: str) -> dict:
+    dist = {src: 0}
+    queue = deque([src])
+    while queue:
+        n = queue.popleft()
+        for l in links[n]:
+            if l not in dist:
+                dist[l] = dist[n] + 1
+                queue.append(l)
+    return dist
+
+
+def equal_cost_hops(links: dict, src: str) -> dict:
+    """dst -> every neighbor of src on a shortest path to dst, in the order of
+    links[src]"""
+    dist = distances(links, src)
+    from_neighbor = {l: distances(links, l) for l in links[src]}
+    return {
+        dst: [l for l in links[src] if from_neighbor[l][dst] == dist[dst] - 1]
+        for dst in links
+        if dst != src
+    }
+
+
+def expected_routes(data: dict) -> dict:
+    """node -> dst -> every equal-cost next hop, with prefixed names"""
+    links = data["links"]
+    return {
+        f"t_{src}": {
+            f"t_{dst}": [f"t_{h}" for h in hops]
+            for dst, hops in equal_cost_hops(links, src).items()
+        }
+        for src in links
+    }
+
+
+def most_specific_route(routes: dict, subnet: IPv4Network) -> list:
+    matches = [IPv4Network(net) for net in routes if subnet.subnet_of(IPv4Network(net))]
+    assert matches, f"no route covers {subnet}"
+    return routes[str(max(matches, key=lambda net: net.prefixlen))]
+
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_ecmp_lists_every_equal_cost_next_hop(name):
+    data = CONFIGS[name]
+    topo = build(data, True)
+    expected = expected_routes(data)
+    num_multipath = 0
+    for src, table in expected.items():
+        for dst, hops in table.items():
+            ips = [topo.link_to_fwd_ip[src][h] for h in hops]
+            assert topo.link_to_fwd_ips[src][dst] == ips
+            assert topo.link_to_fwd_ip[src][dst] == ips[0]
+            num_multipath += len(hops) > 1
+    assert num_multipath > 0
+
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_ecmp_container_routes(name):
+    data = CONFIGS[name]
+    topo = build(data, True)
+    routes = topo.container_routes()
+    for src, table in expected_routes(data).items():
+        fwd = topo.forwarders[src].name
+        for dst, hops in table.items():
+            subnet = topo.forwarders[dst].networks[0].subnet
+            ips = [topo.link_to_fwd_ip[src][h] for h in hops]
+            assert most_specific_route(routes[fwd], subnet) == ips
+
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_single_next_hop_without_ecmp(name):
+    data = CONFIGS[name]
+    single = build(data, False)
+    multi = build(data, True)
+    routes = single.container_routes()
+    for src, table in expected_routes(data).items():
+        fwd = single.forwarders[src].name
+        for dst, hops in table.items():
+            # The first equal-cost hop in the order of the node's links
+            ip = single.link_to_fwd_ip[src][hops[0]]
+            assert single.link_to_fwd_ip[src][dst] == ip
+            assert single.link_to_fwd_ips[src][dst] == [ip]
+            assert multi.link_to_fwd_ips[src][dst][0] == ip
+            subnet = single.forwarders[dst].networks[0].subnet
+            assert most_specific_route(routes[fwd], subnet) == [ip]
+
+
+def load_example() -> dict:
+    with open(ROOT / "example.json") as f:
+        return json.load(f)
+
+
+def longest_prefix_match(routes: dict, address) -> list:
+    matches = [IPv4Network(net) for net in routes if address in IPv4Network(net)]
+    assert matches, f"no route covers {address}"
+    return routes[str(max(matches, key=lambda net: net.prefixlen))]
+
+
+@pytest.mark.parametrize("ecmp", [False, True])
+@pytest.mark.parametrize("name", ["example", *CONFIGS])
+def test_aggregated_routes_forward_like_per_node_routes(name, ecmp):
+    data = load_example() if name == "example" else CONFIGS[name]
+    topo = build(data, ecmp)
+    routes = topo.container_routes()
+    for n, fwd in topo.forwarders.items():
+        # One route per destination node network, as before aggregation
+        for dst, forward_ips in topo.link_to_fwd_ips[n].items():
+            subnet = topo.forwarders[dst].networks[0].subnet
+            for address in (subnet.network_address, subnet.broadcast_address):
+                assert longest_prefix_match(routes[fwd.name], address) == forward_ips
+        assert len(routes[fwd.name]) <= len(topo.link_to_fwd_ips[n])
+
+
+def test_aggregate_routes_of_random_slots():
+    rng = np.random.default_rng(0)
+    block = IPv4Network("10.0.0.0/23")
+    hops = [("a",), ("b",), ("a", "b"), ("c",)]
+    for _ in range(50):
+        # Every slot forwards to one of a few next hops or is don't-care
+        slots = {
+            int(s): hops[int(h)]
+            for s, h in enumerate(rng.integers(-1, len(hops), 64))
+            if h >= 0
+        }
+        routes = {str(net): hop for net, hop in aggregate_routes(block, slots).items()}
+        assert len(routes) <= len(slots)
+        for slot, hop in slots.items():
+            address = block[slot * 8]
+            assert longest_prefix_match(routes, address) == hop
+
+
+def test_subnet_allocator():
+    allocator = SubnetAllocator(IPv4Network("10.0.0.0/24"), 5, set())
+    # 5 node networks need a block of 8 /29s
+    assert allocator.node_block == IPv4Network("10.0.0.0/26")
+    assert [str(allocator.node_subnet(i)) for i in (0, 4)] == [
+        "10.0.0.0/29",
+        "10.0.0.32/29",
+    ]
+    links = [allocator.link_subnet() for _ in range(4)]
+    assert [str(l) for l in links] == [
+        "10.0.0.64/29",
+        "10.0.0.72/29",
+        "10.0.0.80/29",
+        "10.0.0.88/29",
+    ]
+    assert not any(l.overlaps(allocator.node_block) for l in links)
+
+    # The /24 holds 32 /29s
+    for _ in range(32 - 8 - 4):
+        allocator.link_subnet()
+    with pytest.raises(Exception, match="Ran out of subnets"):
+        allocator.link_subnet()
+    with pytest.raises(Exception, match="too small for 64 nodes"):
+        SubnetAllocator(IPv4Network("10.0.0.0/24"), 64, set())
+
+
+def test_subnet_allocator_skips_reserved_subnets():
+    supernet = IPv4Network("10.0.0.0/24")
+    reserved = {IPv4Network("10.0.0.8/29"), IPv4Network("10.0.0.16/29")}
+    allocator = SubnetAllocator(supernet, 1, reserved)
+    assert allocator.node_block == IPv4Network("10.0.0.0/29")
+    assert str(allocator.link_subnet()) == "10.0.0.24/29"
+
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_networks_are_disjoint_29s_of_the_supernet(name):
+    topo = build(CONFIGS[name], False)
+    subnets = [net.subnet for net in topo.networks]
+    assert len(set(subnets)) == len(subnets)
+    for subnet in subnets:
+        assert subnet.prefixlen == 29
+        assert subnet.subnet_of(topo.supernet)
+    for fwd in topo.forwarders.values():
+        assert fwd.networks[0].subnet.subnet_of(topo.node_block)
@@ -1,18 +1,35 @@
 #!/usr/bin/env python
 import json
-import os
-import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
+from . import utils
 from .application import Application, application_registry
-from .topology import Node, Topology
-from .utils import print_to_file, print_to_script
+from .artifacts import Artifacts
+from .forwarder import load_forwarder
+from .graph import TopologyGraph
+from .topology import BACKENDS, FORWARDING_MODES, Network, Node, Topology, log
 
 
 template_dir = Path(__file__).parent / "templates"
-env = Environment(loader=FileSystemLoader(template_dir))
+
+
+def bytecode_cache() -> Optional[FileSystemBytecodeCache]:
+    # Compiling the templates takes about as long as rendering them for a
+    # small topology, so keep the compiled templates on disk for the next run.
+    try:
+        return FileSystemBytecodeCache(pattern="__toposim_%s.cache")
+    except RuntimeError:
+        # No usable temporary directory, compile the templates every time
+        return None
+
+
+env = Environment(
+    loader=FileSystemLoader(template_dir), bytecode_cache=bytecode_cache()
+)
 
 
 def template(fname: str, topo: Topology) -> str:
@@ -20,32 +37,53 @@ def template(fname: str, topo: Topology) -> str:
     return template_obj.render(topo=topo)
 
 
-def generate_docker_compose(app: Application, topo: Topology):
+def load_templates():
+    """Compile every template into `env`'s cache ahead of rendering"""
+    for name in env.list_templates():
+        env.get_template(name)
+
+
+def output_endpoints(output, endpoints: List[Tuple[Network, str]]):
+    # Compose connects networks by descending priority (and by name otherwise),
+    # give every network a priority so that interfaces are created in the order
+    # Topology.iface_names expects.
+    for i, (net, ip) in enumerate(endpoints):
+        output(f"      {net.name}:")
+        output(f"        ipv4_address: {ip}")
+        if len(endpoints) > 1:
+            output(f"        priority: {len(endpoints) - i}")
+
+
+def generate_docker_compose(app: Application, topo: Topology, out: Artifacts):
     # Set up docker-compose.yml. This could be a template as well, but getting
     # the whitespace to render correctly in templates is a bit painful, so it's
     # easier to leave this in python so that we can easily modify it.
-    with print_to_file("docker-compose.yml") as output:
+    with out.print_to_file("docker-compose.yml") as output:
         output("networks:")
-        for net in topo.networks:
+        for net in topo.bridge_networks:
             output(f"  {net.name}:")
             output(f"    driver: bridge")
             output(f"    ipam:")
             output(f"      config:")
-            output(f"        - subnet: {net.subnet16}.0.0/16")
-            output(f"          gateway: {net.subnet16}.0.1")
+            output(f"        - subnet: {net.subnet}")
+            output(f"          gateway: {net.gateway}")
         output("services:")
+        forwarder = topo.forwarder
         for p in topo.ports.values():
             output(f"  {p.name}:")
-            output(f"    image: ubuntu:latest")
-            output(f'    entrypoint: /bin/sh -c "sleep inf"')
+            output(f"    image: {forwarder.image}")
+            if forwarder.entrypoint:
+                output(f"    entrypoint: {forwarder.entrypoint}")
             output(f"    container_name: {p.name}")
             output(f"    hostname: {p.name}")
+            if forwarder.mem_limit:
+                output(f"    mem_limit: {forwarder.mem_limit}")
+            if forwarder.cpus:
+                output(f"    cpus: {forwarder.cpus}")
             output(f"    cap_add:")
             output(f'      - "NET_ADMIN"')
             output(f"    networks:")
-            for i, net in enumerate(p.networks):
-                output(f"      {net.name}:")
-                output(f"        ipv4_address: {p.ips[i]}")
+            output_endpoints(output, topo.bridge_endpoints(p))
 
         for i, node in enumerate(topo.nodes.values()):
             output(f"  {node.name}:")
@@ -59,8 +97,7 @@ def generate_docker_compose(app: Application, topo: Topology):
             if entrypt := app.entrypoint(node):
                 output(f"    entrypoint: {entrypt}")
             output(f"    networks:")
-            output(f"      {node.networks[0].name}:")
-            output(f"        ipv4_address: {node.ip}")
+            output_endpoints(output, topo.bridge_endpoints(node))
             if ports := app.ports(node):
                 output(f"    ports:")
                 for src, dst in ports.items():
@@ -85,41 +122,252 @@ def generate_docker_compose(app: Application, topo: Topology):
                     output(f"        external: false")
 
 
-def generate(prefix: str, filename: str, app_name: str | None, subnet32: str):
-    with open(filename) as f:
-        data = json.load(f)
-    os.makedirs(prefix, exist_ok=True)
-    shutil.copy(filename, f"{prefix}/topology.json")
-    os.chdir(prefix)
+def nexthop_spec(forward_ips: List[str], src: str = "") -> str:
+    """The `ip route` arguments to forward traffic to `forward_ips`"""
+    if len(forward_ips) == 1:
+        spec = f"via {forward_ips[0]}"
+    else:
+        spec = " ".join(f"nexthop via {ip}" for ip in forward_ips)
+    # `nexthop` takes every argument after it, so the source goes first
+    return f"src {src} {spec}" if src else spec
 
-    if app_name is None:
-        app_name = data["app"]
-        assert app_name in application_registry
-    app = application_registry[app_name]()
 
-    names = set(data["links"].keys())
+def veth_setup(topo: Topology, net: Network) -> Dict[str, List[str]]:
+    """`ip -batch` lines that address and bring up both ends of a veth link"""
+    iface = topo.veth_iface(net)
+    return {
+        container: [
+            f"addr add {ip}/{net.subnet.prefixlen} dev {iface}",
+            f"link set dev {iface} up",
+        ]
+        for container, ip in net.devices.items()
+    }
+
+
+def generate_networking(topo: Topology, out: Artifacts):
+    # Every container gets a route batch for `ip -batch` (plus iptables-restore
+    # rules and sysctls for forwarders, and addresses for veth links) so that
+    # setup_networking only needs to enter each namespace once.
+    links: Dict[str, List[str]] = {}
+    for net in topo.veth_networks:
+        for container, lines in veth_setup(topo, net).items():
+            links.setdefault(container, []).extend(lines)
+    for container, lines in links.items():
+        with out.print_to_file(f"networking/{container}.links") as output:
+            for line in lines:
+                output(line)
+
+    for container, routes in topo.container_routes().items():
+        src = topo.route_source(container)
+        with out.print_to_file(f"networking/{container}.routes") as output:
+            for dst, forward_ips in routes.items():
+                output(f"route add {dst} {nexthop_spec(forward_ips, src)}")
+
+    # Docker interfaces are eth<n>, veth links are v<network>
+    wildcards = ["eth+", "v+"] if topo.backend == "veth" else ["eth+"]
+    for fwd in topo.forwarders.values():
+        # Accept forwarded traffic on every interface of the forwarder. Match
+        # with wildcards so that interfaces connected by `toposim reconfigure`
+        # are covered as well.
+        with out.print_to_file(f"networking/{fwd.name}.iptables") as output:
+            output("*nat")
+            for wildcard in wildcards:
+                output(f"-A POSTROUTING -o {wildcard} -j ACCEPT")
+            output("COMMIT")
+            output("*filter")
+            for wildcard in wildcards:
+                output(f"-A FORWARD -o {wildcard} -j ACCEPT")
+            output("COMMIT")
+
+        sysctls = {}
+        if isinstance(fwd, Node):
+            # Application images are not set up to forward traffic
+            sysctls["net.ipv4.ip_forward"] = 1
+        if topo.ecmp:
+            sysctls["net.ipv4.fib_multipath_hash_policy"] = topo.ecmp_hash_policy
+        if sysctls:
+            with out.print_to_file(f"networking/{fwd.name}.sysctl") as output:
+                for key, value in sysctls.items():
+                    output(f"{key} = {value}")
+
+
+def generate_links(topo: Topology, out: Artifacts):
+    """Write which interface of every container faces each of its peers"""
+    links = topo.links()
+    out.write("links.json", json.dumps(links, indent=2))
+    with out.print_to_file("links.yml") as output:
+        for container, peers in links.items():
+            output(f"{container}:")
+            for peer, ifaces in peers.items():
+                output(f"  {peer}:")
+                for iface in ifaces:
+                    output(f"    - {iface}")
+
+
+def validate_config(data: dict) -> TopologyGraph:
+    """Check the structure of a config and build the graph of its links.
+
+    Raises an exception naming the offending key for the first problem found.
+    """
+    if not isinstance(data, dict):
+        raise Exception("The config must be a JSON object")
+    links = data.get("links")
+    if not isinstance(links, dict):
+        raise Exception('"links" must map every node to a list of its neighbors')
+    for n, neighbors in links.items():
+        if not isinstance(neighbors, list) or not all(
+            isinstance(l, str) for l in neighbors
+        ):
+            raise Exception(f'links["{n}"] must be a list of node names')
+    dummies = data.get("dummyNodes", [])
+    if not isinstance(dummies, list) or not all(isinstance(d, str) for d in dummies):
+        raise Exception('"dummyNodes" must be a list of node names')
+
+    if "app" in data and data["app"] not in application_registry:
+        raise Exception(f"Unknown app {data['app']}")
+    if not isinstance(data.get("ecmp", False), bool):
+        raise Exception('"ecmp" must be true or false')
+    choices = {
+        "ecmpHashPolicy": (0, 1, 2, 3),
+        "forwarding": FORWARDING_MODES,
+        "backend": BACKENDS,
+    }
+    for key, allowed in choices.items():
+        if key in data and data[key] not in allowed:
+            raise Exception(f"Invalid {key} {data[key]} (one of {list(allowed)})")
+    graph = TopologyGraph.from_links(links, dummies)
+
+    groups = data.get("groups", {})
+    if not isinstance(groups, dict):
+        raise Exception('"groups" must map group names to lists of node names')
+    for group, members in groups.items():
+        if not isinstance(members, list):
+            raise Exception(f'groups["{group}"] must be a list of node names')
+        for i, n in enumerate(members):
+            if n not in graph.ids:
+                raise Exception(f'groups["{group}"][{i}]: unknown node "{n}"')
+    return graph
+
+
+def build_topology(
+    prefix: str, data: dict, supernet: str, previous: Optional[Topology] = None
+) -> Topology:
+    graph = validate_config(data)
     nodes = {}
-    i = 0
     for k, links in data["links"].items():
-        for l in links:
-            if l not in names:
-                raise Exception(f"Unknown node {l}")
-            assert k in data["links"][l], f"malformed link {k} -> {l}"
         name = f"{prefix}_{k}"
-        print(name, name in data["dummyNodes"])
-        nodes[name] = Node(
-            name, [f"{prefix}_{l}" for l in links], k in data["dummyNodes"]
-        )
-        i += 1
+        is_dummy = bool(graph.is_dummy[graph.ids[k]])
+        if utils.verbose:
+            log(name, is_dummy)
+        nodes[name] = Node(name, [f"{prefix}_{l}" for l in links], is_dummy)
+
+    return Topology(
+        prefix,
+        nodes,
+        supernet=supernet,
+        ecmp=data.get("ecmp", False),
+        ecmp_hash_policy=data.get("ecmpHashPolicy", 1),
+        previous=previous,
+        forwarding=data.get("forwarding", "port"),
+        forwarder=load_forwarder(data.get("forwarder")),
+        backend=data.get("backend", "bridge"),
+    )
+
+
+def load_metadata(directory: str) -> dict:
+    """Load the arguments `generate` was called with to create `directory`"""
+    with open(Path(directory) / ".toposim.json") as f:
+        return json.load(f)
+
+
+def load_topology(directory: str) -> Topology:
+    """Rebuild the Topology of a directory created by `generate`.
 
-    topo = Topology(prefix, nodes, subnet32=subnet32)
+    If the cluster was reconfigured, every config in the history is replayed so
+    that reused networks keep the addresses they were created with.
+    """
+    metadata = load_metadata(directory)
+    topo = None
+    for config in metadata.get("history", ["topology.json"]):
+        with open(Path(directory) / config) as f:
+            data = json.load(f)
+        topo = build_topology(metadata["prefix"], data, metadata["supernet"], topo)
+    assert topo is not None
+    return topo
+
+
+def generate_artifacts(
+    prefix: str, data: dict, app_name: Optional[str], supernet: str
+) -> Artifacts:
+    """Generate every file of the directory for the config `data` in memory.
+
+    `prefix` is prepended to the name of every container. Nothing is written
+    to disk, so this can be called from many threads at once.
+    """
+    topo = build_topology(prefix, data, supernet)
+    if app_name is None:
+        if "app" not in data:
+            raise Exception('No app given, pass --app or set "app" in the config')
+        app_name = data["app"]
+    app = application_registry[app_name]()
+
+    out = Artifacts()
+    out.write("topology.json", json.dumps(data, indent=2) + "\n")
+    out.write(
+        ".toposim.json",
+        json.dumps({"prefix": prefix, "app": app_name, "supernet": supernet}),
+    )
 
     app.initialize(topo)
-    generate_docker_compose(app, topo)
-    app.extra(topo)
+    app.extra(topo, out)
+    generate_scripts(app, topo, out)
+    return out
+
+
+def generate(
+    prefix: str,
+    filename: str,
+    app_name: str | None,
+    subnet32: str,
+    supernet: Optional[str] = None,
+    directory: Optional[str] = None,
+):
+    """Generate the directory for the config in `filename` into `directory`
+    (default: `prefix`)"""
+    with open(filename) as f:
+        data = json.load(f)
+    if supernet is None:
+        supernet = f"{subnet32}.0.0.0/8"
+    out = generate_artifacts(prefix, data, app_name, supernet)
+    # Keep the config exactly as it was written
+    out.copy(filename, "topology.json")
+    out.write_to(directory or prefix)
+
+
+def _generate(kwargs: dict):
+    generate(**kwargs)
+
+
+def generate_many(configs: List[dict], jobs: Optional[int] = None):
+    """Call `generate(**kwargs)` for every kwargs in `configs` (e.g. for a
+    parameter sweep) from a pool of `jobs` processes.
+
+    The templates are compiled once before the workers are forked, so no
+    topology pays for compiling them.
+    """
+    load_templates()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(_generate, configs))
+
+
+def generate_scripts(app: Application, topo: Topology, out: Artifacts):
+    """Generate docker-compose.yml, the networking files and all scripts for
+    `topo` into `out`"""
+    generate_docker_compose(app, topo, out)
 
-    gitignore = ""
-    os.makedirs("tools", exist_ok=True)
+    gitignore = ".toposim.json\nnetworking/\nlinks.yml\nlinks.json\n"
+    generate_networking(topo, out)
+    generate_links(topo, out)
     templates = [
         "add_delay",
         "cleanup",
@@ -130,31 +378,33 @@ def generate(prefix: str, filename: str, app_name: str | None, subnet32: str):
         "tools/egress",
         "tools/get_mac",
         "tools/limit_bandwidth",
+        "tools/port_memory",
         "tools/run_in_ns",
         "tools/tcpdump",
     ]
     for t in templates:
         gitignore += f"{t}\n"
-        with print_to_script(t) as output:
+        with out.print_to_script(t) as output:
             output(template(f"{t}.sh", topo))
 
-    with print_to_script(f"to_geni.py") as output:
+    with out.print_to_script(f"to_geni.py") as output:
         gitignore += f"to_geni.py\n"
         output(template(f"to_geni.py", topo))
 
     # pause and setup_networking are special cases, since there might be
     # application specific behavior we need to inject
-    with print_to_script("setup_networking") as output:
+    with out.print_to_script("setup_networking") as output:
         gitignore += f"setup_networking\n"
         output(template("setup_networking.sh", topo))
         app.post_network_setup(topo, output)
         output("wait")
+        output('timing "application setup"')
 
-    with print_to_script("pause") as output:
+    with out.print_to_script("pause") as output:
         gitignore += f"pause\n"
         output(template("pause.sh", topo))
         app.post_pause(output)
 
     # Set all generated files to be untracked by git
-    with print_to_script(".gitignore") as output:
+    with out.print_to_script(".gitignore") as output:
         output(gitignore)
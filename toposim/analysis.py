@@ -0,0 +1,375 @@
+"""Structural metrics of a topology, computed before anything is emulated.
+
+Traffic is uniform all-to-all between the nodes that are not dummy nodes
+(endpoints): every endpoint sends one unit per second in total, split evenly
+between the other endpoints, and every pair splits its traffic evenly across
+all of its shortest paths. Shortest paths and link loads are computed with
+Brandes' algorithm, one BFS level at a time for a batch of sources at once, so
+every step is an operation on a (nodes x sources) array.
+
+SciPy is optional (`pip install toposim[analyze]`): with it, neighbor sums are
+sparse matrix products and the spectral bisection of large graphs uses its
+sparse eigensolver, otherwise NumPy is used for both.
+"""
+
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .graph import TopologyGraph
+
+try:
+    from scipy import sparse
+    from scipy.sparse import linalg as sparse_linalg
+except ImportError:
+    sparse = None
+
+# Upper bound on the elements of every (arcs x sources) array
+BATCH_ELEMENTS = 1 << 22
+# Larger graphs get a few eigenvectors of their Laplacian from a Krylov
+# subspace instead of all of them
+DENSE_EIGEN_NODES = 1000
+KRYLOV_STEPS = 200
+
+# Degrees up to which neighbor sums add one neighbor at a time
+SMALL_DEGREE = 32
+
+NeighborSum = Callable[[np.ndarray], np.ndarray]
+
+
+def _neighbor_sum(graph: TopologyGraph) -> NeighborSum:
+    """f(x)[v] = sum of x[u] over the neighbors u of v, for x of shape
+    (nodes x columns)"""
+    if sparse is not None:
+        adjacency = sparse.csr_matrix(
+            (np.ones(len(graph.indices)), graph.indices, graph.indptr),
+            shape=(graph.num_nodes, graph.num_nodes),
+        )
+        return lambda x: adjacency @ x
+
+    # Nodes with the same degree, and their neighbors as a (nodes x degree)
+    # array
+    degrees = graph.degrees()
+    classes = []
+    for degree in np.unique(degrees[degrees > 0]).tolist():
+        nodes = np.flatnonzero(degrees == degree)
+        arcs = graph.indptr[nodes][:, None] + np.arange(degree)
+        classes.append((nodes, graph.indices[arcs]))
+
+    def neighbor_sum(x: np.ndarray) -> np.ndarray:
+        out = np.zeros_like(x)
+        for nodes, neighbors in classes:
+            if neighbors.shape[1] > SMALL_DEGREE:
+                out[nodes] = x[neighbors].sum(axis=1)
+                continue
+            # Adding one neighbor of every node at a time only touches
+            # contiguous rows of x
+            acc = x[neighbors[:, 0]]
+            for column in neighbors.T[1:]:
+                acc += x[column]
+            out[nodes] = acc
+        return out
+
+    return neighbor_sum
+
+
+def shortest_paths(
+    graph: TopologyGraph,
+    sources: np.ndarray,
+    neighbor_sum: Optional[NeighborSum] = None,
+):
+    """Hop distance (-1 if unreachable) and number of shortest paths from every
+    source to every node, as (nodes x sources) arrays"""
+    neighbor_sum = neighbor_sum or _neighbor_sum(graph)
+    columns = np.arange(len(sources))
+    dist = np.full((graph.num_nodes, len(sources)), -1, np.int32)
+    sigma = np.zeros((graph.num_nodes, len(sources)))
+    dist[sources, columns] = 0
+    sigma[sources, columns] = 1
+    # Number of shortest paths to the nodes of the last level, 0 elsewhere
+    frontier = sigma.copy()
+    level = 0
+    while True:
+        reach = neighbor_sum(frontier)
+        new = (reach > 0) & (dist < 0)
+        if not new.any():
+            return dist, sigma
+        level += 1
+        dist[new] = level
+        frontier = np.where(new, reach, 0)
+        sigma += frontier
+
+
+def _arc_loads(
+    graph: TopologyGraph,
+    dist: np.ndarray,
+    sigma: np.ndarray,
+    targets: np.ndarray,
+    neighbor_sum: NeighborSum,
+) -> np.ndarray:
+    """Number of (source, target) pairs routed over every arc, where the sources
+    are the columns of `dist` and the targets are the nodes in `targets`"""
+    reached = dist >= 0
+    # (t(w) + delta(w)) / sigma(w), where t(w) = 1 if w is a target and delta(w)
+    # is the number of pairs whose paths continue after w (Brandes)
+    per_path = np.zeros_like(sigma)
+    for level in range(dist.max(), -1, -1):
+        at = dist == level
+        below = np.where(dist == level + 1, per_path, 0)
+        delta = sigma * neighbor_sum(below)
+        np.divide(targets[:, None] + delta, sigma, out=per_path, where=at & reached)
+
+    src = graph.sources()
+    downhill = dist[graph.indices] == dist[src] + 1
+    downhill &= reached[src]
+    flow = sigma[src] * per_path[graph.indices]
+    return np.where(downhill, flow, 0).sum(axis=1)
+
+
+def _krylov_vectors(laplacian: NeighborSum, n: int, k: int) -> np.ndarray:
+    """Approximate eigenvectors of the k smallest nonzero eigenvalues of a
+    Laplacian, from an orthonormal basis of a Krylov subspace that excludes the
+    constant vector"""
+    steps = min(n - 1, KRYLOV_STEPS)
+    ones = np.full(n, 1 / np.sqrt(n))
+    basis = np.zeros((steps, n))
+    image = np.zeros((steps, n))
+    v = np.random.default_rng(0).standard_normal(n)
+    size = 0
+    while size < steps:
+        # Orthogonalizing twice keeps the basis orthogonal in floating point
+        for _ in range(2):
+            v = v - ones * (ones @ v) - basis[:size].T @ (basis[:size] @ v)
+        norm = np.linalg.norm(v)
+        if norm < 1e-9:
+            break
+        basis[size] = v / norm
+        image[size] = laplacian(basis[size])
+        v = image[size]
+        size += 1
+    projected = basis[:size] @ image[:size].T
+    _, vectors = np.linalg.eigh((projected + projected.T) / 2)
+    return basis[:size].T @ vectors[:, :k]
+
+
+def _laplacian_vectors(
+    graph: TopologyGraph, neighbor_sum: NeighborSum, k: int
+) -> np.ndarray:
+    """Eigenvectors of the k smallest nonzero eigenvalues of the Laplacian of a
+    connected graph (the first is the Fiedler vector), as columns"""
+    n = graph.num_nodes
+    degrees = graph.degrees().astype(float)
+    if n <= DENSE_EIGEN_NODES:
+        laplacian = np.diag(degrees)
+        laplacian[graph.sources(), graph.indices] -= 1
+        _, vectors = np.linalg.eigh(laplacian)
+        return vectors[:, 1 : k + 1]
+    if sparse is not None:
+        adjacency = sparse.csr_matrix(
+            (np.ones(len(graph.indices)), graph.indices, graph.indptr), shape=(n, n)
+        )
+        # The smallest eigenvalues of the Laplacian are the largest of
+        # shift * I - L, which Lanczos finds quickly
+        shift = 2 * degrees.max()
+        shifted = sparse.diags(shift - degrees) + adjacency
+        values, vectors = sparse_linalg.eigsh(shifted, k=k + 1, which="LA")
+        return vectors[:, np.argsort(-values)[1:]]
+    return _krylov_vectors(lambda x: degrees * x - neighbor_sum(x[:, None])[:, 0], n, k)
+
+
+def _split(graph: TopologyGraph, endpoints: np.ndarray, vector: np.ndarray):
+    n = graph.num_nodes
+    side = np.zeros(n, bool)
+    order = np.argsort(vector, kind="stable")
+    # Split after the node that completes the first half of the endpoints (or
+    # of all nodes, if there are no endpoints)
+    balanced = endpoints if endpoints.any() else np.ones(n, bool)
+    counted = balanced[order]
+    split = np.searchsorted(np.cumsum(counted), counted.sum() // 2) + 1
+    side[order[:split]] = True
+
+    # Greedily move dummy nodes, or swap two endpoints (which keeps the halves
+    # balanced), while that cuts fewer links
+    src = graph.sources()
+    degrees = graph.degrees()
+    adjacency = graph.adjacency()
+    for _ in range(n):
+        across = np.bincount(src, side[src] != side[graph.indices], n)
+        gain = 2 * across - degrees
+        moves = np.where(balanced, -1, gain)
+        if moves.max() > 0:
+            best = int(np.argmax(moves))
+            side[best] = ~side[best]
+            continue
+        a = int(np.argmax(np.where(balanced & side, gain, -n)))
+        b = int(np.argmax(np.where(balanced & ~side, gain, -n)))
+        # A link between a and b stays cut
+        if gain[a] + gain[b] - 2 * (b in adjacency[a]) <= 0:
+            break
+        side[a], side[b] = False, True
+    return side
+
+
+def spectral_bisection(
+    graph: TopologyGraph,
+    endpoints: np.ndarray,
+    candidates: int = 3,
+    neighbor_sum: Optional[NeighborSum] = None,
+) -> np.ndarray:
+    """Split the nodes in two halves with the same number of endpoints (within
+    one) by the order of a Laplacian eigenvector, then refine the split by
+    moving nodes greedily. Returns whether every node is in the first half.
+
+    The number of links the halves cut is an upper bound on the bisection
+    width. Symmetric topologies have several eigenvectors for the Fiedler value, so
+    the split of each of the first `candidates` eigenvectors is tried and the
+    one that cuts the fewest links is kept.
+    """
+    n = graph.num_nodes
+    if n < 3:
+        return np.arange(n) < n // 2
+    neighbor_sum = neighbor_sum or _neighbor_sum(graph)
+    edges = graph.edges()
+    best = None
+    vectors = _laplacian_vectors(graph, neighbor_sum, min(candidates, n - 2))
+    for vector in vectors.T:
+        side = _split(graph, endpoints, vector)
+        cut = int((side[edges[:, 0]] != side[edges[:, 1]]).sum())
+        if best is None or cut < best[0]:
+            best = (cut, side)
+    return best[1]
+
+
+def analyze(
+    graph: TopologyGraph, groups: Optional[Dict[str, List[str]]] = None
+) -> dict:
+    """Diameter, hop counts, path diversity, link loads and bisection of the
+    topology under uniform all-to-all traffic between endpoints.
+
+    Loads are in units of the rate every endpoint injects, so a link with a
+    load above 1 saturates before the endpoints reach their full rate. With
+    `groups` (group name -> nodes), loads are also summarized separately for
+    the links inside groups and the links between them.
+    """
+    neighbor_sum = _neighbor_sum(graph)
+    endpoints = ~graph.is_dummy
+    sources = np.flatnonzero(endpoints)
+    num_endpoints = len(sources)
+    num_pairs = num_endpoints * (num_endpoints - 1)
+
+    arc_pairs = np.zeros(len(graph.indices))
+    hops = 0
+    diameter = 0
+    unreachable = 0
+    diversity_min = np.inf
+    diversity_sum = 0.0
+    multipath = 0
+    batch = max(1, BATCH_ELEMENTS // max(len(graph.indices), graph.num_nodes, 1))
+    for start in range(0, num_endpoints, batch):
+        chunk = sources[start : start + batch]
+        dist, sigma = shortest_paths(graph, chunk, neighbor_sum)
+        arc_pairs += _arc_loads(graph, dist, sigma, endpoints, neighbor_sum)
+
+        pair_dist = dist[sources]
+        pair_sigma = sigma[sources]
+        others = sources[:, None] != chunk[None, :]
+        found = others & (pair_dist >= 0)
+        unreachable += int((others & (pair_dist < 0)).sum())
+        hops += int(pair_dist[found].sum())
+        if found.any():
+            diameter = max(diameter, int(pair_dist[found].max()))
+            diversity_min = min(diversity_min, float(pair_sigma[found].min()))
+        diversity_sum += float(pair_sigma[found].sum())
+        multipath += int((pair_sigma[found] > 1).sum())
+
+    routed = num_pairs - unreachable
+    # Every endpoint injects 1, i.e. 1 / (num_endpoints - 1) per destination
+    arc_load = arc_pairs / max(num_endpoints - 1, 1)
+    edges = graph.edges()
+    forward = graph.arc_index(edges[:, 0], edges[:, 1])
+    backward = graph.arc_index(edges[:, 1], edges[:, 0])
+    link_load = np.maximum(arc_load[forward], arc_load[backward])
+    busiest = int(np.argmax(link_load)) if len(edges) else None
+    max_load = float(link_load.max()) if len(edges) else 0.0
+
+    side = spectral_bisection(graph, endpoints, neighbor_sum=neighbor_sum)
+    cut = int((side[edges[:, 0]] != side[edges[:, 1]]).sum())
+    # The bisection bandwidth a network with full bisection bandwidth needs
+    full = num_endpoints // 2
+
+    names = graph.names
+    report = {
+        "nodes": graph.num_nodes,
+        "endpoints": num_endpoints,
+        "links": graph.num_links,
+        "diameter": diameter if not unreachable else None,
+        "averageHops": hops / routed if routed else None,
+        "unreachablePairs": unreachable,
+        "pathDiversity": {
+            "min": diversity_min if routed else None,
+            "mean": diversity_sum / routed if routed else None,
+            "multipathPairs": multipath / routed if routed else None,
+        },
+        "linkLoad": {
+            "max": max_load,
+            "mean": float(link_load.mean()) if len(edges) else 0.0,
+            "busiest": (
+                [names[edges[busiest, 0]], names[edges[busiest, 1]]]
+                if busiest is not None
+                else None
+            ),
+            # The injection rate at which the busiest link saturates
+            "saturation": 1 / max_load if max_load else None,
+        },
+        "bisection": {
+            "links": cut,
+            "ratio": cut / full if full else None,
+            "side": [names[i] for i in np.flatnonzero(side)],
+        },
+        "perLink": [
+            {
+                "link": [names[u], names[v]],
+                "betweenness": float(arc_pairs[f] + arc_pairs[b]),
+                "load": [float(arc_load[f]), float(arc_load[b])],
+            }
+            for (u, v), f, b in zip(edges.tolist(), forward.tolist(), backward.tolist())
+        ],
+    }
+
+    if groups:
+        group_of = np.full(graph.num_nodes, -1)
+        for i, members in enumerate(groups.values()):
+            group_of[[graph.ids[n] for n in members]] = i
+        a, b = group_of[edges[:, 0]], group_of[edges[:, 1]]
+        between = (a != b) & (a >= 0) & (b >= 0)
+        report["groups"] = {
+            "count": len(groups),
+            "interGroupLinks": int(between.sum()),
+            "maxInterGroupLoad": float(link_load[between].max(initial=0)),
+            "maxIntraGroupLoad": float(link_load[~between].max(initial=0)),
+        }
+    return report
+
+
+def format_table(reports: Dict[str, dict]) -> str:
+    """One row per report, e.g. to compare candidate configs"""
+
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    width = max(len("config"), *map(len, reports))
+    lines = [
+        f"{'config':<{width}} {'nodes':>6} {'endpoints':>9} {'links':>6} "
+        f"{'diameter':>8} {'avg hops':>8} {'min paths':>9} {'mean paths':>10} "
+        f"{'max load':>8} {'saturation':>10} {'bisection':>9} {'ratio':>6}"
+    ]
+    for name, r in reports.items():
+        diversity, load, bisection = r["pathDiversity"], r["linkLoad"], r["bisection"]
+        lines.append(
+            f"{name:<{width}} {r['nodes']:>6} {r['endpoints']:>9} {r['links']:>6} "
+            f"{fmt(r['diameter'], '>8')} {fmt(r['averageHops'], '>8.3f')} "
+            f"{fmt(diversity['min'], '>9.0f')} {fmt(diversity['mean'], '>10.2f')} "
+            f"{load['max']:>8.3f} {fmt(load['saturation'], '>10.3f')} "
+            f"{bisection['links']:>9} {fmt(bisection['ratio'], '>6.2f')}"
+        )
+    return "\n".join(lines)
@@ -1,11 +1,9 @@
-import os
-import shutil
 from abc import abstractmethod
 from pathlib import Path
 from typing import Optional
 
+from .artifacts import Artifacts
 from .topology import Node, Topology
-from .utils import print_to_file, print_to_script
 
 
 appdata_dir = Path(__file__).parent / "appdata"
@@ -61,7 +59,8 @@ class Application(metaclass=RegisterApp):
         pass
 
     @abstractmethod
-    def extra(self, topo: Topology):
+    def extra(self, topo: Topology, out: Artifacts):
+        """Add application specific files to `out`"""
         pass
 
     @abstractmethod
@@ -133,19 +132,12 @@ class JanusGraphOnCassandra(Application):
     def ports(self, node: Node) -> Optional[dict[str, str]]:
         return None
 
-    def extra(self, topo: Topology):
-        shutil.copy(appdata_dir / "janusgraph/wait.sh", "wait.sh")
+    def extra(self, topo: Topology, out: Artifacts):
+        out.copy(appdata_dir / "janusgraph/wait.sh", "wait.sh")
+        for node in topo.nodes:
+            out.copy(appdata_dir / "janusgraph/etc_template", f"etc/{node}")
 
-        os.makedirs("etc", exist_ok=True)
-        try:
-            for node in topo.nodes:
-                shutil.copytree(
-                    appdata_dir / "janusgraph/etc_template", f"./etc/{node}"
-                )
-        except Exception:
-            pass
-
-        with print_to_file("graph.properties") as output:
+        with out.print_to_file("graph.properties") as output:
             output(f"storage.backend = cql")
             output(f"storage.hostname = {self.seeds}")
             output(f"storage.cql.local-datacenter = Mars")
@@ -195,15 +187,10 @@ class TigerGraph(Application):
     def ports(self, node: Node) -> Optional[dict[str, str]]:
         return None
 
-    def extra(self, topo: Topology):
-        try:
-            os.mkdir("data")
-        except FileExistsError:
-            pass
-
-        shutil.copy(appdata_dir / "tigergraph/setup-tg.sh", "data/setup-tg.sh")
-        shutil.copy(self.license, "data/license")
-        with print_to_script("setup-cluster.sh") as output:
+    def extra(self, topo: Topology, out: Artifacts):
+        out.copy(appdata_dir / "tigergraph/setup-tg.sh", "data/setup-tg.sh")
+        out.copy(self.license, "data/license")
+        with out.print_to_script("setup-cluster.sh") as output:
             node_names = list(topo.nodes.keys())
             for name in node_names:
                 output(
@@ -280,17 +267,9 @@ class Galois(Application):
     def ports(self, node: Node) -> Optional[dict[str, str]]:
         return None
 
-    def extra(self, topo: Topology):
-        shutil.copy(appdata_dir / "galois/cloudlab_setup.sh", "cloudlab_setup.sh")
-
-        try:
-            os.mkdir("data")
-        except FileExistsError:
-            pass
-
-        with open("data/hostfile", "w") as f:
-            for node in topo.nodes.values():
-                f.write(node.ip + "\n")
+    def extra(self, topo: Topology, out: Artifacts):
+        out.copy(appdata_dir / "galois/cloudlab_setup.sh", "cloudlab_setup.sh")
+        out.write("data/hostfile", "".join(n.ip + "\n" for n in topo.nodes.values()))
 
     def post_network_setup(self, topo: Topology, output):
         pass
@@ -340,8 +319,8 @@ class Cockroach(Application):
         idx = self.node_ips.index(node.ip)
         return {f"{26257 + idx}": f"{26257 + idx}", f"{8080 + idx}": f"{8080 + idx}"}
 
-    def extra(self, topo: Topology):
-        with print_to_script("setup-cluster.sh") as output:
+    def extra(self, topo: Topology, out: Artifacts):
+        with out.print_to_script("setup-cluster.sh") as output:
             output(
                 f"docker exec -it {self.node_names[0]} ./cockroach --host={self.node_ips[0]}:26357 init --insecure"
             )
@@ -409,8 +388,8 @@ class Spark(Application):
                 if node.name == n.name:
                     return {f"{8081 + i}": "8081"}
 
-    def extra(self, topo: Topology):
-        with print_to_script("setup-cluster.sh") as output:
+    def extra(self, topo: Topology, out: Artifacts):
+        with out.print_to_script("setup-cluster.sh") as output:
             for node in topo.nodes.values():
                 if node.name == self.master_name:
                     output(
@@ -467,20 +446,10 @@ class Powerlyra(Application):
     def ports(self, node: Node) -> Optional[dict[str, str]]:
         return None
 
-    def extra(self, topo: Topology):
-        try:
-            os.mkdir("sgp")
-        except FileExistsError:
-            pass
-
-        with open("sgp/hostfile", "w") as f:
-            for node in topo.nodes.values():
-                f.write(node.ip + "\n")
-                
-        shutil.copytree(appdata_dir / "powerlyra/parameters", "sgp/parameters", dirs_exist_ok=True)
-        shutil.copytree(appdata_dir / "powerlyra/powerlyra", "sgp/powerlyra", dirs_exist_ok=True)
-        shutil.copytree(appdata_dir / "powerlyra/scripts", "sgp/scripts", dirs_exist_ok=True)
-        shutil.copytree(appdata_dir / "powerlyra/datasets", "sgp/datasets", dirs_exist_ok=True)
+    def extra(self, topo: Topology, out: Artifacts):
+        out.write("sgp/hostfile", "".join(n.ip + "\n" for n in topo.nodes.values()))
+        for d in ["parameters", "powerlyra", "scripts", "datasets"]:
+            out.copy(appdata_dir / "powerlyra" / d, f"sgp/{d}")
 
     def post_network_setup(self, topo: Topology, output):
         pass
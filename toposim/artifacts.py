@@ -0,0 +1,143 @@
+"""Generated files of a topology, kept in memory until they are written out.
+
+Generating used to chdir into the output directory and write every file as it
+was produced, so only one topology could be generated per process at a time.
+Everything is now collected into an `Artifacts` bundle first, which can be
+inspected or compared with another bundle, and written to any directory.
+"""
+
+import io
+import os
+import shutil
+import stat
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Sequence, Set, Union
+
+from . import utils
+
+EXECUTABLE = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+
+
+class Artifacts:
+    """Files to create, by path relative to the output directory"""
+
+    # path -> content
+    files: Dict[str, str]
+    # paths of files (in `files`) that are scripts
+    executable: Set[str]
+    # path -> file or directory to copy there (e.g. from appdata)
+    copies: Dict[str, Path]
+
+    def __init__(self):
+        self.files = {}
+        self.executable = set()
+        self.copies = {}
+
+    def write(self, path: str, content: str, executable: bool = False):
+        self.files[path] = content
+        self.copies.pop(path, None)
+        if executable:
+            self.executable.add(path)
+        else:
+            self.executable.discard(path)
+
+    def copy(self, src: Union[str, Path], path: str):
+        """Copy the file or directory `src` to `path` when written"""
+        self.copies[path] = Path(src)
+        self.files.pop(path, None)
+        self.executable.discard(path)
+
+    @contextmanager
+    def print_to_file(self, path: str, executable: bool = False):
+        # Buffer the whole file, since large topologies generate hundreds of
+        # thousands of lines
+        buf = io.StringIO()
+
+        def output(*args, **kwargs):
+            if utils.verbose:
+                print(*args, **kwargs)
+            print(*args, **kwargs, file=buf)
+
+        yield output
+        self.write(path, buf.getvalue(), executable)
+
+    @contextmanager
+    def print_to_script(self, path: str):
+        with self.print_to_file(path, executable=True) as output:
+            output("#!/bin/bash")
+            yield output
+
+    def paths(self) -> List[str]:
+        return sorted([*self.files, *self.copies])
+
+    def changed(self, other: "Artifacts") -> List[str]:
+        """Paths that are only in one of the bundles or differ between them"""
+        return [
+            path
+            for path in sorted(set(self.paths()) | set(other.paths()))
+            if self.files.get(path) != other.files.get(path)
+            or self.copies.get(path) != other.copies.get(path)
+            or (path in self.executable) != (path in other.executable)
+        ]
+
+    def _write_files(self, directory: Path, replace: bool):
+        for path, content in self.files.items():
+            dst = directory / path
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            # Write next to the destination and rename over it, so that a file
+            # is never seen half written
+            tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex}") if replace else dst
+            with open(tmp, "w") as f:
+                f.write(content)
+            if path in self.executable:
+                os.chmod(tmp, os.stat(tmp).st_mode | EXECUTABLE)
+            if tmp != dst:
+                os.replace(tmp, dst)
+        for path, src in self.copies.items():
+            dst = directory / path
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            if src.is_dir():
+                shutil.copytree(src, dst, dirs_exist_ok=True)
+            elif replace:
+                tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex}")
+                shutil.copy(src, tmp)
+                os.replace(tmp, dst)
+            else:
+                shutil.copy(src, dst)
+
+    def _prune(self, directory: Path, subdirs: Sequence[str]):
+        keep = set(self.paths())
+        for subdir in subdirs:
+            for path in sorted((directory / subdir).rglob("*")):
+                rel = path.relative_to(directory)
+                if path.is_file() and not any(
+                    p.as_posix() in keep for p in [rel, *rel.parents]
+                ):
+                    path.unlink()
+
+    def write_to(self, directory: Union[str, Path], prune: Sequence[str] = ()):
+        """Write every file into `directory`.
+
+        A new directory is populated under a temporary name and renamed into
+        place, so it only appears once it is complete. In an existing directory
+        every file is replaced atomically and other files are left alone,
+        except for files under the subdirectories in `prune` that are not in
+        the bundle, which are removed first.
+        """
+        directory = Path(directory)
+        if directory.exists():
+            self._prune(directory, prune)
+            self._write_files(directory, replace=True)
+            return
+
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        tmp = directory.with_name(f".{directory.name}.{uuid.uuid4().hex}")
+        tmp.mkdir()
+        try:
+            self._write_files(tmp, replace=False)
+            os.rename(tmp, directory)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
@@ -0,0 +1,272 @@
+"""Bring a generated cluster up or down without docker compose.
+
+`docker compose up` and the generated `cleanup` script issue one request (or
+one CLI process) per container with no bound on concurrency, which floods the
+daemon for large topologies, and networks are removed one at a time. This
+drives the docker API directly from a bounded pool of workers: networks are
+created (or removed) in parallel, ports are started before the nodes that send
+traffic through them, and nodes are started in waves that respect
+`Application.depends_on`.
+"""
+
+import shlex
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, List, Tuple
+
+from . import load_metadata, load_topology
+from .application import application_registry
+from .docker import Docker, DockerError, docker_network_name, project_name
+from .topology import Network, Node, Port
+
+# Units accepted by compose's mem_limit
+_SIZE_UNITS = {"b": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+
+
+def parse_size(size: str) -> int:
+    size = size.strip().lower().removesuffix("b") or "0"
+    if size[-1] in _SIZE_UNITS:
+        return int(float(size[:-1]) * _SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+class Cluster:
+    def __init__(self, directory: str, jobs: int):
+        self.directory = Path(directory).resolve()
+        metadata = load_metadata(directory)
+        self.topo = load_topology(directory)
+        self.app = application_registry[metadata["app"]]()
+        self.app.initialize(self.topo)
+        self.project = project_name(self.topo)
+        self.docker = Docker()
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+        self.errors: List[str] = []
+        self.timings: List[Tuple[str, float]] = []
+
+    def run(self, name: str, fn: Callable, items: Iterable):
+        """Run `fn` on every item in parallel as one timed phase"""
+
+        def call(item):
+            try:
+                fn(item)
+            except DockerError as e:
+                self.errors.append(str(e))
+
+        start = time.perf_counter()
+        list(self.pool.map(call, items))
+        self.timings.append((name, time.perf_counter() - start))
+
+    def node_waves(self) -> List[List[Node]]:
+        """Group nodes so that every node comes after the node it depends on"""
+        remaining = dict(self.topo.nodes)
+        started: set = set()
+        waves = []
+        while remaining:
+            wave = [
+                n
+                for n in remaining.values()
+                if (dep := self.app.depends_on(n)) is None
+                or dep in started
+                or dep not in self.topo.nodes
+            ]
+            if not wave:
+                raise Exception(f"Circular depends_on between {list(remaining)}")
+            for n in wave:
+                del remaining[n.name]
+            started |= {n.name for n in wave}
+            waves.append(wave)
+        return waves
+
+    def labels(self, service: str) -> dict:
+        return {
+            "com.docker.compose.project": self.project,
+            "com.docker.compose.service": service,
+            "com.docker.compose.oneoff": "False",
+            "com.docker.compose.container-number": "1",
+        }
+
+    def bind(self, src: str, dst: str) -> str:
+        # Paths are relative to the generated directory, anything else is a
+        # named volume (see should_create_volumes)
+        if src.startswith(".") or src.startswith("/"):
+            return f"{(self.directory / src).resolve()}:{dst}"
+        return f"{self.project}_{src}:{dst}"
+
+    def container_config(
+        self, name: str, image: str, endpoints: List[Tuple[Network, str]]
+    ) -> dict:
+        first, ip = endpoints[0]
+        net = docker_network_name(self.topo, first)
+        return {
+            "Image": image,
+            "Hostname": name,
+            "Labels": self.labels(name),
+            "HostConfig": {"CapAdd": ["NET_ADMIN"], "NetworkMode": net},
+            "NetworkingConfig": {
+                "EndpointsConfig": {net: {"IPAMConfig": {"IPv4Address": ip}}}
+            },
+        }
+
+    def port_config(self, p: Port) -> dict:
+        forwarder = self.topo.forwarder
+        config = self.container_config(
+            p.name, forwarder.image, self.topo.bridge_endpoints(p)
+        )
+        host_config = config["HostConfig"]
+        if forwarder.mem_limit:
+            host_config["Memory"] = parse_size(forwarder.mem_limit)
+        if forwarder.cpus:
+            host_config["NanoCpus"] = int(forwarder.cpus * 1e9)
+        if forwarder.entrypoint:
+            config["Entrypoint"] = shlex.split(forwarder.entrypoint)
+        return config
+
+    def node_config(self, node: Node) -> dict:
+        app = self.app
+        config = self.container_config(
+            node.name, app.image(node), self.topo.bridge_endpoints(node)
+        )
+        host_config = config["HostConfig"]
+        if mem_limit := app.mem_limit(node):
+            host_config["Memory"] = parse_size(mem_limit)
+        if cpus := app.cpus(node):
+            host_config["NanoCpus"] = int(cpus * 1e9)
+        if entrypt := app.entrypoint(node):
+            config["Entrypoint"] = shlex.split(entrypt)
+        if ports := app.ports(node):
+            config["ExposedPorts"] = {f"{dst}/tcp": {} for dst in ports.values()}
+            host_config["PortBindings"] = {
+                f"{dst}/tcp": [{"HostPort": str(src)}] for src, dst in ports.items()
+            }
+        host_config["Binds"] = [
+            self.bind(src, dst) for src, dst in app.volumes(node).items()
+        ]
+        if env := app.environment(node):
+            config["Env"] = [f"{key}={val}" for key, val in env.items()]
+        return config
+
+    def create_network(self, net: Network):
+        self.docker.request(
+            "POST",
+            "/networks/create",
+            {
+                "Name": docker_network_name(self.topo, net),
+                "Driver": "bridge",
+                "CheckDuplicate": True,
+                "IPAM": {
+                    "Config": [{"Subnet": str(net.subnet), "Gateway": net.gateway}]
+                },
+                "Labels": {
+                    "com.docker.compose.project": self.project,
+                    "com.docker.compose.network": net.name,
+                },
+            },
+            ok=(409,),
+        )
+
+    def start_container(
+        self, name: str, config: dict, endpoints: List[Tuple[Network, str]]
+    ):
+        created = self.docker.request(
+            "POST", "/containers/create", config, params={"name": name}, ok=(409,)
+        )
+        # Containers can only be created with one network, connect the rest
+        # before starting so that the interfaces are in order. An existing
+        # container (409) is already connected.
+        if created is not None:
+            for net, ip in endpoints[1:]:
+                self.docker.request(
+                    "POST",
+                    f"/networks/{docker_network_name(self.topo, net)}/connect",
+                    {
+                        "Container": name,
+                        "EndpointConfig": {"IPAMConfig": {"IPv4Address": ip}},
+                    },
+                )
+        self.docker.request("POST", f"/containers/{name}/start", ok=(304,))
+
+    def start_port(self, p: Port):
+        self.start_container(p.name, self.port_config(p), self.topo.bridge_endpoints(p))
+
+    def start_node(self, node: Node):
+        self.start_container(
+            node.name, self.node_config(node), self.topo.bridge_endpoints(node)
+        )
+
+    def pull_image(self, image: str):
+        if not self.docker.image_exists(image):
+            self.docker.pull(image)
+
+    def remove_container(self, name: str):
+        self.docker.request(
+            "DELETE", f"/containers/{name}", params={"force": "true"}, ok=(404,)
+        )
+
+    def remove_network(self, net: Network):
+        self.docker.request(
+            "DELETE", f"/networks/{docker_network_name(self.topo, net)}", ok=(404,)
+        )
+
+    def remove_volume(self, name: str):
+        self.docker.request("DELETE", f"/volumes/{self.project}_{name}", ok=(404,))
+
+    def up(self, pull: bool = True):
+        ports = list(self.topo.ports.values())
+        phases: List[Tuple[str, Callable, Iterable]] = []
+        if pull:
+            images = {self.app.image(n) for n in self.topo.nodes.values()}
+            if ports:
+                images.add(self.topo.forwarder.image)
+            phases.append(("pull images", self.pull_image, sorted(images)))
+        phases.append(
+            ("create networks", self.create_network, self.topo.bridge_networks)
+        )
+        phases.append(("start ports", self.start_port, ports))
+        for i, wave in enumerate(self.node_waves()):
+            phases.append((f"start nodes ({i})", self.start_node, wave))
+        for phase in phases:
+            self.run(*phase)
+            # Later phases depend on everything before them
+            if self.errors:
+                break
+
+    def down(self, volumes: bool = False):
+        for i, wave in reversed(list(enumerate(self.node_waves()))):
+            self.run(
+                f"remove nodes ({i})", self.remove_container, [n.name for n in wave]
+            )
+        ports = [p.name for p in self.topo.ports.values()]
+        self.run("remove ports", self.remove_container, ports)
+        self.run("remove networks", self.remove_network, self.topo.bridge_networks)
+        if volumes and self.app.should_create_volumes():
+            names = {
+                src for n in self.topo.nodes.values() for src in self.app.volumes(n)
+            }
+            self.run("remove volumes", self.remove_volume, sorted(names))
+
+    def report(self) -> bool:
+        self.pool.shutdown()
+        for e in self.errors:
+            print(e, file=sys.stderr)
+        for name, elapsed in self.timings:
+            print(f"{name:<20} {elapsed:.3f}s", file=sys.stderr)
+        print(
+            f"{self.docker.num_requests} requests ({self.docker.num_retries} retries) "
+            f"in {sum(t for _, t in self.timings):.3f}s ({len(self.errors)} errors)",
+            file=sys.stderr,
+        )
+        return len(self.errors) == 0
+
+
+def up(directory: str, jobs: int = 16, pull: bool = True) -> bool:
+    cluster = Cluster(directory, jobs)
+    cluster.up(pull)
+    return cluster.report()
+
+
+def down(directory: str, jobs: int = 16, volumes: bool = False) -> bool:
+    cluster = Cluster(directory, jobs)
+    cluster.down(volumes)
+    return cluster.report()
@@ -0,0 +1,284 @@
+"""Online control of the optical circuit switches (OCS) of an OCSTopology.
+
+Traffic matrices are consumed as the heatmap tool writes them (or as they
+arrive over a socket). The controller keeps an exponentially weighted average
+of the traffic between every pair of groups per interval, which is updated in
+O(G^2) per matrix, and after every matrix decides the state the switches
+should be in for the next interval. It only switches if the new state is
+cheaper for the average traffic by more than a hysteresis margin, so that
+short bursts do not flip switches back and forth. Every decision has a latency budget: with too
+many states to compare, the state is improved by flipping one switch at a
+time until no flip helps or the budget runs out.
+
+Replaying stored matrices measures the latency of the decisions and compares
+the cost of the decisions (in effect from the next interval) with staying
+static and with the offline optimum of plan_schedule.
+"""
+
+import os
+import socket
+import time
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .ocs import (
+    MAX_STATES,
+    OCSTopology,
+    Schedule,
+    evaluate_schedule,
+    plan_schedule,
+    popcount,
+)
+
+
+@dataclass
+class Decision:
+    # Timestep of the last matrix the decision is based on
+    timestep: int
+    # State the switches should be in from the next timestep on
+    state: int
+    # Switches flipped from the previous state
+    flips: int
+    # Seconds taken to decide
+    latency: float
+    # Cost of the average traffic in the previous and in the new state
+    previous_cost: float
+    cost: float
+
+    def report(self, topo: OCSTopology) -> dict:
+        return {
+            "timestep": self.timestep,
+            "state": self.state,
+            "bar": topo.bar(self.state),
+            "flips": self.flips,
+            "latency": self.latency,
+            "previousCost": self.previous_cost,
+            "cost": self.cost,
+        }
+
+
+class Controller:
+    topo: OCSTopology
+    # Weight of the traffic of every older interval
+    decay: float
+    # Fraction of the current cost a new state has to save to switch to it
+    hysteresis: float
+    # Cost of flipping a switch, counted against what a new state saves. Like
+    # the per-flip cost of plan_schedule, it is in the unit of the cost of one
+    # interval of traffic (bytes times hops).
+    switch_cost: float
+    # Seconds every decision may take
+    budget: float
+
+    state: int
+    # Exponentially weighted average of the traffic of every interval, so
+    # that its cost is the cost of one interval whatever the half-life
+    traffic: np.ndarray
+    timestep: int
+
+    def __init__(
+        self,
+        topo: OCSTopology,
+        half_life: float = 1.0,
+        hysteresis: float = 0.05,
+        switch_cost: float = 0.0,
+        budget: float = 0.1,
+        initial: int = 0,
+    ):
+        """`half_life` is the number of intervals after which the traffic of
+        an interval counts half (0 for only the last interval)"""
+        if half_life < 0 or hysteresis < 0 or budget <= 0:
+            raise Exception("half_life and hysteresis must be >= 0, budget > 0")
+        self.topo = topo
+        self.decay = 0.5 ** (1 / half_life) if half_life > 0 else 0.0
+        self.hysteresis = hysteresis
+        self.switch_cost = switch_cost
+        self.budget = budget
+        self.state = initial
+        n = topo.num_groups
+        self.traffic = np.zeros((n, n))
+        self.timestep = -1
+        # Hop counts of every state, if they can be enumerated
+        self._hops = topo.hops() if topo.num_states <= MAX_STATES else None
+        self._flips = np.int64(1) << np.arange(len(topo.switches) - 1, -1, -1)
+
+    def _cost(self, states: np.ndarray) -> np.ndarray:
+        hops = self.topo.state_hops(states)
+        return np.einsum("sd,ksd->k", self.traffic, hops)
+
+    def _best(self, deadline: float) -> Tuple[int, float, float]:
+        """The state with the lowest cost for the average traffic plus the cost
+        of flipping to it, its traffic cost and the cost of the current
+        state"""
+        if self._hops is not None:
+            costs = np.einsum("sd,ksd->k", self.traffic, self._hops)
+            states = np.arange(len(costs))
+            net = costs + self.switch_cost * popcount(states ^ self.state)
+            best = int(net.argmin())
+            return best, float(costs[best]), float(costs[self.state])
+        state = self.state
+        current = cost = float(self._cost(np.array([state]))[0])
+        net = cost
+        while time.perf_counter() < deadline:
+            neighbors = state ^ self._flips
+            costs = self._cost(neighbors)
+            neighbor_net = costs + self.switch_cost * popcount(neighbors ^ self.state)
+            best = int(neighbor_net.argmin())
+            if neighbor_net[best] >= net:
+                break
+            state, cost, net = (
+                int(neighbors[best]),
+                float(costs[best]),
+                float(neighbor_net[best]),
+            )
+        return state, cost, current
+
+    def update(self, matrix: np.ndarray) -> Decision:
+        """Add the traffic matrix of the next interval and decide the state of
+        the switches for the interval after it"""
+        start = time.perf_counter()
+        n = self.topo.num_groups
+        self.traffic *= self.decay
+        self.traffic += (1 - self.decay) * matrix[:n, :n]
+        self.timestep += 1
+
+        best, cost, current = self._best(start + self.budget)
+        previous = self.state
+        saved = current - cost - self.switch_cost * popcount(best ^ previous)
+        if best != previous and saved > self.hysteresis * current:
+            self.state = best
+        else:
+            cost = current
+        return Decision(
+            self.timestep,
+            self.state,
+            int(popcount(self.state ^ previous)),
+            time.perf_counter() - start,
+            current,
+            cost,
+        )
+
+
+def _parse(lines: List[str]) -> np.ndarray:
+    return np.array([[float(x) for x in line.split()] for line in lines], ndmin=2)
+
+
+def tail_matrices(
+    directory: str, poll: float = 1.0, timeout: Optional[float] = None
+) -> Iterator[np.ndarray]:
+    """Matrices of `directory` in order as the heatmap tool writes them.
+
+    matrix-ts<i>.txt is read once matrix-ts<i+1>.txt exists or its size has
+    not changed for `poll` seconds. Stops after `timeout` seconds without a
+    new matrix (never by default).
+    """
+    t = 0
+    last_size = -1
+    waited = 0.0
+    while True:
+        path = os.path.join(directory, f"matrix-ts{t}.txt")
+        following = os.path.join(directory, f"matrix-ts{t + 1}.txt")
+        size = os.path.getsize(path) if os.path.exists(path) else -1
+        if size > 0 and (os.path.exists(following) or size == last_size):
+            yield np.loadtxt(path, ndmin=2)
+            t += 1
+            last_size = -1
+            waited = 0.0
+            continue
+        if timeout is not None and waited >= timeout:
+            return
+        last_size = size
+        time.sleep(poll)
+        waited += poll
+
+
+def socket_matrices(address: Tuple[str, int]) -> Iterator[np.ndarray]:
+    """Matrices sent to a TCP server at `address`, one connection after the
+    other: rows of whitespace-separated numbers, with an empty line after
+    every matrix"""
+    with socket.create_server(address) as server:
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile("r") as f:
+                rows: List[str] = []
+                for line in f:
+                    if line.strip():
+                        rows.append(line)
+                    elif rows:
+                        yield _parse(rows)
+                        rows = []
+                if rows:
+                    yield _parse(rows)
+
+
+@dataclass
+class Replay:
+    decisions: List[Decision]
+    # Switch states in effect in every timestep
+    controller: Schedule
+    static: Schedule
+    optimal: Schedule
+
+    def report(self, topo: OCSTopology) -> dict:
+        latency = np.array([d.latency for d in self.decisions])
+        return {
+            "timesteps": len(self.decisions),
+            "switches": sum(d.flips > 0 for d in self.decisions),
+            "meanLatency": float(latency.mean()) if len(latency) else 0.0,
+            "maxLatency": float(latency.max(initial=0)),
+            "cost": self.controller.cost,
+            "staticCost": self.static.cost,
+            "optimalCost": self.optimal.cost,
+            "flips": int(self.controller.flips.sum()),
+            "optimalFlips": int(self.optimal.flips.sum()),
+            "decisions": [d.report(topo) for d in self.decisions],
+        }
+
+
+def replay(
+    controller: Controller, matrices: np.ndarray, downtime: float = 0.0
+) -> Replay:
+    """Feed (T x G x G) matrices to the controller one at a time. The decision
+    taken after timestep t is in effect from timestep t + 1, while the
+    offline optimum knows every matrix in advance. `downtime` is the fraction
+    of an interval flipping switches takes."""
+    topo = controller.topo
+    initial = controller.state
+    n = topo.num_groups
+    matrices = np.asarray(matrices)[:, :n, :n]
+    decisions = [controller.update(m) for m in matrices]
+    in_effect = np.array([initial] + [d.state for d in decisions], np.int64)
+    in_effect = in_effect[: len(matrices)]
+
+    states = np.union1d(topo.candidate_states(matrices), in_effect)
+    costs = topo.costs(matrices, states)
+    args = (controller.switch_cost, downtime, initial)
+    return Replay(
+        decisions,
+        evaluate_schedule(costs, states, in_effect, *args),
+        evaluate_schedule(costs, states, np.full(len(matrices), initial), *args),
+        plan_schedule(costs, states, *args),
+    )
+
+
+def format_replay(result: Replay) -> str:
+    lines = [f"{'strategy':<12} {'cost':>16} {'flips':>6} {'vs optimal':>10}"]
+    for name, schedule in (
+        ("controller", result.controller),
+        ("static", result.static),
+        ("optimal", result.optimal),
+    ):
+        over = schedule.cost / result.optimal.cost - 1 if result.optimal.cost else 0
+        lines.append(
+            f"{name:<12} {schedule.cost:>16.0f} {schedule.flips.sum():>6} "
+            f"{100 * over:>9.2f}%"
+        )
+    latency = np.array([d.latency for d in result.decisions])
+    mean = latency.mean() if len(latency) else 0.0
+    lines.append(
+        f"decision latency: mean {1000 * mean:.3f} ms, "
+        f"max {1000 * latency.max(initial=0):.3f} ms"
+    )
+    return "\n".join(lines)
@@ -0,0 +1,162 @@
+"""A minimal client for the docker engine API over its Unix socket.
+
+Forking the docker CLI for every container costs a process and a new API
+connection per call. This talks HTTP to the daemon directly, keeps one
+connection per thread and retries requests that fail because the daemon is
+overloaded.
+"""
+
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from typing import Any, Optional
+from urllib.parse import quote, urlencode
+
+from .topology import Network, Topology
+
+
+def project_name(topo: Topology) -> str:
+    return topo.prefix.lower()
+
+
+def docker_network_name(topo: Topology, net: Network) -> str:
+    # Same name docker compose gives the network (see cleanup.sh)
+    return f"{project_name(topo)}_{net.name}".lower()
+
+
+def socket_path() -> str:
+    host = os.environ.get("DOCKER_HOST", "unix:///var/run/docker.sock")
+    if not host.startswith("unix://"):
+        raise Exception(f"Only unix sockets are supported (DOCKER_HOST={host})")
+    return host.removeprefix("unix://")
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class DockerError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+# Statuses returned when the daemon is too busy to handle a request
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class Docker:
+    """Thread-safe docker API client. Every thread gets its own connection."""
+
+    def __init__(self, retries: int = 5, backoff: float = 0.1, timeout: float = 300):
+        self.path = socket_path()
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._local = threading.local()
+        # Requests are counted from many threads
+        self._count_lock = threading.Lock()
+        self.num_requests = 0
+        self.num_retries = 0
+
+    def _connection(self) -> UnixHTTPConnection:
+        if getattr(self._local, "conn", None) is None:
+            self._local.conn = UnixHTTPConnection(self.path, self.timeout)
+        return self._local.conn
+
+    def _reset(self):
+        if getattr(self._local, "conn", None) is not None:
+            self._local.conn.close()
+            self._local.conn = None
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[Any] = None,
+        params: Optional[dict] = None,
+        ok: tuple = (),
+    ) -> Any:
+        """Send a request and return the decoded JSON response (if any).
+
+        Error responses whose status is in `ok` return None, any other error
+        raises DockerError.
+        """
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+
+        for attempt in range(self.retries):
+            if attempt:
+                with self._count_lock:
+                    self.num_retries += 1
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                conn = self._connection()
+                conn.request(method, path, body=data, headers=headers)
+                resp = conn.getresponse()
+                payload = resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                self._reset()
+                if attempt == self.retries - 1:
+                    raise DockerError(0, f"{method} {path}: {e}")
+                continue
+            with self._count_lock:
+                self.num_requests += 1
+
+            if resp.status in RETRY_STATUSES and attempt < self.retries - 1:
+                continue
+            if resp.status in ok:
+                return None
+            if resp.status >= 400:
+                try:
+                    message = json.loads(payload)["message"]
+                except (ValueError, KeyError):
+                    message = payload.decode(errors="replace")
+                raise DockerError(resp.status, f"{method} {path}: {message}")
+            if not payload or not resp.getheader("Content-Type", "").startswith(
+                "application/json"
+            ):
+                return None
+            try:
+                return json.loads(payload)
+            except ValueError:
+                # Streamed responses (e.g. pulls) are one JSON object per line
+                return [json.loads(l) for l in payload.splitlines() if l.strip()]
+        assert False, "unreachable"
+
+    def image_exists(self, image: str) -> bool:
+        return (
+            self.request("GET", f"/images/{quote(image)}/json", ok=(404,)) is not None
+        )
+
+    def pull(self, image: str):
+        if "@" in image:
+            # Pinned by digest (repo@sha256:...), which docker takes as is
+            params = {"fromImage": image}
+        else:
+            # The tag follows the last colon, unless that colon is a registry
+            # port (e.g. registry:5000/image)
+            name, _, tag = image.rpartition(":")
+            if not name or "/" in tag:
+                name, tag = image, ""
+            params = {"fromImage": name, "tag": tag or "latest"}
+        progress = self.request("POST", "/images/create", params=params)
+        for event in progress or []:
+            if "error" in event:
+                raise DockerError(500, f"pull {image}: {event['error']}")
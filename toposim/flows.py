@@ -0,0 +1,348 @@
+"""Flow-level simulation of captured traffic on a topology.
+
+The heatmap tool writes the bytes sent between every pair of groups (or
+hosts) in every interval as `matrix-ts<i>.txt`. Instead of rerunning the
+application on a new topology, the traffic of every interval is routed over
+the topology's next-hop tables (split evenly between equal-cost next hops with
+ECMP) to get the bytes every link carries.
+
+Routing is captured once in a path-incidence matrix: row `a * U + b` holds the
+fraction of the traffic from unit `a` to unit `b` (a host, or a group whose
+traffic is spread evenly over all pairs of its hosts) that crosses every arc
+(one direction of a link). The loads of all intervals are then a single
+product of the (intervals x unit pairs) traffic with that matrix.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .graph import TopologyGraph
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+# Larger incidence matrices are kept as (row, arc, weight) entries
+DENSE_INCIDENCE_ELEMENTS = 1 << 25
+
+
+def load_matrices(directory: str) -> np.ndarray:
+    """All `matrix-ts<i>.txt` files of a directory as a (T x U x U) array"""
+    files = {}
+    for f in os.listdir(directory):
+        if match := re.fullmatch(r"matrix-ts(\d+)\.txt", f):
+            files[int(match.group(1))] = os.path.join(directory, f)
+    if not files:
+        raise Exception(f"No matrix-ts<i>.txt files in {directory}")
+    missing = sorted(set(range(max(files) + 1)) - set(files))
+    if missing:
+        raise Exception(f"Missing matrices for intervals {missing} in {directory}")
+    return np.stack([np.loadtxt(files[i], ndmin=2) for i in range(len(files))])
+
+
+def next_hop_array(
+    graph: TopologyGraph, routes: Dict[str, Dict[str, List[str]]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Routing table (see `topology.routing_table`) as arrays: `hops[u, d, :k]`
+    are the `k = counts[u, d]` next hops from node u to node d"""
+    n = graph.num_nodes
+    width = max((len(h) for r in routes.values() for h in r.values()), default=1)
+    hops = np.full((n, n, width), -1, np.int32)
+    counts = np.zeros((n, n), np.int32)
+    ids = graph.ids
+    for src, table in routes.items():
+        u = ids[src]
+        for dst, first_hops in table.items():
+            d = ids[dst]
+            counts[u, d] = len(first_hops)
+            hops[u, d, : len(first_hops)] = [ids[h] for h in first_hops]
+    return hops, counts
+
+
+def path_incidence(
+    graph: TopologyGraph,
+    hops: np.ndarray,
+    counts: np.ndarray,
+    src: np.ndarray,
+    dst: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Fraction of flow i (from src[i] to dst[i]) that crosses every arc, as
+    (flow, arc, fraction) entries.
+
+    All flows advance one hop at a time together. A flow reaching a node over
+    several equal-cost paths is merged, so the entries never outnumber
+    (flows x nodes on their paths).
+    """
+    n = graph.num_nodes
+    flow = np.flatnonzero(src != dst)
+    node = src[flow]
+    weight = np.ones(len(flow))
+    entries = []
+    while len(flow):
+        k = counts[node, dst[flow]]
+        if not k.all():
+            i = np.flatnonzero(k == 0)[0]
+            a, b = graph.names[node[i]], graph.names[dst[flow[i]]]
+            raise Exception(f"No route from {a} to {b}")
+        # One entry for every next hop of every flow
+        rep = np.repeat(np.arange(len(flow)), k)
+        slot = np.arange(len(rep)) - np.repeat(np.cumsum(k) - k, k)
+        f, u = flow[rep], node[rep]
+        v = hops[u, dst[f], slot]
+        w = (weight / k)[rep]
+        entries.append((f, graph.arc_index(u, v), w))
+
+        on = v != dst[f]
+        keys, inverse = np.unique(
+            f[on].astype(np.int64) * n + v[on], return_inverse=True
+        )
+        weight = np.bincount(inverse.ravel(), w[on], len(keys))
+        flow, node = keys // n, (keys % n).astype(np.int32)
+    if not entries:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+    return tuple(np.concatenate(e) for e in zip(*entries))
+
+
+class Incidence:
+    """Fraction of the traffic of every row (pair of units) on every arc"""
+
+    num_rows: int
+    num_arcs: int
+    # (rows x arcs), if small enough
+    dense: Optional[np.ndarray] = None
+    # Otherwise nonzero entries, sorted by row and arc
+    rows: np.ndarray
+    arcs: np.ndarray
+    weights: np.ndarray
+
+    def __init__(
+        self,
+        num_rows: int,
+        num_arcs: int,
+        rows: np.ndarray,
+        arcs: np.ndarray,
+        weights: np.ndarray,
+    ):
+        self.num_rows = num_rows
+        self.num_arcs = num_arcs
+        keys, inverse = np.unique(
+            rows.astype(np.int64) * num_arcs + arcs, return_inverse=True
+        )
+        self.rows, self.arcs = keys // num_arcs, keys % num_arcs
+        self.weights = np.bincount(inverse.ravel(), weights, len(keys))
+        if num_rows * num_arcs <= DENSE_INCIDENCE_ELEMENTS:
+            self.dense = np.zeros((num_rows, num_arcs))
+            self.dense[self.rows, self.arcs] = self.weights
+
+    def apply(self, traffic: np.ndarray) -> np.ndarray:
+        """Bytes on every arc for (T x rows) traffic, as (T x arcs)"""
+        if self.dense is not None:
+            return traffic @ self.dense
+        if sparse is not None:
+            matrix = sparse.csr_matrix(
+                (self.weights, (self.rows, self.arcs)),
+                shape=(self.num_rows, self.num_arcs),
+            )
+            return np.asarray((matrix.T @ traffic.T).T)
+        out = np.zeros((len(traffic), self.num_arcs))
+        for t, row in enumerate(traffic):
+            out[t] = np.bincount(
+                self.arcs, row[self.rows] * self.weights, self.num_arcs
+            )
+        return out
+
+
+def traffic_units(
+    graph: TopologyGraph,
+    groups: Optional[Dict[str, List[str]]],
+    size: int,
+    level: str = "auto",
+) -> Tuple[List[str], List[np.ndarray]]:
+    """Names and endpoint ids of the units the rows and columns of (size x
+    size) traffic matrices refer to: the groups of the config in order, or its
+    non-dummy nodes in order"""
+    endpoints = np.flatnonzero(~graph.is_dummy)
+    if level == "auto":
+        fits = {"groups": bool(groups) and len(groups) == size}
+        fits["hosts"] = len(endpoints) == size
+        if fits["groups"] == fits["hosts"]:
+            raise Exception(
+                f"Can't tell if {size}x{size} matrices are per group or per host, "
+                "pass the level"
+            )
+        level = "groups" if fits["groups"] else "hosts"
+
+    if level == "hosts":
+        if len(endpoints) != size:
+            raise Exception(f"{size}x{size} matrices, but {len(endpoints)} hosts")
+        return [graph.names[e] for e in endpoints], [np.array([e]) for e in endpoints]
+    if not groups or len(groups) != size:
+        raise Exception(f"{size}x{size} matrices, but {len(groups or {})} groups")
+    members = []
+    for name, nodes in groups.items():
+        ids = np.array([graph.ids[n] for n in nodes], np.int64)
+        if not (~graph.is_dummy[ids]).any():
+            raise Exception(f'groups["{name}"] has no non-dummy nodes to send from')
+        members.append(ids[~graph.is_dummy[ids]])
+    return list(groups), members
+
+
+def unit_incidence(
+    graph: TopologyGraph,
+    routes: Dict[str, Dict[str, List[str]]],
+    members: List[np.ndarray],
+) -> Incidence:
+    """Incidence of the traffic between every pair of units, where traffic
+    between two units is split evenly between all pairs of distinct endpoints
+    (one in each unit). Raises an exception if a unit has no endpoints, as its
+    traffic could not be routed."""
+    units = len(members)
+    if empty := [u for u, m in enumerate(members) if not len(m)]:
+        raise Exception(f"Units {empty} have no endpoints to send traffic from")
+    node = np.concatenate(members).astype(np.int64)
+    unit = np.repeat(np.arange(units), [len(m) for m in members])
+    i, j = np.meshgrid(np.arange(len(node)), np.arange(len(node)), indexing="ij")
+    i, j = i.ravel(), j.ravel()
+    keep = node[i] != node[j]
+    i, j = i[keep], j[keep]
+    row = unit[i] * units + unit[j]
+    pairs = np.bincount(row, minlength=units * units)
+
+    hops, counts = next_hop_array(graph, routes)
+    flow, arc, fraction = path_incidence(graph, hops, counts, node[i], node[j])
+    return Incidence(
+        units * units,
+        len(graph.indices),
+        row[flow],
+        arc,
+        fraction / pairs[row[flow]],
+    )
+
+
+@dataclass
+class FlowResult:
+    graph: TopologyGraph
+    # Seconds every matrix covers
+    interval: float
+    # Bytes per second every direction of a link carries
+    bandwidth: float
+    # Bytes sent in every interval
+    offered: np.ndarray
+    # (T x arcs) bytes every arc carries in every interval
+    arc_bytes: np.ndarray
+
+    @property
+    def utilization(self) -> np.ndarray:
+        """(T x arcs) fraction of every interval every arc is busy"""
+        return self.arc_bytes / (self.bandwidth * self.interval)
+
+    @property
+    def completion_time(self) -> np.ndarray:
+        """Seconds until the busiest arc has sent its bytes, for every interval.
+        This is a lower bound: flows are assumed to share every link perfectly,
+        and latency is ignored."""
+        if not self.arc_bytes.shape[1]:
+            return np.zeros(len(self.arc_bytes))
+        return self.arc_bytes.max(axis=1) / self.bandwidth
+
+    def report(self) -> dict:
+        graph = self.graph
+        names = graph.names
+        src = graph.sources()
+        edges = graph.edges()
+        forward = graph.arc_index(edges[:, 0], edges[:, 1])
+        backward = graph.arc_index(edges[:, 1], edges[:, 0])
+        utilization = self.utilization
+        completion = self.completion_time
+        intervals = []
+        for t in range(len(self.arc_bytes)):
+            busiest = int(np.argmax(self.arc_bytes[t])) if len(src) else None
+            intervals.append(
+                {
+                    "bytes": float(self.offered[t]),
+                    "byteHops": float(self.arc_bytes[t].sum()),
+                    "maxLoad": (
+                        float(self.arc_bytes[t, busiest])
+                        if busiest is not None
+                        else 0.0
+                    ),
+                    "busiest": (
+                        [names[src[busiest]], names[graph.indices[busiest]]]
+                        if busiest is not None
+                        else None
+                    ),
+                    "maxUtilization": float(utilization[t].max(initial=0)),
+                    "completionTime": float(completion[t]),
+                }
+            )
+        return {
+            "interval": self.interval,
+            "bandwidth": self.bandwidth,
+            "bytes": float(self.offered.sum()),
+            "byteHops": float(self.arc_bytes.sum()),
+            "completionTime": float(completion.sum()),
+            # Intervals whose traffic takes longer than the interval to send
+            "overloaded": int((completion > self.interval).sum()),
+            "intervals": intervals,
+            "perLink": [
+                {
+                    "link": [names[u], names[v]],
+                    "bytes": [
+                        float(self.arc_bytes[:, f].sum()),
+                        float(self.arc_bytes[:, b].sum()),
+                    ],
+                    "maxUtilization": float(utilization[:, [f, b]].max(initial=0)),
+                }
+                for (u, v), f, b in zip(
+                    edges.tolist(), forward.tolist(), backward.tolist()
+                )
+            ],
+        }
+
+
+def simulate(
+    graph: TopologyGraph,
+    routes: Dict[str, Dict[str, List[str]]],
+    matrices: np.ndarray,
+    interval: float,
+    bandwidth: float,
+    groups: Optional[Dict[str, List[str]]] = None,
+    level: str = "auto",
+) -> FlowResult:
+    """Route (T x U x U) traffic matrices (bytes from row to column in every
+    interval) over `routes`. `bandwidth` is in bytes per second."""
+    size = matrices.shape[1]
+    _, members = traffic_units(graph, groups, size, level)
+    incidence = unit_incidence(graph, routes, members)
+    traffic = matrices.reshape(len(matrices), size * size)
+    return FlowResult(
+        graph,
+        interval,
+        bandwidth,
+        traffic.sum(axis=1),
+        incidence.apply(traffic),
+    )
+
+
+def format_intervals(result: FlowResult) -> str:
+    report = result.report()
+    lines = [
+        f"{'interval':>8} {'bytes':>14} {'byte hops':>14} {'max load':>14} "
+        f"{'busiest link':<20} {'max util':>8} {'completion (s)':>14}"
+    ]
+    for t, r in enumerate(report["intervals"]):
+        busiest = " -> ".join(r["busiest"]) if r["busiest"] else "-"
+        lines.append(
+            f"{t:>8} {r['bytes']:>14.0f} {r['byteHops']:>14.0f} {r['maxLoad']:>14.0f} "
+            f"{busiest:<20} {r['maxUtilization']:>8.3f} {r['completionTime']:>14.3f}"
+        )
+    lines.append(
+        f"{'total':>8} {report['bytes']:>14.0f} {report['byteHops']:>14.0f} "
+        f"{'':>14} {'':<20} {'':>8} {report['completionTime']:>14.3f}"
+    )
+    return "\n".join(lines)
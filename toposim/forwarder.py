@@ -0,0 +1,62 @@
+"""Container images that ports (forwarding containers) are started from.
+
+Ports never run anything themselves: routes, qdiscs and captures are set up
+from the host with nsenter, so a port only needs to keep its network namespace
+alive. The smaller the image, the more ports fit on a single host.
+"""
+
+from dataclasses import dataclass, replace
+from typing import Optional, Union
+
+
+@dataclass(frozen=True)
+class Forwarder:
+    image: str
+    # None keeps the image's own entrypoint
+    entrypoint: Optional[str] = None
+    # Same format as compose's mem_limit, e.g. "16m"
+    mem_limit: Optional[str] = None
+    cpus: Optional[float] = None
+
+
+forwarder_presets = {
+    # Only runs a process that sleeps until it's killed (a few hundred KB)
+    "pause": Forwarder("registry.k8s.io/pause:3.9"),
+    "busybox": Forwarder("busybox:latest", '/bin/sh -c "sleep inf"'),
+    "alpine": Forwarder("alpine:latest", '/bin/sh -c "sleep inf"'),
+    # Has a shell and a package manager for debugging from inside the port
+    "ubuntu": Forwarder("ubuntu:latest", '/bin/sh -c "sleep inf"'),
+}
+
+DEFAULT_FORWARDER = "pause"
+
+
+def load_forwarder(spec: Union[str, dict, None]) -> Forwarder:
+    """Parse the "forwarder" value of a config.
+
+    Either the name of a preset, or an object with an optional "preset" to
+    start from and any of "image", "entrypoint", "memLimit" and "cpus".
+    """
+    if spec is None:
+        spec = DEFAULT_FORWARDER
+    if isinstance(spec, str):
+        spec = {"preset": spec}
+
+    unknown = set(spec) - {"preset", "image", "entrypoint", "memLimit", "cpus"}
+    if unknown:
+        raise Exception(f"Unknown forwarder options {sorted(unknown)}")
+    preset = spec.get("preset", DEFAULT_FORWARDER if "image" not in spec else None)
+    if preset is None:
+        res = Forwarder(spec["image"])
+    elif preset in forwarder_presets:
+        res = forwarder_presets[preset]
+    else:
+        raise Exception(f"Unknown forwarder preset {preset}")
+
+    overrides = {
+        "image": spec.get("image"),
+        "entrypoint": spec.get("entrypoint"),
+        "mem_limit": spec.get("memLimit"),
+        "cpus": spec.get("cpus"),
+    }
+    return replace(res, **{k: v for k, v in overrides.items() if v is not None})
@@ -0,0 +1,211 @@
+"""Configs for common network topologies.
+
+Every generator returns a config with `links` and `dummyNodes` like the ones
+written by hand, plus `groups`, which assigns every router and the hosts behind
+it to a group (e.g. a slimfly subgraph or a fat-tree pod) so that analysis can
+aggregate traffic per group. Routers are named r1, r2, ... and are dummy nodes;
+hosts are named h1, h2, ... and every router is followed by its hosts in
+`links`. With zero hosts per router, the routers are the nodes themselves.
+
+Links are built as NumPy arrays of router ids, so even fabrics with thousands
+of routers are generated in milliseconds.
+"""
+
+import math
+from typing import Dict, List, Sequence, Union
+
+import numpy as np
+
+
+def _arcs(edges: np.ndarray) -> np.ndarray:
+    """Both directions of every edge, sorted by source and then target"""
+    arcs = np.concatenate([edges, edges[:, ::-1]]).reshape(-1, 2)
+    return arcs[np.lexsort((arcs[:, 1], arcs[:, 0]))]
+
+
+def _config(
+    num_routers: int,
+    edge_classes: List[np.ndarray],
+    hosts: Union[int, np.ndarray],
+    groups: np.ndarray,
+) -> dict:
+    """Assemble a config from the links between routers.
+
+    Every router lists its neighbors one class of edges after the other (e.g.
+    links inside its group before global links), in ascending order within a
+    class, and its hosts (`hosts` per router, or `hosts[r]` for router r)
+    last.
+    """
+    edges = [np.asarray(e, np.int64).reshape(-1, 2) for e in edge_classes]
+    arcs = np.concatenate([_arcs(e) for e in edges] or [np.zeros((0, 2), np.int64)])
+    # Stable, so that every router keeps the order of the classes
+    arcs = arcs[np.argsort(arcs[:, 0], kind="stable")]
+    counts = np.bincount(arcs[:, 0], minlength=num_routers).tolist()
+    targets = [f"r{t + 1}" for t in arcs[:, 1].tolist()]
+    num_hosts = np.broadcast_to(hosts, num_routers).tolist()
+
+    links: Dict[str, List[str]] = {}
+    group_members: Dict[str, List[str]] = {}
+    group_names = [f"g{g}" for g in groups.tolist()]
+    start = 0
+    first_host = 1
+    for r in range(num_routers):
+        name = f"r{r + 1}"
+        host_names = [f"h{first_host + i}" for i in range(num_hosts[r])]
+        first_host += num_hosts[r]
+        links[name] = targets[start : start + counts[r]] + host_names
+        start += counts[r]
+        for h in host_names:
+            links[h] = [name]
+        group_members.setdefault(group_names[r], []).extend([name] + host_names)
+
+    return {
+        "links": links,
+        "dummyNodes": (
+            [f"r{r + 1}" for r in range(num_routers)] if any(num_hosts) else []
+        ),
+        "groups": dict(sorted(group_members.items(), key=lambda g: int(g[0][1:]))),
+    }
+
+
+def _is_prime(n: int) -> bool:
+    return n >= 2 and all(n % d for d in range(2, math.isqrt(n) + 1))
+
+
+def slimfly(q: int, hosts: int = -1) -> dict:
+    """MMS slimfly over GF(q) for a prime q with q % 4 in (1, 3).
+
+    2 * q * q routers in 2 * q groups of q. Router (0, x, y) is linked to
+    (1, m, c) if y = c - m * x. By default every router gets
+    ceil(radix / 2) hosts, where radix is its number of router links.
+    """
+    if not _is_prime(q) or q % 4 not in (1, 3):
+        raise Exception(f"slimfly needs a prime q with q % 4 in (1, 3), got {q}")
+    xi = next(
+        x for x in range(2, q) if len({pow(x, i, q) for i in range(1, q)}) == q - 1
+    )
+    w = q // 4
+    if q % 4 == 1:
+        X = [pow(xi, i, q) for i in range(0, q - 1, 2)]
+        Xp = [pow(xi, i, q) for i in range(1, q - 1, 2)]
+        delta = 1
+    else:
+        w += 1
+        X = [pow(xi, i, q) for i in range(0, 2 * w - 1, 2)]
+        X += [pow(xi, i, q) for i in range(2 * w - 1, 4 * w - 2, 2)]
+        Xp = [pow(xi, i, q) for i in range(1, 2 * w, 2)]
+        Xp += [pow(xi, i, q) for i in range(2 * w, 4 * w - 1, 2)]
+        delta = -1
+    if hosts < 0:
+        hosts = math.ceil((3 * q - delta) / 4)
+
+    def router(s, a, b):
+        return s * q * q + a * q + b
+
+    # Inside a group: (s, a, y) - (s, a, y2) if y - y2 is in X (X' for s = 1)
+    a, y, y2 = np.indices((q, q, q)).reshape(3, -1)
+    upper = y < y2
+    intra = []
+    for s, gen in ((0, X), (1, Xp)):
+        mask = upper & np.isin((y - y2) % q, gen)
+        intra.append(np.stack([router(s, a, y), router(s, a, y2)], axis=1)[mask])
+    # Between subgraphs: (0, x, y) - (1, m, y + m * x)
+    x, m, y = np.indices((q, q, q)).reshape(3, -1)
+    inter = np.stack([router(0, x, y), router(1, m, (y + m * x) % q)], axis=1)
+
+    groups = np.arange(2 * q * q) // q
+    return _config(2 * q * q, [np.concatenate(intra), inter], hosts, groups)
+
+
+def dragonfly(a: int, p: int, h: int) -> dict:
+    """Dragonfly with a routers per group, p hosts per router and h global
+    links per router.
+
+    a * h + 1 groups whose routers are fully connected, and exactly one global
+    link between every pair of groups.
+    """
+    if a < 1 or h < 1 or p < 0:
+        raise Exception(f"Invalid dragonfly a={a} p={p} h={h}")
+    g = a * h + 1
+    i, j = np.triu_indices(a, 1)
+    base = np.arange(g)[:, None] * a
+    intra = np.stack([(base + i).ravel(), (base + j).ravel()], axis=1)
+    g1, g2 = np.triu_indices(g, 1)
+    r1 = g1 * a + ((g2 - g1 - 1) % g) // h
+    r2 = g2 * a + ((g1 - g2 - 1) % g) // h
+    inter = np.stack([r1, r2], axis=1)
+    return _config(g * a, [intra, inter], p, np.arange(g * a) // a)
+
+
+def fat_tree(k: int) -> dict:
+    """k-ary fat-tree: k pods of k / 2 edge and k / 2 aggregation switches,
+    (k / 2)^2 core switches and k / 2 hosts per edge switch.
+
+    Every pod is a group, and the core switches form the last group.
+    """
+    if k < 2 or k % 2:
+        raise Exception(f"fat-tree needs an even k >= 2, got {k}")
+    half = k // 2
+    pod, e, agg = np.indices((k, half, half)).reshape(3, -1)
+    # Routers of pod p: edge switches at p * k, aggregation switches after
+    edge_agg = np.stack([pod * k + e, pod * k + half + agg], axis=1)
+    pod, agg, c = np.indices((k, half, half)).reshape(3, -1)
+    agg_core = np.stack([pod * k + half + agg, k * k + agg * half + c], axis=1)
+
+    num_routers = k * k + half * half
+    ids = np.arange(num_routers)
+    hosts = np.where((ids < k * k) & (ids % k < half), half, 0)
+    groups = np.minimum(ids // k, k)
+    return _config(num_routers, [edge_agg, agg_core], hosts, groups)
+
+
+def torus(dims: Sequence[int], hosts: int = 1) -> dict:
+    """Torus with the given size in every dimension (a ring for one dimension,
+    2D and 3D tori for two and three).
+
+    Routers with the same first coordinate form a group.
+    """
+    dims = tuple(dims)
+    if not dims or min(dims) < 1:
+        raise Exception(f"Invalid torus dimensions {dims}")
+    num_routers = math.prod(dims)
+    coords = np.indices(dims).reshape(len(dims), -1)
+    ids = np.arange(num_routers)
+    edges = []
+    for d, size in enumerate(dims):
+        if size == 1:
+            continue
+        nxt = coords.copy()
+        nxt[d] = (nxt[d] + 1) % size
+        # A dimension of size 2 has a single link, not two parallel ones
+        keep = coords[d] + 1 < size if size == 2 else slice(None)
+        edges.append(
+            np.stack([ids, np.ravel_multi_index(tuple(nxt), dims)], axis=1)[keep]
+        )
+    edges = [np.sort(e, axis=1) for e in edges]
+    return _config(num_routers, [np.concatenate(edges or [[]])], hosts, coords[0])
+
+
+def hypercube(d: int, hosts: int = 1) -> dict:
+    """d-dimensional hypercube: 2^d routers, linked if their ids differ in
+    one bit.
+
+    Subcubes of dimension d // 2 form the groups.
+    """
+    if d < 0:
+        raise Exception(f"Invalid hypercube dimension {d}")
+    ids = np.arange(1 << d)
+    bits = 1 << np.arange(d)
+    u, b = np.meshgrid(ids, bits, indexing="ij")
+    v = u ^ b
+    edges = np.stack([u[u < v], v[u < v]], axis=1)
+    return _config(1 << d, [edges], hosts, ids >> (d // 2))
+
+
+generators = {
+    "slimfly": slimfly,
+    "dragonfly": dragonfly,
+    "fat-tree": fat_tree,
+    "torus": torus,
+    "hypercube": hypercube,
+}
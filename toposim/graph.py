@@ -0,0 +1,138 @@
+"""Adjacency of a topology as integer node ids and CSR arrays.
+
+Configs name nodes by strings and list the neighbors of every node. Checking
+that those lists are consistent with list membership tests is quadratic in the
+degree, and searching the graph through dicts of strings hashes a name for
+every edge. TopologyGraph numbers the nodes once (in config order) and keeps the
+neighbors of node `i` in `indices[indptr[i]:indptr[i + 1]]`, in the order the
+config lists them, so the whole config is checked with a few array operations.
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+class TopologyGraph:
+    # node id -> name
+    names: List[str]
+    # name -> node id
+    ids: Dict[str, int]
+    # neighbors of node i are indices[indptr[i]:indptr[i + 1]]
+    indptr: np.ndarray
+    indices: np.ndarray
+    # node id -> whether the node is a dummy (only forwards traffic)
+    is_dummy: np.ndarray
+
+    _adjacency: Optional[List[List[int]]] = None
+
+    def __init__(
+        self,
+        names: List[str],
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        is_dummy: np.ndarray,
+    ):
+        self.names = names
+        self.ids = {n: i for i, n in enumerate(names)}
+        self.indptr = indptr
+        self.indices = indices
+        self.is_dummy = is_dummy
+
+    @classmethod
+    def from_links(
+        cls, links: Dict[str, List[str]], dummies: Iterable[str] = ()
+    ) -> "TopologyGraph":
+        """Build the graph of a config's `links` and `dummyNodes`.
+
+        Raises an exception naming the first entry that refers to an unknown
+        node, links a node to itself, repeats a link, or is missing from the
+        neighbor's list.
+        """
+        names = list(links)
+        ids = {n: i for i, n in enumerate(names)}
+        num_nodes = len(names)
+
+        degrees = np.fromiter(map(len, links.values()), np.int64, num_nodes)
+        indptr = np.zeros(num_nodes + 1, np.int64)
+        np.cumsum(degrees, out=indptr[1:])
+        flat = [l for neighbors in links.values() for l in neighbors]
+        try:
+            indices = np.fromiter(map(ids.__getitem__, flat), np.int32, len(flat))
+        except KeyError:
+            for n, neighbors in links.items():
+                for i, l in enumerate(neighbors):
+                    if l not in ids:
+                        raise Exception(f'links["{n}"][{i}]: unknown node "{l}"')
+            raise
+
+        src = np.repeat(np.arange(num_nodes, dtype=np.int32), degrees)
+        if (loops := np.flatnonzero(src == indices)).size:
+            n = names[src[loops[0]]]
+            raise Exception(f'links["{n}"]: "{n}" is linked to itself')
+
+        # Every link as one integer, so that duplicates and missing reverse
+        # links are found by sorting
+        keys = src.astype(np.int64) * num_nodes + indices
+        order = np.argsort(keys, kind="stable")
+        if (dups := np.flatnonzero(np.diff(keys[order]) == 0)).size:
+            e = order[dups[0] + 1]
+            a, b = names[src[e]], names[indices[e]]
+            raise Exception(f'links["{a}"]: "{b}" is listed more than once')
+        reverse = indices.astype(np.int64) * num_nodes + src
+        if (missing := np.flatnonzero(~np.isin(keys, reverse))).size:
+            e = missing[0]
+            a, b = names[src[e]], names[indices[e]]
+            raise Exception(
+                f'links["{a}"] lists "{b}", but links["{b}"] does not list "{a}"'
+            )
+
+        is_dummy = np.zeros(num_nodes, bool)
+        for i, d in enumerate(dummies):
+            if d not in ids:
+                raise Exception(f'dummyNodes[{i}]: unknown node "{d}"')
+            is_dummy[ids[d]] = True
+        return cls(names, indptr, indices, is_dummy)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.names)
+
+    @property
+    def num_links(self) -> int:
+        return len(self.indices) // 2
+
+    def degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def neighbors(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node] : self.indptr[node + 1]]
+
+    def sources(self) -> np.ndarray:
+        """The node every entry of `indices` is a neighbor of"""
+        return np.repeat(np.arange(self.num_nodes, dtype=np.int32), self.degrees())
+
+    def edges(self) -> np.ndarray:
+        """Every link once as a row (u, v) with u < v, in config order"""
+        src = self.sources()
+        mask = src < self.indices
+        return np.stack([src[mask], self.indices[mask]], axis=1)
+
+    def arc_index(self, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        """Position in `indices` of every link (u, v), i.e. of v among the
+        neighbors of u"""
+        keys = self.sources().astype(np.int64) * self.num_nodes + self.indices
+        order = np.argsort(keys)
+        wanted = np.asarray(u, np.int64) * self.num_nodes + v
+        return order[np.searchsorted(keys[order], wanted)]
+
+    def adjacency(self) -> List[List[int]]:
+        """Neighbors of every node as Python lists, for searches that visit
+        one node at a time (indexing numpy arrays element by element is slow)"""
+        if self._adjacency is None:
+            indices = self.indices.tolist()
+            bounds = self.indptr.tolist()
+            self._adjacency = [
+                indices[bounds[i] : bounds[i + 1]] for i in range(self.num_nodes)
+            ]
+        return self._adjacency
@@ -1,12 +1,556 @@
 import argparse
+import json
+import sys
 from pathlib import Path
 
-from . import generate
+from . import generate, load_topology, utils, validate_config
 from .application import application_registry
 
 
+def net_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="toposim net",
+        description="Apply network changes to a running cluster from one process",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    apply_parser = subparsers.add_parser("apply")
+    apply_parser.add_argument("directory", help="Directory created by toposim")
+    apply_parser.add_argument(
+        "--routes",
+        action="store_true",
+        help="Apply the generated routes, iptables rules and sysctls",
+    )
+    apply_parser.add_argument(
+        "--delay", type=int, default=None, help="Set a netem delay (ms) on every port"
+    )
+    apply_parser.add_argument(
+        "--change",
+        action="store_true",
+        help="Change an existing delay instead of adding one",
+    )
+    apply_parser.add_argument(
+        "--bandwidth",
+        type=int,
+        default=None,
+        help="Limit the bandwidth (kbit/s) of every node",
+    )
+    apply_parser.add_argument(
+        "--clear-bandwidth", action="store_true", help="Remove bandwidth limits"
+    )
+    apply_parser.add_argument(
+        "--batch",
+        action="append",
+        default=[],
+        metavar="CONTAINER=FILE",
+        help="Apply a file of `ip -batch` style commands to a container",
+    )
+    args = parser.parse_args(argv)
+
+    # Only import when needed since it loads libc
+    from .netns import apply
+
+    batches = dict(b.split("=", 1) for b in args.batch)
+    ok = apply(
+        args.directory,
+        load_topology(args.directory),
+        routes=args.routes,
+        delay=args.delay,
+        change_delay=args.change,
+        bandwidth=args.bandwidth,
+        clear_bandwidth=args.clear_bandwidth,
+        batches=batches,
+    )
+    sys.exit(0 if ok else 1)
+
+
+def reconfigure_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="toposim reconfigure",
+        description="Change the links of a running cluster without restarting it",
+    )
+    parser.add_argument("directory", help="Directory created by toposim")
+    parser.add_argument("filename", help="New config file (same nodes)")
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Print the commands that would be run instead of running them",
+    )
+    parser.add_argument(
+        "--native",
+        action="store_true",
+        help="Change routes over netlink instead of running nsenter",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=32, help="Number of commands to run at once"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Echo every generated file"
+    )
+    args = parser.parse_args(argv)
+    utils.verbose = args.verbose
+
+    from .reconfigure import reconfigure
+
+    ok = reconfigure(
+        args.directory,
+        args.filename,
+        dry_run=args.dry_run,
+        native=args.native,
+        jobs=args.jobs,
+    )
+    sys.exit(0 if ok else 1)
+
+
+def up_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="toposim up",
+        description="Create the networks and containers of a generated cluster",
+    )
+    parser.add_argument("directory", help="Directory created by toposim")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=16, help="Number of requests to send at once"
+    )
+    parser.add_argument(
+        "--no-pull", action="store_true", help="Don't pull missing images"
+    )
+    args = parser.parse_args(argv)
+
+    from .cluster import up
+
+    sys.exit(0 if up(args.directory, args.jobs, pull=not args.no_pull) else 1)
+
+
+def down_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="toposim down",
+        description="Remove the containers and networks of a generated cluster",
+    )
+    parser.add_argument("directory", help="Directory created by toposim")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=16, help="Number of requests to send at once"
+    )
+    parser.add_argument(
+        "--volumes", action="store_true", help="Also remove named volumes"
+    )
+    args = parser.parse_args(argv)
+
+    from .cluster import down
+
+    sys.exit(0 if down(args.directory, args.jobs, volumes=args.volumes) else 1)
+
+
+def analyze_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="toposim analyze",
+        description="Report the diameter, path diversity, link loads under uniform "
+        "all-to-all traffic and bisection of topology configs",
+    )
+    parser.add_argument("filenames", nargs="+", metavar="config_file")
+    parser.add_argument("--json", action="store_true", help="Print the reports as JSON")
+    parser.add_argument(
+        "-o", "--output", default=None, help="Also write the reports to this JSON file"
+    )
+    parser.add_argument(
+        "--links", type=int, default=0, help="Print the N most loaded links"
+    )
+    args = parser.parse_args(argv)
+
+    from .analysis import analyze, format_table
+
+    reports = {}
+    for filename in args.filenames:
+        with open(filename) as f:
+            data = json.load(f)
+        graph = validate_config(data)
+        reports[filename] = analyze(graph, data.get("groups"))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+            f.write("\n")
+    if args.json:
+        json.dump(reports, sys.stdout, indent=2)
+        print()
+        return
+
+    print(format_table(reports))
+    for filename, report in reports.items():
+        if "groups" in report:
+            g = report["groups"]
+            print(
+                f"{filename}: {g['count']} groups, {g['interGroupLinks']} links "
+                f"between groups, max load {g['maxInterGroupLoad']:.3f} between "
+                f"and {g['maxIntraGroupLoad']:.3f} inside groups"
+            )
+        busiest = sorted(report["perLink"], key=lambda l: -max(l["load"]))
+        for link in busiest[: args.links]:
+            a, b = link["link"]
+            print(f"  {a} <-> {b}: load {link['load'][0]:.3f} / {link['load'][1]:.3f}")
+
+
+def simulate_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="toposim simulate",
+        description="Route captured traffic matrices (matrix-ts<i>.txt from the "
+        "heatmap tool) over a topology and report the load of its links",
+    )
+    parser.add_argument("filename", metavar="config_file")
+    parser.add_argument("matrices", help="Directory of matrix-ts<i>.txt files")
+    parser.add_argument(
+        "-i", "--interval", type=float, default=10, help="Seconds every matrix covers"
+    )
+    parser.add_argument(
+        "-b",
+        "--bandwidth",
+        type=float,
+        default=1024,
+        help="Bandwidth (kbit/s) of every link, as for tools/limit_bandwidth",
+    )
+    parser.add_argument(
+        "--level",
+        choices=["auto", "hosts", "groups"],
+        default="auto",
+        help="Whether the matrices are per host or per group of the config",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument(
+        "-o", "--output", default=None, help="Also write the report to this JSON file"
+    )
+    args = parser.parse_args(argv)
+
+    from .flows import format_intervals, load_matrices, simulate
+    from .topology import routing_table
+
+    with open(args.filename) as f:
+        data = json.load(f)
+    graph = validate_config(data)
+    routes = routing_table(graph, data.get("ecmp", False))
+    result = simulate(
+        graph,
+        routes,
+        load_matrices(args.matrices),
+        args.interval,
+        args.bandwidth * 1000 / 8,
+        data.get("groups"),
+        args.level,
+    )
+
+    report = result.report()
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    print(format_intervals(result))
+    print(
+        f"{report['overloaded']} of {len(report['intervals'])} intervals take longer "
+        f"than {args.interval}s to send"
+    )
+
+
+def ocs_arguments(parser: argparse.ArgumentParser):
+    """Arguments of the commands that model optical circuit switches"""
+    parser.add_argument(
+        "--config",
+        default=None,
+        help='Config whose "reconfig" racks and OCSs (or groups) to model',
+    )
+    parser.add_argument(
+        "--num-groups",
+        type=int,
+        default=6,
+        help="Without --config, pair this many groups into racks like slimfly",
+    )
+    parser.add_argument(
+        "-i", "--interval", type=float, default=10, help="Seconds every matrix covers"
+    )
+    parser.add_argument(
+        "--switch-cost",
+        type=float,
+        default=0,
+        help="Cost (in byte hops) of flipping an OCS",
+    )
+    parser.add_argument(
+        "--downtime",
+        type=float,
+        default=0,
+        help="Seconds flipping OCSs takes, during which the previous state is used",
+    )
+    parser.add_argument(
+        "--initial", type=int, default=0, help="State of the OCSs before the trace"
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument(
+        "-o", "--output", default=None, help="Also write the report to this JSON file"
+    )
+
+
+def ocs_topology(args: argparse.Namespace):
+    from .ocs import OCSTopology
+
+    if args.config is not None:
+        with open(args.config) as f:
+            topo = OCSTopology.from_config(json.load(f))
+    else:
+        topo = OCSTopology.pairs(args.num_groups)
+    if not 0 <= args.initial < topo.num_states:
+        raise Exception(f"The OCSs have {topo.num_states} states, got {args.initial}")
+    return topo
+
+
+def plan_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="toposim plan",
+        description="Plan the OCS states with the lowest total cost for captured "
+        "traffic matrices (matrix-ts<i>.txt from the heatmap tool), when flipping "
+        "an OCS costs something and takes time",
+    )
+    parser.add_argument("matrices", help="Directory of matrix-ts<i>.txt files")
+    ocs_arguments(parser)
+    args = parser.parse_args(argv)
+
+    import numpy as np
+
+    from .flows import load_matrices
+    from .ocs import format_schedule, plan_schedule
+
+    topo = ocs_topology(args)
+    n = topo.num_groups
+    matrices = load_matrices(args.matrices)[:, :n, :n].astype(np.int64)
+    if matrices.shape[1] < n:
+        raise Exception(f"{n} groups, but the matrices only have {matrices.shape[1]}")
+    states = np.union1d(topo.candidate_states(matrices), [args.initial])
+    schedule = plan_schedule(
+        topo.costs(matrices, states),
+        states,
+        args.switch_cost,
+        min(args.downtime / args.interval, 1),
+        args.initial,
+    )
+
+    report = schedule.report()
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    print(format_schedule(schedule))
+
+
+def control_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="toposim control",
+        description="Decide the state of the OCSs online from traffic matrices as "
+        "they are produced (matrix-ts<i>.txt from the heatmap tool, or a socket)",
+    )
+    parser.add_argument(
+        "matrices",
+        nargs="?",
+        default=None,
+        help="Directory of matrix-ts<i>.txt files to follow (or replay)",
+    )
+    ocs_arguments(parser)
+    parser.add_argument(
+        "--listen",
+        default=None,
+        metavar="HOST:PORT",
+        help="Read matrices sent over TCP instead: rows of numbers, and an empty "
+        "line after every matrix",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="Feed the stored matrices as fast as possible and compare the cost of "
+        "the decisions with staying static and the offline optimum",
+    )
+    parser.add_argument(
+        "--half-life",
+        type=float,
+        default=1,
+        help="Intervals after which the traffic of an interval counts half",
+    )
+    parser.add_argument(
+        "--hysteresis",
+        type=float,
+        default=0.05,
+        help="Fraction of the current cost a new state must save to switch",
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=0.1,
+        help="Seconds every decision may take",
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=1,
+        help="Seconds between checks for new matrices in the directory",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Stop after this many seconds without a new matrix",
+    )
+    args = parser.parse_args(argv)
+    if (args.matrices is None) == (args.listen is None):
+        parser.error("give either a matrix directory or --listen")
+    if args.replay and args.matrices is None:
+        parser.error("--replay needs a matrix directory")
+
+    from .controller import (
+        Controller,
+        format_replay,
+        replay,
+        socket_matrices,
+        tail_matrices,
+    )
+    from .flows import load_matrices
+
+    topo = ocs_topology(args)
+    controller = Controller(
+        topo,
+        args.half_life,
+        args.hysteresis,
+        args.switch_cost,
+        args.budget,
+        args.initial,
+    )
+    downtime = min(args.downtime / args.interval, 1)
+
+    if args.replay:
+        result = replay(controller, load_matrices(args.matrices), downtime)
+        report = result.report(topo)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+                f.write("\n")
+        if args.json:
+            json.dump(report, sys.stdout, indent=2)
+            print()
+            return
+        print(format_replay(result))
+        return
+
+    if args.listen is not None:
+        host, _, port = args.listen.rpartition(":")
+        matrices = socket_matrices((host, int(port)))
+    else:
+        matrices = tail_matrices(args.matrices, args.poll, args.timeout)
+    output = open(args.output, "w") if args.output is not None else None
+    try:
+        if not args.json:
+            print(f"{'timestep':>8} {'state':>12} {'flips':>6} {'latency (ms)':>12}")
+        for matrix in matrices:
+            decision = controller.update(matrix)
+            line = json.dumps(decision.report(topo))
+            if output is not None:
+                output.write(line + "\n")
+                output.flush()
+            if args.json:
+                print(line, flush=True)
+            else:
+                print(
+                    f"{decision.timestep:>8} {decision.state:>12} "
+                    f"{decision.flips:>6} {1000 * decision.latency:>12.3f}",
+                    flush=True,
+                )
+    finally:
+        if output is not None:
+            output.close()
+
+
+def gen_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="toposim gen",
+        description="Write the config of a common network topology",
+    )
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "-o", "--output", default=None, help="Config file to write (default: stdout)"
+    )
+    common.add_argument("--app", default=None, choices=application_registry.keys())
+    subparsers = parser.add_subparsers(dest="family", required=True)
+    slimfly = subparsers.add_parser("slimfly", parents=[common], help="MMS slimfly")
+    slimfly.add_argument("q", type=int, help="Prime with q %% 4 in (1, 3)")
+    slimfly.add_argument(
+        "-p",
+        "--hosts",
+        type=int,
+        default=-1,
+        help="Hosts per router (default: half the router links)",
+    )
+    dragonfly = subparsers.add_parser("dragonfly", parents=[common], help="Dragonfly")
+    dragonfly.add_argument("a", type=int, help="Routers per group")
+    dragonfly.add_argument("p", type=int, help="Hosts per router")
+    dragonfly.add_argument("h", type=int, help="Global links per router")
+    fat_tree = subparsers.add_parser(
+        "fat-tree", parents=[common], help="k-ary fat-tree"
+    )
+    fat_tree.add_argument("k", type=int, help="Even number of ports per switch")
+    torus = subparsers.add_parser("torus", parents=[common], help="Ring or torus")
+    torus.add_argument("dims", type=int, nargs="+", help="Size of every dimension")
+    torus.add_argument("-p", "--hosts", type=int, default=1, help="Hosts per router")
+    hypercube = subparsers.add_parser("hypercube", parents=[common], help="Hypercube")
+    hypercube.add_argument("d", type=int, help="Number of dimensions")
+    hypercube.add_argument(
+        "-p", "--hosts", type=int, default=1, help="Hosts per router"
+    )
+    args = parser.parse_args(argv)
+
+    from . import generators
+
+    if args.family == "slimfly":
+        config = generators.slimfly(args.q, args.hosts)
+    elif args.family == "dragonfly":
+        config = generators.dragonfly(args.a, args.p, args.h)
+    elif args.family == "fat-tree":
+        config = generators.fat_tree(args.k)
+    elif args.family == "torus":
+        config = generators.torus(args.dims, args.hosts)
+    else:
+        config = generators.hypercube(args.d, args.hosts)
+    if args.app:
+        config = {"app": args.app, **config}
+
+    if args.output is None:
+        json.dump(config, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(config, f, indent=2)
+            f.write("\n")
+
+
+commands = {
+    "analyze": analyze_main,
+    "control": control_main,
+    "gen": gen_main,
+    "net": net_main,
+    "plan": plan_main,
+    "reconfigure": reconfigure_main,
+    "simulate": simulate_main,
+    "up": up_main,
+    "down": down_main,
+}
+
+
 def main():
-    parser = argparse.ArgumentParser()
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        commands[sys.argv[1]](sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(
+        epilog=f"other commands: {', '.join(commands)} (see toposim <command> --help)"
+    )
     parser.add_argument("prefix")
     parser.add_argument("filename")
     parser.add_argument(
@@ -15,7 +559,18 @@ def main():
         default=None,
         choices=application_registry.keys(),
     )
-    parser.add_argument("--subnet32", action="store", default="174")
+    parser.add_argument(
+        "--subnet32",
+        action="store",
+        default="174",
+        help="First octet of the default supernet",
+    )
+    parser.add_argument(
+        "--supernet",
+        action="store",
+        default=None,
+        help="Address range to allocate networks from (default: <subnet32>.0.0.0/8)",
+    )
     parser.add_argument(
         "-l",
         "--license",
@@ -23,7 +578,14 @@ def main():
         default=None,
         help="License file to use for tigergraph",
     )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Echo every generated file and print the routing table",
+    )
 
     args = parser.parse_args()
+    utils.verbose = args.verbose
 
-    generate(args.prefix, args.filename, args.app, args.subnet32)
+    generate(args.prefix, args.filename, args.app, args.subnet32, args.supernet)
@@ -0,0 +1,390 @@
+"""Apply network changes inside container namespaces over netlink.
+
+The generated scripts fork `sudo nsenter -t <pid> -n ip/tc ...` for every
+change. Instead, this module enters each container's network namespace once
+from a single privileged process, keeps a netlink socket bound to it, and
+applies all route, qdisc and link changes over that socket.
+"""
+
+import ctypes
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from .topology import Topology
+
+try:
+    from pyroute2 import IPRoute
+except ImportError:
+    IPRoute = None
+
+CLONE_NEWNET = 0x40000000
+TC_H_ROOT = 0xFFFFFFFF
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def setns(fd: int):
+    if _libc.setns(fd, CLONE_NEWNET) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+@contextmanager
+def entered(fd: int):
+    """Temporarily move the calling thread into the network namespace `fd`"""
+    orig = os.open("/proc/thread-self/ns/net", os.O_RDONLY)
+    setns(fd)
+    try:
+        yield
+    finally:
+        setns(orig)
+        os.close(orig)
+
+
+def pid_cache_path(topo: Topology) -> Path:
+    # Shared with run_in_ns_fn.sh
+    return Path(os.environ.get("TMPDIR", "/tmp")) / f"toposim_{topo.prefix}_pids"
+
+
+def proc_start_time(pid: int) -> Optional[str]:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces, so only split the fields after it
+    return stat.rsplit(") ", 1)[1].split()[19]
+
+
+def container_pids(topo: Topology) -> Dict[str, int]:
+    """Get the pid of every container in the topology.
+
+    Uses the pid cache written by the generated tools if every entry is still
+    valid, otherwise refreshes it with a single `docker inspect`.
+    """
+    containers = list(topo.nodes) + [p.name for p in topo.ports.values()]
+    cache = pid_cache_path(topo)
+    pids: Dict[str, int] = {}
+    try:
+        with open(cache) as f:
+            for line in f:
+                name, pid, *start = line.split()
+                if start and proc_start_time(int(pid)) == start[0]:
+                    pids[name] = int(pid)
+    except OSError:
+        pass
+    if all(c in pids for c in containers):
+        return pids
+
+    output = subprocess.run(
+        ["docker", "inspect", "-f", "{{.Name}} {{.State.Pid}}", *containers],
+        capture_output=True,
+        text=True,
+    ).stdout
+    pids = {}
+    lines = []
+    for line in output.splitlines():
+        name, pid = line.split()
+        name = name.lstrip("/")
+        pids[name] = int(pid)
+        lines.append(f"{name} {pid} {proc_start_time(int(pid)) or ''}\n")
+    tmp = cache.with_name(f"{cache.name}.{os.getpid()}")
+    with open(tmp, "w") as f:
+        f.writelines(lines)
+    os.replace(tmp, cache)
+
+    missing = [c for c in containers if not pids.get(c)]
+    if missing:
+        raise Exception(f"Containers are not running: {missing}")
+    return pids
+
+
+def create_veth(name: str, pid_a: int, pid_b: int):
+    """Create a veth pair with one end named `name` in the namespace of each pid"""
+    if IPRoute is None:
+        raise Exception(
+            "pyroute2 is required for native networking (pip install toposim[netns])"
+        )
+    with IPRoute() as ipr:
+        ipr.link(
+            "add",
+            ifname=name,
+            kind="veth",
+            net_ns_pid=pid_a,
+            peer={"ifname": name, "net_ns_pid": pid_b},
+        )
+
+
+class NetNS:
+    """A netlink connection bound to the network namespace of a process"""
+
+    def __init__(self, name: str, pid: int):
+        if IPRoute is None:
+            raise Exception(
+                "pyroute2 is required for native networking (pip install toposim[netns])"
+            )
+        self.name = name
+        self.fd = os.open(f"/proc/{pid}/ns/net", os.O_RDONLY)
+        # Netlink sockets stay bound to the namespace they were created in, so
+        # we only need to be inside the namespace while creating the socket.
+        with entered(self.fd):
+            self.ipr = IPRoute()
+        self.errors: List[str] = []
+        self.changes = 0
+
+    def close(self):
+        self.ipr.close()
+        os.close(self.fd)
+
+    def ifindex(self, ifname: str) -> int:
+        indices = self.ipr.link_lookup(ifname=ifname)
+        if not indices:
+            raise Exception(f"{self.name} has no interface {ifname}")
+        return indices[0]
+
+    def iface_for_address(self, address: str) -> str:
+        for addr in self.ipr.get_addr(family=2):
+            if addr.get("IFA_ADDRESS") == address:
+                return self.ipr.get_links(addr["index"])[0].get("ifname")
+        raise Exception(f"{self.name} has no interface with address {address}")
+
+    def sysctl(self, key: str, value: str):
+        # /proc/sys/net resolves to the namespace of the task opening the file
+        with entered(self.fd):
+            with open(f"/proc/sys/{key.replace('.', '/')}", "w") as f:
+                f.write(f"{value}\n")
+        self.changes += 1
+
+    def run(self, args: List[str], stdin=None):
+        """Run a command inside the namespace (for tools without a netlink API)"""
+        try:
+            subprocess.run(
+                args, stdin=stdin, check=True, preexec_fn=lambda: setns(self.fd)
+            )
+            self.changes += 1
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.errors.append(f"{self.name}: {' '.join(args)}: {e}")
+
+    def apply_line(self, line: str, check: bool = True):
+        """Apply a single command in the `ip -batch` syntax generated by toposim.
+
+        Supports `route`, `qdisc`, `link` and `addr` commands with the options
+        toposim emits. Like `ip -force -batch`, failures are recorded in
+        `errors` (unless `check` is False) instead of aborting the batch.
+        """
+        tokens = line.split()
+        if not tokens or tokens[0].startswith("#"):
+            return
+        obj, cmd, args = tokens[0], tokens[1], tokens[2:]
+        handlers = {
+            "route": self._route,
+            "qdisc": self._qdisc,
+            "link": self._link,
+            "addr": self._addr,
+        }
+        try:
+            if obj not in handlers:
+                raise Exception("unsupported command")
+            handlers[obj](cmd, args)
+            self.changes += 1
+        except Exception as e:
+            if check:
+                self.errors.append(f"{self.name}: {line}: {e}")
+
+    def apply_batch(self, lines: Iterable[str]):
+        for line in lines:
+            self.apply_line(line)
+
+    def _route(self, cmd: str, args: List[str]):
+        kwargs: dict = {"dst": args[0]}
+        nexthops: List[dict] = []
+        # Options following `nexthop` belong to that nexthop
+        target = kwargs
+        i = 1
+        while i < len(args):
+            if args[i] == "nexthop":
+                target = {}
+                nexthops.append(target)
+                i += 1
+            elif args[i] == "via":
+                target["gateway"] = args[i + 1]
+                i += 2
+            elif args[i] == "src":
+                target["prefsrc"] = args[i + 1]
+                i += 2
+            elif args[i] == "dev":
+                target["oif"] = self.ifindex(args[i + 1])
+                i += 2
+            else:
+                raise Exception(f"unsupported route option {args[i]}")
+        if nexthops:
+            kwargs["multipath"] = nexthops
+        self.ipr.route(cmd, **kwargs)
+
+    def _qdisc(self, cmd: str, args: List[str]):
+        assert args[0] == "dev" and args[2] == "root", "only root qdiscs are supported"
+        index = self.ifindex(args[1])
+        if cmd == "del":
+            self.ipr.tc("del", index=index, parent=TC_H_ROOT)
+            return
+        kind, params = args[3], args[4:]
+        kwargs: dict = {}
+        for key, val in zip(params[::2], params[1::2]):
+            kwargs[key] = val
+        if kind == "netem":
+            # pyroute2 expects the delay in microseconds
+            kwargs["delay"] = int(float(kwargs["delay"].removesuffix("ms")) * 1000)
+        elif kind == "tbf":
+            kwargs["burst"] = int(kwargs["burst"])
+        self.ipr.tc(cmd, kind, index, **kwargs)
+
+    def _link(self, cmd: str, args: List[str]):
+        if cmd == "add":
+            assert args[1] == "type"
+            self.ipr.link("add", ifname=args[0], kind=args[2])
+        elif cmd == "del":
+            if args[0] == "dev":
+                args = args[1:]
+            self.ipr.link("del", index=self.ifindex(args[0]))
+        elif cmd == "set":
+            if args[0] == "dev":
+                args = args[1:]
+            self.ipr.link("set", index=self.ifindex(args[0]), state=args[1])
+        else:
+            raise Exception(f"unsupported link command {cmd}")
+
+    def _addr(self, cmd: str, args: List[str]):
+        assert args[1] == "dev"
+        address, prefixlen = args[0].split("/")
+        self.ipr.addr(
+            cmd, index=self.ifindex(args[2]), address=address, prefixlen=int(prefixlen)
+        )
+
+
+class NetworkApplier:
+    """Apply changes to every container of a topology from one process"""
+
+    def __init__(self, directory: str, topo: Topology):
+        self.directory = Path(directory)
+        self.topo = topo
+        self.pids = container_pids(topo)
+        self.namespaces = {name: NetNS(name, pid) for name, pid in self.pids.items()}
+
+    def close(self):
+        for ns in self.namespaces.values():
+            ns.close()
+
+    def create_veths(self):
+        for net in self.topo.veth_networks:
+            a, b = net.devices
+            try:
+                create_veth(self.topo.veth_iface(net), self.pids[a], self.pids[b])
+                self.namespaces[a].changes += 1
+            except Exception as e:
+                self.namespaces[a].errors.append(f"{a}: veth {net.name} to {b}: {e}")
+
+    def apply_routes(self):
+        """Apply the files setup_networking would apply with `ip -batch`"""
+        self.create_veths()
+        networking = self.directory / "networking"
+        for name, ns in self.namespaces.items():
+            if (links := networking / f"{name}.links").exists():
+                ns.apply_batch(links.read_text().splitlines())
+            if (sysctl := networking / f"{name}.sysctl").exists():
+                for line in sysctl.read_text().splitlines():
+                    key, value = line.split("=")
+                    ns.sysctl(key.strip(), value.strip())
+            if (iptables := networking / f"{name}.iptables").exists():
+                with open(iptables) as f:
+                    ns.run(["iptables-restore", "--noflush"], stdin=f)
+            if (routes := networking / f"{name}.routes").exists():
+                ns.apply_batch(routes.read_text().splitlines())
+
+    def set_delay(self, delay_ms: int, change: bool):
+        """Same as add_delay/mod_delay: netem delay on every forwarding interface"""
+        cmd = "change" if change else "add"
+        for n, fwd in self.topo.forwarders.items():
+            for iface in self.topo.forwarding_ifaces(n):
+                self.namespaces[fwd.name].apply_line(
+                    f"qdisc {cmd} dev {iface} root netem delay {delay_ms}ms"
+                )
+
+    def _bandwidth_ifaces(self):
+        # Shape both ends of every network the node sends on: the node's end for
+        # its egress, and the other end for its ingress.
+        seen = set()
+        for n, node in self.topo.nodes.items():
+            if n in self.topo.ports:
+                networks = node.networks[:1]
+            else:
+                networks = node.networks[1:]
+            for net in networks:
+                for container, ip in net.devices.items():
+                    if (container, ip) in seen or container not in self.namespaces:
+                        continue
+                    seen.add((container, ip))
+                    ns = self.namespaces[container]
+                    yield ns, ns.iface_for_address(ip)
+
+    def set_bandwidth(self, kbit: int):
+        """Limit every node's upload and download bandwidth to `kbit`"""
+        # Allow bursts of 10ms worth of traffic (and at least one full packet)
+        burst = max(kbit * 1000 // 8 // 100, 1600)
+        for ns, iface in self._bandwidth_ifaces():
+            ns.apply_line(
+                f"qdisc replace dev {iface} root tbf rate {kbit}kbit burst {burst} latency 50ms"
+            )
+
+    def clear_bandwidth(self):
+        for ns, iface in self._bandwidth_ifaces():
+            # Deleting a qdisc that was never added is not an error
+            ns.apply_line(f"qdisc del dev {iface} root", check=False)
+
+    def apply_batch_file(self, container: str, filename: str):
+        with open(filename) as f:
+            self.namespaces[container].apply_batch(f.read().splitlines())
+
+    def report(self, elapsed: float) -> bool:
+        changes = sum(ns.changes for ns in self.namespaces.values())
+        errors = [e for ns in self.namespaces.values() for e in ns.errors]
+        for e in errors:
+            print(e, file=sys.stderr)
+        print(
+            f"applied {changes} changes in {len(self.namespaces)} namespaces "
+            f"in {elapsed:.3f}s ({len(errors)} errors)",
+            file=sys.stderr,
+        )
+        return len(errors) == 0
+
+
+def apply(
+    directory: str,
+    topo: Topology,
+    routes: bool = False,
+    delay: Optional[int] = None,
+    change_delay: bool = False,
+    bandwidth: Optional[int] = None,
+    clear_bandwidth: bool = False,
+    batches: Optional[Dict[str, str]] = None,
+) -> bool:
+    start = time.perf_counter()
+    applier = NetworkApplier(directory, topo)
+    try:
+        if routes:
+            applier.apply_routes()
+        if delay is not None:
+            applier.set_delay(delay, change_delay)
+        if clear_bandwidth:
+            applier.clear_bandwidth()
+        if bandwidth is not None:
+            applier.set_bandwidth(bandwidth)
+        for container, filename in (batches or {}).items():
+            applier.apply_batch_file(container, filename)
+    finally:
+        applier.close()
+    return applier.report(time.perf_counter() - start)
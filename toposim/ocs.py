@@ -0,0 +1,543 @@
+"""Groups connected through optical circuit switches (OCS), and the cost of
+traffic under every switch state.
+
+Groups are wired in racks of two. Every OCS connects two racks: in the bar
+state, the i-th group of one rack is linked to the i-th group of the other,
+and in the cross state to the other group. With k switches there are 2^k
+states, numbered so that the first switch is the most significant bit (a set
+bit is bar).
+
+Routes and the path-incidence tensor of every state are computed once, so the
+cost of a whole trace of traffic matrices under every state is a single tensor
+contraction instead of a walk along every path for every timestep.
+
+Past MAX_STATES states (a dozen switches), enumerating them is not feasible,
+and the cheapest states are found by local search over single switch flips
+instead. The same goes for relabelings of the groups (best_relabeling).
+
+plan_schedule picks the state of every timestep that minimizes the total cost
+of a trace when flipping switches costs something and takes time.
+"""
+
+import itertools
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .flows import next_hop_array, path_incidence
+from .graph import TopologyGraph
+from .topology import routing_table
+
+# Largest number of states that are enumerated
+MAX_STATES = 1 << 12
+# Timesteps searched at once by best_states
+SEARCH_BATCH = 256
+
+
+class OCSTopology:
+    num_groups: int
+    # Pairs of groups
+    racks: List[Tuple[int, int]]
+    # Pairs of racks (indices into `racks`) every OCS connects
+    switches: List[Tuple[int, int]]
+
+    # Name of every group
+    names: List[str]
+
+    _incidence: Optional[np.ndarray] = None
+    _hops: Optional[np.ndarray] = None
+
+    def __init__(
+        self,
+        racks: Sequence[Sequence[int]],
+        switches: Sequence[Sequence[int]],
+        names: Optional[Sequence[str]] = None,
+    ):
+        self.racks = [(a, b) for a, b in racks]
+        self.switches = [(a, b) for a, b in switches]
+        self.num_groups = 1 + max(g for rack in self.racks for g in rack)
+        groups = sorted(g for rack in self.racks for g in rack)
+        if groups != list(range(self.num_groups)):
+            raise Exception(f"Every group 0..n-1 must be in exactly one rack: {racks}")
+        for a, b in self.switches:
+            if not (0 <= a < len(self.racks) and 0 <= b < len(self.racks)) or a == b:
+                raise Exception(f"Invalid switch between racks {a} and {b}")
+        # States are stored in int64
+        if len(self.switches) > 62:
+            raise Exception(f"At most 62 switches are supported, got {len(switches)}")
+        self.names = [f"g{g}" for g in range(self.num_groups)]
+        if names is not None:
+            if len(names) != self.num_groups:
+                raise Exception(f"Expected {self.num_groups} group names: {names}")
+            self.names = list(names)
+
+    @classmethod
+    def pairs(cls, num_groups: int) -> "OCSTopology":
+        """Racks of the i-th and the (i + n / 2)-th group and a switch between
+        every pair of racks"""
+        if num_groups < 2 or num_groups % 2:
+            raise Exception(f"Cannot pair {num_groups} groups into racks")
+        half = num_groups // 2
+        racks = [(i, i + half) for i in range(half)]
+        return cls(racks, itertools.combinations(range(half), 2))
+
+    @classmethod
+    def slimfly(cls) -> "OCSTopology":
+        """The 6 groups of slimfly_3: racks (0, 3), (1, 4), (2, 5) and a switch
+        between every pair of racks"""
+        return cls.pairs(6)
+
+    @classmethod
+    def from_config(cls, data: dict) -> "OCSTopology":
+        """The model in the "reconfig" key of a config (or a generator's
+        output): {"racks": [[a, b], ...], "switches": [[i, j], ...]}.
+
+        Racks pair the config's groups, or its nodes, and are numbered in
+        order for "switches". Groups are numbered in the order of "groups"
+        and nodes in the order of "links", like the rows of traffic matrices.
+        Without "racks", the groups (or non-dummy nodes) are paired like
+        pairs() does, and without "switches" there is a switch between every
+        pair of racks. Only the links of racks and switches are modeled, not
+        the config's links.
+        """
+        groups = list(data.get("groups", {}))
+        reconfig = data.get("reconfig", {})
+        if not isinstance(reconfig, dict):
+            raise Exception('"reconfig" must be an object with "racks" and "switches"')
+        if "racks" not in reconfig:
+            dummies = set(data.get("dummyNodes", []))
+            names = groups or [n for n in data["links"] if n not in dummies]
+            racks = cls.pairs(len(names)).racks
+        else:
+            racks = reconfig["racks"]
+            for i, rack in enumerate(racks):
+                if not isinstance(rack, list) or len(rack) != 2:
+                    raise Exception(f'reconfig["racks"][{i}] must list two names')
+            for i, rack in enumerate(racks):
+                for n in rack:
+                    if n not in data["links"] and n not in groups:
+                        raise Exception(f'reconfig["racks"][{i}]: unknown name "{n}"')
+            members = [n for rack in racks for n in rack]
+            units = groups if set(members) <= set(groups) else list(data["links"])
+            order = {n: i for i, n in enumerate(units)}
+            if len(order.keys() & members) != len(set(members)):
+                raise Exception("Racks must pair either groups or nodes, not both")
+            if units is groups and len(set(members)) != len(groups):
+                missing = sorted(set(groups) - set(members))
+                raise Exception(f"Every group must be in a rack, missing {missing}")
+            names = sorted(set(members), key=order.__getitem__)
+            index = {n: i for i, n in enumerate(names)}
+            racks = [(index[a], index[b]) for a, b in racks]
+        switches = reconfig.get(
+            "switches", list(itertools.combinations(range(len(racks)), 2))
+        )
+        for i, switch in enumerate(switches):
+            if not isinstance(switch, list | tuple) or len(switch) != 2:
+                raise Exception(f'reconfig["switches"][{i}] must list two racks')
+        return cls(racks, switches, names)
+
+    @property
+    def num_states(self) -> int:
+        return 1 << len(self.switches)
+
+    def bar(self, state: int) -> List[bool]:
+        """Whether every switch is in the bar state"""
+        k = len(self.switches)
+        return [bool(state >> (k - 1 - i) & 1) for i in range(k)]
+
+    def links(self, state: int) -> Dict[str, List[str]]:
+        """Links between groups in `state`, as in a config"""
+        links: Dict[str, List[str]] = {name: [] for name in self.names}
+
+        def link(a: int, b: int):
+            links[self.names[a]].append(self.names[b])
+            links[self.names[b]].append(self.names[a])
+
+        for a, b in self.racks:
+            link(a, b)
+        for bar, (r1, r2) in zip(self.bar(state), self.switches):
+            a, b = self.racks[r1], self.racks[r2]
+            for i in range(2):
+                link(a[i], b[i] if bar else b[1 - i])
+        return links
+
+    def graph(self, state: int) -> TopologyGraph:
+        return TopologyGraph.from_links(self.links(state))
+
+    def incidence(self) -> np.ndarray:
+        """(states x G * G x G * G) tensor: the fraction of the traffic from
+        group s to group d that every state sends from group u to group v is at
+        [state, s * G + d, u * G + v]. Traffic within a group is counted once
+        at [state, s * G + s, s * G + s], like the heatmap scripts do."""
+        if self._incidence is not None:
+            return self._incidence
+        n = self.num_groups
+        src, dst = np.divmod(np.arange(n * n), n)
+        incidence = np.zeros((self.num_states, n * n, n * n))
+        for state in self._all_states():
+            graph = self.graph(state)
+            hops, counts = next_hop_array(graph, routing_table(graph, False))
+            flow, arc, fraction = path_incidence(graph, hops, counts, src, dst)
+            cell = graph.sources()[arc] * n + graph.indices[arc]
+            np.add.at(incidence[state], (flow, cell), fraction)
+        diagonal = np.arange(n) * (n + 1)
+        incidence[:, diagonal, diagonal] = 1
+        self._incidence = incidence
+        return incidence
+
+    def _all_states(self) -> np.ndarray:
+        if self.num_states > MAX_STATES:
+            raise Exception(
+                f"{self.num_states} states are too many to enumerate, search them"
+            )
+        return np.arange(self.num_states)
+
+    def adjacency(self, states: Sequence[int]) -> np.ndarray:
+        """(len(states) x G x G) whether two groups are linked in every state"""
+        states = np.asarray(states, np.int64)
+        n = self.num_groups
+        rows = np.arange(len(states))
+        adjacency = np.zeros((len(states), n, n), bool)
+        for a, b in self.racks:
+            adjacency[:, a, b] = adjacency[:, b, a] = True
+        k = len(self.switches)
+        for i, (r1, r2) in enumerate(self.switches):
+            bar = (states >> (k - 1 - i) & 1).astype(bool)
+            a, b = self.racks[r1], self.racks[r2]
+            for j in range(2):
+                other = np.where(bar, b[j], b[1 - j])
+                adjacency[rows, a[j], other] = adjacency[rows, other, a[j]] = True
+        return adjacency
+
+    def distances(self, states: Sequence[int]) -> np.ndarray:
+        """(len(states) x G x G) number of links from every group to every
+        group (0 to itself) in every state, by breadth-first search from all
+        groups at once"""
+        adjacency = self.adjacency(states)
+        n = self.num_groups
+        distances = np.zeros(adjacency.shape, np.int64)
+        reached = np.broadcast_to(np.eye(n, dtype=bool), adjacency.shape).copy()
+        frontier = reached
+        links = adjacency.astype(np.float32)
+        for step in range(1, n):
+            frontier = (frontier.astype(np.float32) @ links > 0) & ~reached
+            if not frontier.any():
+                break
+            distances[frontier] = step
+            reached |= frontier
+        if not reached.all():
+            raise Exception("Some groups are not connected in every state")
+        return distances
+
+    def state_hops(self, states: Sequence[int]) -> np.ndarray:
+        """(len(states) x G x G) number of links from every group to every
+        other group (1 within a group) in every state"""
+        hops = self.distances(states)
+        diagonal = np.arange(self.num_groups)
+        hops[:, diagonal, diagonal] = 1
+        return hops
+
+    def next_hops(self, states: Optional[Sequence[int]] = None) -> np.ndarray:
+        """(states x G x G) group that traffic from every group to every other
+        group is sent to first (the group itself within a group), for every
+        state or the given ones"""
+        if states is None:
+            states = self._all_states()
+        distances = self.distances(states)
+        # Lowest neighbor u of s that is one link closer to d
+        closer = distances[:, None, :, :] == distances[:, :, None, :] - 1
+        closer &= self.adjacency(states)[:, :, :, None]
+        next_hops = closer.argmax(axis=2)
+        diagonal = np.arange(self.num_groups)
+        next_hops[:, diagonal, diagonal] = diagonal
+        return next_hops
+
+    def hops(self) -> np.ndarray:
+        """(states x G x G) number of links from every group to every other
+        group (1 within a group)"""
+        if self._hops is None:
+            self._hops = self.state_hops(self._all_states())
+        return self._hops
+
+    def link_loads(self, matrices: np.ndarray) -> np.ndarray:
+        """(T x states x G x G) traffic every state sends from group to group,
+        for (T x G x G) traffic matrices"""
+        n = self.num_groups
+        traffic = matrices.reshape(len(matrices), n * n)
+        loads = np.einsum("tp,kpc->tkc", traffic, self.incidence())
+        return loads.reshape(len(matrices), self.num_states, n, n)
+
+    def costs(
+        self, matrices: np.ndarray, states: Optional[Sequence[int]] = None
+    ) -> np.ndarray:
+        """(T x states) bytes times the links they cross, for (T x G x G)
+        traffic matrices and every state (or the given ones)"""
+        hops = self.hops() if states is None else self.state_hops(states)
+        return np.einsum("tsd,ksd->tk", matrices, hops)
+
+    def switch_states(self, matrices: np.ndarray) -> np.ndarray:
+        """The state that sets every switch to bar if more traffic flows between
+        the groups bar links than between the groups cross links, for every
+        (G x G) matrix of (T x G x G)"""
+        matrices = np.asarray(matrices)
+        state = np.zeros(len(matrices), np.int64)
+        for r1, r2 in self.switches:
+            (a0, a1), (b0, b1) = self.racks[r1], self.racks[r2]
+            both = matrices + matrices.transpose(0, 2, 1)
+            bar = both[:, a0, b0] + both[:, a1, b1] > both[:, a0, b1] + both[:, a1, b0]
+            state = state << 1 | bar
+        return state
+
+    def _search(self, matrices: np.ndarray, states: np.ndarray) -> np.ndarray:
+        """Flip the switch that lowers the cost of every matrix the most,
+        starting from `states`, until no flip does"""
+        n = self.num_groups
+        k = len(self.switches)
+        flips = np.int64(1) << np.arange(k - 1, -1, -1)
+        states = states.copy()
+        costs = np.einsum("tsd,tsd->t", matrices, self.state_hops(states))
+        active = np.arange(len(states))
+        while active.size:
+            neighbors = states[active, None] ^ flips
+            hops = self.state_hops(neighbors.ravel()).reshape(-1, k, n, n)
+            neighbor_costs = np.einsum("tsd,tksd->tk", matrices[active], hops)
+            best = neighbor_costs.argmin(axis=1)
+            best_costs = neighbor_costs[np.arange(active.size), best]
+            better = best_costs < costs[active]
+            states[active[better]] = neighbors[better, best[better]]
+            costs[active[better]] = best_costs[better]
+            active = active[better]
+        return states
+
+    def best_states(self, matrices: np.ndarray) -> np.ndarray:
+        """The cheapest state for every (G x G) matrix of (T x G x G).
+
+        With at most MAX_STATES states they are all compared. Otherwise, every
+        matrix starts from its switch_states() and moves to the cheapest
+        state that differs in one switch while that lowers its cost, so the
+        result is a local optimum.
+        """
+        matrices = np.asarray(matrices)
+        if self.num_states <= MAX_STATES:
+            return self.costs(matrices).argmin(axis=1)
+        states = self.switch_states(matrices)
+        for start in range(0, len(matrices), SEARCH_BATCH):
+            batch = slice(start, start + SEARCH_BATCH)
+            states[batch] = self._search(matrices[batch], states[batch])
+        return states
+
+    def candidate_states(self, matrices: np.ndarray) -> np.ndarray:
+        """Sorted states worth comparing for (T x G x G) matrices: all of them
+        if they can be enumerated, otherwise the static state 0 and the states
+        switch_states() and best_states() pick"""
+        if self.num_states <= MAX_STATES:
+            return np.arange(self.num_states)
+        picked = [[0], self.switch_states(matrices), self.best_states(matrices)]
+        return np.unique(np.concatenate(picked))
+
+
+def best_relabeling(
+    matrix: np.ndarray, hops: np.ndarray, relabeling: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Relabeling p of the groups that makes the cost of sending
+    matrix[p[s], p[d]] over hops[s, d] from every s to every d locally
+    minimal: the pair of groups whose swap lowers the cost the most is
+    swapped until no swap does, starting from `relabeling` (or the identity).
+
+    The change in cost of every swap is computed at once from the current
+    relabeled matrix (Taillard's delta for the quadratic assignment problem),
+    so every step takes O(G^3).
+    """
+    n = len(matrix)
+    p = np.arange(n) if relabeling is None else np.array(relabeling)
+    h = np.asarray(hops, np.int64)
+    hd = np.diag(h)
+    for _ in range(n * n):
+        r = np.asarray(matrix, np.int64)[p[:, None], p[None, :]]
+        rd = np.diag(r)
+        # Sums over every k of the rows and columns the swap of i and j changes
+        cols = h.T @ r
+        rows = h @ r.T
+        cd = np.diag(cols)
+        rwd = np.diag(rows)
+        delta = cols + cols.T - cd[:, None] - cd[None, :]
+        delta += rows + rows.T - rwd[:, None] - rwd[None, :]
+        # Minus the terms of k = i and k = j, which the swap changes differently
+        hi, hj = hd[:, None], hd[None, :]
+        ri, rj = rd[:, None], rd[None, :]
+        delta -= (hi - h) * (r - ri) + (hi - h.T) * (r.T - ri)
+        delta -= (h.T - hj) * (rj - r.T) + (h - hj) * (rj - r)
+        delta += (hi - hj) * (rj - ri) + (h - h.T) * (r.T - r)
+        i, j = np.unravel_index(delta.argmin(), delta.shape)
+        if delta[i, j] >= 0:
+            break
+        p[[i, j]] = p[[j, i]]
+    return p
+
+
+def popcount(x: np.ndarray) -> np.ndarray:
+    """Number of set bits of every (non-negative) element"""
+    x = np.array(x, np.int64)
+    count = np.zeros(x.shape, np.int64)
+    while x.any():
+        count += x & 1
+        x >>= 1
+    return count
+
+
+@dataclass
+class Schedule:
+    # State of the switches in every timestep
+    states: np.ndarray
+    # (T,) cost of the traffic of every timestep, part of which is sent in the
+    # previous state while switches are flipped
+    traffic: np.ndarray
+    # (T,) switches flipped at the start of every timestep
+    flips: np.ndarray
+    # Cost of flipping a switch
+    switch_cost: float
+    # Total cost of staying in the initial state
+    static_cost: float
+    # Total cost of moving to the best fixed state once
+    best_static_cost: float
+
+    @property
+    def cost(self) -> float:
+        return float(self.traffic.sum() + self.switch_cost * self.flips.sum())
+
+    def report(self) -> dict:
+        return {
+            "cost": self.cost,
+            "trafficCost": float(self.traffic.sum()),
+            "flips": int(self.flips.sum()),
+            "switchingCost": float(self.switch_cost * self.flips.sum()),
+            "staticCost": self.static_cost,
+            "bestStaticCost": self.best_static_cost,
+            "savingsVsStatic": self.static_cost - self.cost,
+            "savingsVsBestStatic": self.best_static_cost - self.cost,
+            "timesteps": [
+                {"state": int(state), "flips": int(flips), "cost": float(cost)}
+                for state, flips, cost in zip(
+                    self.states.tolist(), self.flips.tolist(), self.traffic.tolist()
+                )
+            ],
+        }
+
+
+def plan_schedule(
+    costs: np.ndarray,
+    states: Optional[Sequence[int]] = None,
+    switch_cost: float = 0.0,
+    downtime: float = 0.0,
+    initial: int = 0,
+) -> Schedule:
+    """The schedule of states with the lowest total cost for (T x S) `costs`
+    of the traffic of every timestep in every state of `states` (all 0..S-1
+    by default), by dynamic programming over the timesteps (Viterbi).
+
+    The switches start in `initial`. Every switch flipped costs
+    `switch_cost`, and flipping takes `downtime` of an interval (0 to 1),
+    during which the traffic is sent in the previous state.
+
+    Every step takes O(S * k) for all 2^k states, as the cheapest way to
+    reach a state is relaxed one switch at a time, and O(S^2) for other sets
+    of states.
+    """
+    costs = np.asarray(costs, np.float64)
+    num_steps, num_states = costs.shape
+    states = np.arange(num_states) if states is None else np.asarray(states, np.int64)
+    if not 0 <= downtime <= 1:
+        raise Exception(f"downtime must be a fraction of an interval, got {downtime}")
+    start = np.flatnonzero(states == initial)
+    if not start.size:
+        raise Exception(f"The initial state {initial} is not one of the states")
+
+    k = int(states.max()).bit_length()
+    hypercube = num_states == 1 << k and np.array_equal(states, np.arange(num_states))
+    if not hypercube:
+        distance = popcount(states[:, None] ^ states[None, :])
+    columns = np.arange(num_states)
+
+    # total[s]: cost of the cheapest schedule so far that ends in states[s]
+    total = np.full(num_states, np.inf)
+    total[start[0]] = 0
+    previous = np.zeros((num_steps, num_states), np.int64)
+    for t in range(num_steps):
+        # Traffic sent in the previous state while switching
+        leaving = total + downtime * costs[t]
+        if hypercube:
+            best, came_from = leaving, columns
+            for bit in range(k):
+                neighbors = columns ^ (1 << bit)
+                moved = best[neighbors] + switch_cost
+                better = moved < best
+                best = np.where(better, moved, best)
+                came_from = np.where(better, came_from[neighbors], came_from)
+        else:
+            moves = leaving[:, None] + switch_cost * distance
+            came_from = moves.argmin(axis=0)
+            best = moves[came_from, columns]
+        previous[t] = came_from
+        total = best + (1 - downtime) * costs[t]
+
+    path = np.zeros(num_steps, np.int64)
+    if num_steps:
+        path[-1] = total.argmin()
+    for t in range(num_steps - 1, 0, -1):
+        path[t - 1] = previous[t, path[t]]
+    return evaluate_schedule(
+        costs, states, states[path], switch_cost, downtime, initial
+    )
+
+
+def evaluate_schedule(
+    costs: np.ndarray,
+    states: Sequence[int],
+    schedule: Sequence[int],
+    switch_cost: float = 0.0,
+    downtime: float = 0.0,
+    initial: int = 0,
+) -> Schedule:
+    """The cost of using state schedule[t] in every timestep t, for (T x S)
+    `costs` of the traffic of every timestep in every state of `states`, like
+    plan_schedule counts it"""
+    costs = np.asarray(costs, np.float64)
+    states = np.asarray(states, np.int64)
+    order = np.argsort(states)
+    columns = order[np.searchsorted(states, schedule, sorter=order)]
+    start = np.flatnonzero(states == initial)
+    if not start.size or not np.array_equal(states[columns], schedule):
+        raise Exception("The schedule uses states whose costs are not given")
+    before = np.concatenate([start, columns[:-1]])
+    steps = np.arange(len(costs))
+    traffic = costs[steps, columns]
+    traffic += downtime * (costs[steps, before] - traffic)
+
+    # Moving to one state in the first timestep and staying there
+    fixed = costs.sum(axis=0) + switch_cost * popcount(states ^ initial)
+    if len(costs):
+        fixed += downtime * (costs[0, start[0]] - costs[0])
+    return Schedule(
+        states[columns],
+        traffic,
+        popcount(states[columns] ^ states[before]),
+        switch_cost,
+        float(costs[:, start[0]].sum()),
+        float(fixed.min()),
+    )
+
+
+def format_schedule(schedule: Schedule) -> str:
+    report = schedule.report()
+    lines = [f"{'timestep':>8} {'state':>12} {'flips':>6} {'cost':>16}"]
+    for t, r in enumerate(report["timesteps"]):
+        lines.append(f"{t:>8} {r['state']:>12} {r['flips']:>6} {r['cost']:>16.0f}")
+    lines.append(f"{'total':>8} {'':>12} {report['flips']:>6} {report['cost']:>16.0f}")
+    for name, key in (("static", "staticCost"), ("best static", "bestStaticCost")):
+        saved = report[key] - report["cost"]
+        lines.append(
+            f"savings vs {name}: {saved:.0f} "
+            f"({100 * saved / report[key] if report[key] else 0:.2f}%)"
+        )
+    return "\n".join(lines)
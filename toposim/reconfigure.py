@@ -0,0 +1,391 @@
+"""Change the links of a running cluster in place.
+
+Instead of regenerating the cluster and restarting every container, diff the
+old and new Topology and only apply the difference: networks for new links are
+created and connected, routes that changed are replaced, and networks of
+removed links are disconnected and deleted. New paths are installed before old
+ones are removed (make-before-break), so traffic only takes a brief detour
+while routes are being replaced.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import (
+    build_topology,
+    generate_scripts,
+    load_metadata,
+    load_topology,
+    nexthop_spec,
+    veth_setup,
+)
+from .application import application_registry
+from .artifacts import Artifacts
+from .docker import docker_network_name, project_name
+from .netns import NetNS, container_pids, create_veth
+from .topology import Network, Topology
+
+
+@dataclass
+class Plan:
+    topo: Topology
+    # Networks for new links
+    create: List[Network] = field(default_factory=lambda: [])
+    # Networks of removed links
+    remove: List[Network] = field(default_factory=lambda: [])
+    # container -> `ip -batch` lines adding or replacing routes
+    replace_routes: Dict[str, List[str]] = field(default_factory=lambda: {})
+    # container -> `ip -batch` lines deleting routes that no longer exist
+    delete_routes: Dict[str, List[str]] = field(default_factory=lambda: {})
+    # sysctls to set on every forwarder
+    sysctls: Dict[str, str] = field(default_factory=lambda: {})
+
+    def empty(self) -> bool:
+        return not (
+            self.create
+            or self.remove
+            or self.replace_routes
+            or self.delete_routes
+            or self.sysctls
+        )
+
+    def create_commands(self) -> List[List[str]]:
+        project = project_name(self.topo)
+        return [
+            [
+                "docker",
+                "network",
+                "create",
+                "--driver",
+                "bridge",
+                "--subnet",
+                str(net.subnet),
+                "--gateway",
+                net.gateway,
+                "--label",
+                f"com.docker.compose.project={project}",
+                "--label",
+                f"com.docker.compose.network={net.name}",
+                docker_network_name(self.topo, net),
+            ]
+            for net in self.create
+            if not net.veth
+        ]
+
+    def veth_pairs(self) -> List[Tuple[str, str, str]]:
+        """(interface, container, container) of every new veth link"""
+        return [
+            (self.topo.veth_iface(net), *net.devices) for net in self.create if net.veth
+        ]
+
+    def veth_commands(self, pid: Callable[[str], str]) -> List[List[str]]:
+        """Commands creating the veth pairs of new links, run on the host"""
+        return [
+            ["ip", "link", "add", iface, "netns", pid(a), "type", "veth"]
+            + ["peer", "name", iface, "netns", pid(b)]
+            for iface, a, b in self.veth_pairs()
+        ]
+
+    def link_batches(self) -> Dict[str, List[str]]:
+        """container -> `ip -batch` lines bringing up its end of new veth links"""
+        res: Dict[str, List[str]] = {}
+        for net in self.create:
+            if net.veth:
+                for container, lines in veth_setup(self.topo, net).items():
+                    res.setdefault(container, []).extend(lines)
+        return res
+
+    def unlink_batches(self) -> Dict[str, List[str]]:
+        """container -> `ip -batch` lines deleting removed veth links.
+
+        Deleting one end of a pair deletes the other end as well.
+        """
+        res: Dict[str, List[str]] = {}
+        for net in self.remove:
+            if net.veth:
+                container = next(iter(net.devices))
+                line = f"link del {self.topo.veth_iface(net)}"
+                res.setdefault(container, []).append(line)
+        return res
+
+    def connect_commands(self) -> List[List[str]]:
+        return [
+            [
+                "docker",
+                "network",
+                "connect",
+                "--ip",
+                ip,
+                docker_network_name(self.topo, net),
+                container,
+            ]
+            for net in self.create
+            if not net.veth
+            for container, ip in net.devices.items()
+        ]
+
+    def disconnect_commands(self) -> List[List[str]]:
+        return [
+            [
+                "docker",
+                "network",
+                "disconnect",
+                "-f",
+                docker_network_name(self.topo, net),
+                container,
+            ]
+            for net in self.remove
+            if not net.veth
+            for container in net.devices
+        ]
+
+    def remove_commands(self) -> List[List[str]]:
+        return [
+            ["docker", "network", "rm", docker_network_name(self.topo, net)]
+            for net in self.remove
+            if not net.veth
+        ]
+
+    def describe(self, output: Callable[..., None]):
+        """Write the plan as the equivalent shell commands"""
+
+        def pid(container: str) -> str:
+            return f"$(docker inspect -f '{{{{.State.Pid}}}}' {container})"
+
+        def nsenter(container: str) -> str:
+            return f"sudo nsenter -t {pid(container)} -n"
+
+        def batches(batch: Dict[str, List[str]]):
+            for container, lines in batch.items():
+                output(f"{nsenter(container)} ip -force -batch - <<EOF")
+                for line in lines:
+                    output(line)
+                output("EOF")
+
+        for cmd in self.create_commands() + self.connect_commands():
+            output(" ".join(cmd))
+        for cmd in self.veth_commands(pid):
+            output("sudo " + " ".join(cmd))
+        batches(self.link_batches())
+        for fwd in self.topo.forwarders.values():
+            for key, value in self.sysctls.items():
+                output(f"{nsenter(fwd.name)} sysctl -w {key}={value}")
+        batches(self.replace_routes)
+        batches(self.delete_routes)
+        for cmd in self.disconnect_commands():
+            output(" ".join(cmd))
+        batches(self.unlink_batches())
+        for cmd in self.remove_commands():
+            output(" ".join(cmd))
+
+
+def plan(old: Topology, new: Topology) -> Plan:
+    """Compute the changes needed to turn a cluster running `old` into `new`.
+
+    `new` must have been built with `previous=old` so that networks of links
+    present in both topologies are identical.
+    """
+    res = Plan(new)
+    old_networks = {net.name: net for net in old.networks}
+    new_networks = {net.name: net for net in new.networks}
+    res.create = [net for name, net in new_networks.items() if name not in old_networks]
+    res.remove = [net for name, net in old_networks.items() if name not in new_networks]
+
+    old_routes = old.container_routes()
+    for container, routes in new.container_routes().items():
+        prev = old_routes.get(container, {})
+        src = new.route_source(container)
+        replace = [
+            f"route replace {dst} {nexthop_spec(hops, src)}"
+            for dst, hops in routes.items()
+            if prev.get(dst) != hops
+        ]
+        delete = [f"route del {dst}" for dst in prev if dst not in routes]
+        if replace:
+            res.replace_routes[container] = replace
+        if delete:
+            res.delete_routes[container] = delete
+
+    if new.ecmp and (not old.ecmp or old.ecmp_hash_policy != new.ecmp_hash_policy):
+        res.sysctls["net.ipv4.fib_multipath_hash_policy"] = str(new.ecmp_hash_policy)
+    return res
+
+
+class Reconfigurer:
+    """Apply a Plan to the running cluster, timing every phase"""
+
+    def __init__(self, plan: Plan, native: bool, jobs: int):
+        self.plan = plan
+        self.native = native
+        self.pool = ThreadPoolExecutor(max_workers=jobs)
+        self.pids = container_pids(plan.topo)
+        self.errors: List[str] = []
+        self.timings: List[Tuple[str, float]] = []
+
+    def phase(self, name: str, fn: Callable[[], None]):
+        start = time.perf_counter()
+        fn()
+        self.timings.append((name, time.perf_counter() - start))
+
+    def _run(self, args: List[str], stdin: Optional[str] = None):
+        res = subprocess.run(args, input=stdin, capture_output=True, text=True)
+        if res.returncode != 0:
+            self.errors.append(f"{' '.join(args)}: {res.stderr.strip()}")
+
+    def run_all(self, commands: List[List[str]]):
+        list(self.pool.map(self._run, commands))
+
+    def _nsenter(self, container: str) -> List[str]:
+        sudo = [] if os.geteuid() == 0 else ["sudo"]
+        return sudo + ["nsenter", "-t", str(self.pids[container]), "-n"]
+
+    def _apply_batch(self, container: str, lines: List[str]):
+        if self.native:
+            ns = NetNS(container, self.pids[container])
+            try:
+                ns.apply_batch(lines)
+            finally:
+                ns.close()
+            self.errors += ns.errors
+        else:
+            self._run(
+                self._nsenter(container) + ["ip", "-force", "-batch", "-"],
+                stdin="\n".join(lines) + "\n",
+            )
+
+    def apply_batches(self, batches: Dict[str, List[str]]):
+        list(self.pool.map(lambda c: self._apply_batch(c, batches[c]), batches))
+
+    def create_veths(self):
+        if not self.native:
+            sudo = [] if os.geteuid() == 0 else ["sudo"]
+            commands = self.plan.veth_commands(lambda c: str(self.pids[c]))
+            self.run_all([sudo + cmd for cmd in commands])
+            return
+
+        def create(pair: Tuple[str, str, str]):
+            iface, a, b = pair
+            try:
+                create_veth(iface, self.pids[a], self.pids[b])
+            except Exception as e:
+                self.errors.append(f"veth {iface} between {a} and {b}: {e}")
+
+        list(self.pool.map(create, self.plan.veth_pairs()))
+
+    def create_networks(self):
+        self.run_all(self.plan.create_commands())
+        self.create_veths()
+
+    def connect_networks(self):
+        self.run_all(self.plan.connect_commands())
+        self.apply_batches(self.plan.link_batches())
+
+    def disconnect_networks(self):
+        self.run_all(self.plan.disconnect_commands())
+        self.apply_batches(self.plan.unlink_batches())
+
+    def set_sysctls(self):
+        commands = [
+            self._nsenter(fwd.name) + ["sysctl", "-q", "-w", f"{key}={value}"]
+            for fwd in self.plan.topo.forwarders.values()
+            for key, value in self.plan.sysctls.items()
+        ]
+        self.run_all(commands)
+
+    def apply(self):
+        p = self.plan
+        self.phase("create networks", self.create_networks)
+        self.phase("connect networks", self.connect_networks)
+        self.phase("sysctls", self.set_sysctls)
+        self.phase("replace routes", lambda: self.apply_batches(p.replace_routes))
+        self.phase("delete routes", lambda: self.apply_batches(p.delete_routes))
+        self.phase("disconnect networks", self.disconnect_networks)
+        self.phase("remove networks", lambda: self.run_all(p.remove_commands()))
+        self.pool.shutdown()
+
+    def report(self) -> bool:
+        p = self.plan
+        for e in self.errors:
+            print(e, file=sys.stderr)
+        for name, elapsed in self.timings:
+            print(f"{name:<20} {elapsed:.3f}s", file=sys.stderr)
+        timings = dict(self.timings)
+        # Paths change between the first route replacement and the last
+        # deletion; everything else happens while traffic uses the old or the
+        # new paths.
+        switchover = timings["replace routes"] + timings["delete routes"]
+        num_routes = sum(len(l) for l in p.replace_routes.values()) + sum(
+            len(l) for l in p.delete_routes.values()
+        )
+        print(
+            f"added {len(p.create)} and removed {len(p.remove)} networks, "
+            f"changed {num_routes} routes in "
+            f"{len(p.replace_routes.keys() | p.delete_routes.keys())} containers; "
+            f"switchover took {switchover:.3f}s, "
+            f"total {sum(timings.values()):.3f}s ({len(self.errors)} errors)",
+            file=sys.stderr,
+        )
+        return len(self.errors) == 0
+
+
+def save_history(directory: Path, filename: str) -> str:
+    """Record `filename` as the current config of `directory`"""
+    metadata = load_metadata(str(directory))
+    history = metadata.get("history")
+    if history is None:
+        shutil.copy(directory / "topology.json", directory / "topology.0.json")
+        history = ["topology.0.json"]
+    config = f"topology.{len(history)}.json"
+    shutil.copy(filename, directory / config)
+    shutil.copy(filename, directory / "topology.json")
+    metadata["history"] = history + [config]
+    with open(directory / ".toposim.json", "w") as f:
+        json.dump(metadata, f)
+    return config
+
+
+def reconfigure(
+    directory: str,
+    filename: str,
+    dry_run: bool = False,
+    native: bool = False,
+    jobs: int = 32,
+) -> bool:
+    metadata = load_metadata(directory)
+    with open(filename) as f:
+        data = json.load(f)
+    old = load_topology(directory)
+    new = build_topology(metadata["prefix"], data, metadata["supernet"], old)
+    changes = plan(old, new)
+
+    if dry_run:
+        changes.describe(print)
+        return True
+    if changes.empty():
+        print("topology is unchanged", file=sys.stderr)
+        return True
+
+    reconfigurer = Reconfigurer(changes, native, jobs)
+    reconfigurer.apply()
+    ok = reconfigurer.report()
+
+    # Keep the generated files in sync with the running cluster, so that the
+    # other tools (and further reconfigurations) see the new topology.
+    save_history(Path(directory), filename)
+    app = application_registry[metadata["app"]]()
+    app.initialize(new)
+    out = Artifacts()
+    generate_scripts(app, new, out)
+    # setup_networking applies every file in networking/, so drop the files
+    # the new topology does not have (e.g. the veth links of a container whose
+    # last veth link was removed)
+    out.write_to(directory, prune=["networking"])
+    return ok
@@ -2,11 +2,22 @@
 # a customizable delay
 set -x
 
+parser=$({
+  argparsh new $0 -d "Add a 25ms delay on every network interface"
+  argparsh add_arg --action store_true --helptext "Apply all changes from a single toposim process" -- "--native"
+})
+eval $(argparsh parse $parser -- "$@")
+
+if [ "$native" == "True" ]; then
+  sudo "$(command -v toposim)" net apply $(dirname $0) --delay 25
+  exit $?
+fi
+
 {% include 'run_in_ns_fn.sh' %}
 
-{%- for p in topo.ports.values() +%}
-  {%- for i in range(p.networks | length) +%}
-run_in_ns {{p.name}} tc qdisc add dev eth{{i}} root netem delay 25ms &
+{%- for (n, fwd) in topo.forwarders.items() +%}
+  {%- for iface in topo.forwarding_ifaces(n) +%}
+run_in_ns {{fwd.name}} tc qdisc add dev {{iface}} root netem delay 25ms &
   {%- endfor %}
 {%- endfor %}
-wait"
+wait
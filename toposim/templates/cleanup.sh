@@ -15,7 +15,7 @@ cleanup {{n}} &
 
 wait
 
-{% for net in topo.networks +%}
+{% for net in topo.bridge_networks +%}
 {%- set net_name = topo.prefix + "_" + net.name %}
 {%- set net_name = net_name.lower() %}
 docker network rm {{net_name}}
@@ -4,14 +4,20 @@ set -x
 parser=$({
   argparsh new $0 -d "Modify delay on network interfaces"
   argparsh add_arg --type int -- "delay"
+  argparsh add_arg --action store_true --helptext "Apply all changes from a single toposim process" -- "--native"
 })
 eval $(argparsh parse $parser -- "$@")
 
+if [ "$native" == "True" ]; then
+  sudo "$(command -v toposim)" net apply $(dirname $0) --delay $delay --change
+  exit $?
+fi
+
 {% include 'run_in_ns_fn.sh' %}
 
-{%- for p in topo.ports.values() +%}
-  {%- for i in range(p.networks | length) +%}
-run_in_ns {{p.name}} tc qdisc change dev eth{{i}} root netem delay ${delay}ms &
+{%- for (n, fwd) in topo.forwarders.items() +%}
+  {%- for iface in topo.forwarding_ifaces(n) +%}
+run_in_ns {{fwd.name}} tc qdisc change dev {{iface}} root netem delay ${delay}ms &
   {%- endfor %}
 {%- endfor %}
-wait"
+wait
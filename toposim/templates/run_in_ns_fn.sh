@@ -1,5 +1,88 @@
+# Container pids are cached in $PID_CACHE as "<name> <pid> <start time>" so
+# that tools don't need to ask the docker daemon for every command. A cached pid
+# is only trusted while /proc/<pid>/stat reports the same start time, so a
+# restarted container invalidates the cache.
+PID_CACHE=${TMPDIR:-/tmp}/toposim_{{topo.prefix}}_pids
+declare -A _pids _pid_starts
+
+# Sets $start to the start time (in clock ticks since boot) of process $1
+_proc_start_time() {
+  start=""
+  local stat
+  read -r stat 2>/dev/null < /proc/$1/stat || return 0
+  # The command name may contain spaces, so only split the fields after it
+  local fields=(${stat##*) })
+  start=${fields[19]}
+}
+
+_load_pid_cache() {
+  _pids=()
+  _pid_starts=()
+  [ -e $PID_CACHE ] || return 0
+  local name p s
+  while read -r name p s; do
+    _pids[$name]=$p
+    _pid_starts[$name]=$s
+  done < $PID_CACHE
+}
+
+# Set once this script refreshed the cache. The cache is refreshed at most once
+# per run, so a container that is not running never costs more than one
+# docker inspect per script.
+_pids_refreshed=""
+
+# Refresh the cached pid of every container with a single docker inspect
+refresh_pid_cache() {
+  local tmp=$(mktemp $PID_CACHE.XXXXXX)
+  docker inspect -f '{% raw %}{{.Name}} {{.State.Pid}}{% endraw %}' \
+  {%- for n in topo.nodes +%}
+    {{n}} \
+  {%- endfor %}
+  {%- for p in topo.ports.values() +%}
+    {{p.name}} \
+  {%- endfor +%}
+    2>/dev/null | while read -r name pid; do
+    _proc_start_time $pid
+    echo ${name#/} $pid $start
+  done > $tmp
+  mv $tmp $PID_CACHE
+  _load_pid_cache
+  _pids_refreshed=1
+}
+
+# Sets $pid to the cached pid of container $1, fails if that process is gone
+_cached_pid() {
+  local start
+  pid=${_pids[$1]}
+  [ -n "$pid" ] || return 1
+  _proc_start_time $pid
+  [ -n "$start" ] && [ "$start" == "${_pid_starts[$1]}" ]
+}
+
+# Sets $pid to the pid of container $1, fails if it is not running
+get_pid() {
+  local start
+  if ! _cached_pid $1 && [ -z "$_pids_refreshed" ]; then
+    refresh_pid_cache
+  fi
+  if [ -z "${_pids[$1]+x}" ]; then
+    # $1 isn't a container from this topology, ask docker about it once
+    _pids[$1]=$(docker inspect -f '{% raw %}{{.State.Pid}}{% endraw %}' $1 2>/dev/null)
+    _proc_start_time ${_pids[$1]}
+    _pid_starts[$1]=$start
+  fi
+  if ! _cached_pid $1; then
+    pid=""
+    echo "container $1 is not running" >&2
+    return 1
+  fi
+}
+
+_load_pid_cache
+
 run_in_ns() {
-  pid=$(docker inspect $1 | jq \.[0].State.Pid)
+  local pid
+  get_pid $1 || return 1
   shift
   flag="-n"
   # if $1 starts with a -, then replace $flag with $1
@@ -9,10 +9,26 @@ set -x
 parser=$({
   argparsh new $0
   argparsh add_arg --action store_true --helptext "Directly execute commands for the current host" -- "--cloudlab"
+  argparsh add_arg --action store_true --helptext "Report the wall-clock time of every setup phase" -- "--timing"
+  argparsh add_arg --action store_true --helptext "Apply all routes from a single toposim process (ignored with --cloudlab)" -- "--native"
 })
 
 eval $(argparsh parse $parser --format assoc-array --name args -- "$@")
 
+# Per-container route batches, iptables rules and sysctls generated by toposim
+NETWORKING_DIR=$(realpath $(dirname $0))/networking
+
+phase_start=$EPOCHREALTIME
+# Report the time since the previous phase ended if --timing was passed
+#   $1 = name of the phase that just finished
+timing() {
+  local now=$EPOCHREALTIME
+  if [ "${args["timing"]}" == "True" ]; then
+    echo "[timing] $1: $(awk "BEGIN { printf \"%.3f\", $now - $phase_start }")s" >&2
+  fi
+  phase_start=$now
+}
+
 if [ "${args["cloudlab"]}" == "True" ]; then
   # If we're deploying the network in cloudlab, then we only want to set routes
   # on this host. We redefine `run_in_ns` to ignore all commands that run in
@@ -26,85 +42,67 @@ if [ "${args["cloudlab"]}" == "True" ]; then
       "$@"
     fi
   }
+else
+  # Containers were (re)started before running this script, so resolve the pid
+  # of every container up front with a single docker inspect.
+  refresh_pid_cache
 fi
+timing "resolve container pids"
 
 
-# Enables forwarding on a particular interface for a given host
-#   $1 = namespace to run in
-#   $2 = interface to forward on
-forward() {
-  run_in_ns $1 iptables -t nat -A POSTROUTING --out-interface $2 -j ACCEPT
-  run_in_ns $1 iptables -A FORWARD -o $2 -j ACCEPT
+# Apply all generated networking config for a container with a single nsenter
+#   $1 = container to configure
+apply_networking() {
+  local cmds="ip -force -batch $NETWORKING_DIR/$1.routes"
+  if [ -e $NETWORKING_DIR/$1.links ] && [ "${args["cloudlab"]}" != "True" ]; then
+    cmds="ip -force -batch $NETWORKING_DIR/$1.links; $cmds"
+  fi
+  if [ -e $NETWORKING_DIR/$1.iptables ]; then
+    cmds="iptables-restore --noflush < $NETWORKING_DIR/$1.iptables; $cmds"
+  fi
+  if [ -e $NETWORKING_DIR/$1.sysctl ]; then
+    cmds="sysctl -q -p $NETWORKING_DIR/$1.sysctl; $cmds"
+  fi
+  run_in_ns $1 sh -c "$cmds"
 }
 
-# Given a subnet, find the interface with an IP matching the input subnet
-#   $1 = namespace to run in
-#   $2 = subnet
-get_iface_for_subnet() {
-  run_in_ns $1 ip addr | grep "inet $2\." | awk '{ print $NF }'
-}
+{%- if topo.veth_networks %}
 
-# for every port, set up packet forwarding
-{%- for p in topo.ports.values() +%}
-  {%- for i in range(p.networks | length) +%}
-forward {{p.name}} eth{{i}}
-  {%- endfor %}
-{%- endfor %}
-
-# for every node forward subnet/16 to the port
-{%- for n in topo.nodes +%}
-setup_{{n}}() {
-  {%- for m in topo.nodes if n != m +%}
-      {%- set subnet = topo.nodes[m].networks[0].subnet16 %}
-  run_in_ns {{n}} ip route add {{subnet}}.0.0/16 via {{topo.ports[n].ips[0]}} dev eth0
-  {%- endfor %}
+# Links are veth pairs between the two containers instead of docker networks.
+# Print the command creating the pair for link $1 between containers $2 and $3
+#   $1 = interface name (in both containers)
+#   $2, $3 = containers
+veth_pair() {
+  local pid
+  get_pid $2 || return 1
+  local pid_a=$pid
+  get_pid $3 || return 1
+  echo "link add $1 netns $pid_a type veth peer name $1 netns $pid"
 }
-setup_{{n}} &
-{%- endfor %}
 
-wait
+if [ "${args["cloudlab"]}" != "True" ] && [ "${args["native"]}" != "True" ]; then
+  {
+  {%- for net in topo.veth_networks %}
+    {%- set ends = net.devices | list +%}
+    veth_pair {{topo.veth_iface(net)}} {{ends[0]}} {{ends[1]}}
+  {%- endfor +%}
+  } | sudo ip -force -batch -
+fi
+timing "create veth pairs"
+{%- endif %}
 
-# for every port setup routes according to the routing table
-{%- for (n, p) in topo.ports.items() +%}
-setup_{{p.name}}() {
-  {%- for dst in topo.link_to_network[n] +%}
-    {%- set target_net = topo.link_to_network[n][dst] -%}
-    {%- set forward_net = topo.ports[dst].networks[0].subnet16 + ".0.0/16" -%}
-    {#- need to resolve ??? by getting the ip of the other port on the network... -#}
-    {%- set forward_ip = topo.link_to_fwd_ip[n][dst] -%}
-    {%- set link_subnet = forward_ip.rsplit(".", 2)[0] %}
-  iface=$(get_iface_for_subnet {{p.name}} {{link_subnet}})
-  run_in_ns {{p.name}} ip route add {{forward_net}} via {{forward_ip}} dev $iface
+# Every node forwards all other node subnets to its port (or routes them
+# itself), and every port forwards traffic according to the routing table
+if [ "${args["native"]}" == "True" ] && [ "${args["cloudlab"]}" != "True" ]; then
+  sudo "$(command -v toposim)" net apply $(dirname $0) --routes
+else
+  {%- for n in topo.nodes +%}
+  apply_networking {{n}} &
   {%- endfor %}
-}
-setup_{{p.name}} &
-{%- endfor %}
-wait
-
-# Output a mapping from each link to the interface it's assigned to
-echo > links.yml
-{%- for n in topo.nodes +%}
-echo {{n}}: >> links.yml
-{%- set port = topo.ports[n] -%}
-{%- set network = topo.nodes[n].networks[0] %}
-echo '  '{{port.name}}: >> links.yml
-echo '    - '$(get_iface_for_subnet {{n}} {{network.subnet16}}) >> links.yml
-{%- endfor %}
-
-{%- for (n, p) in topo.ports.items() +%}
-echo {{p.name}}: >> links.yml
-    {%- set node_net = p.networks[0] %}
-echo '  '{{n}}: >> links.yml
-echo '    - '$(get_iface_for_subnet {{p.name}} {{node_net.subnet16}}) >> links.yml
-  {%- for net in p.networks[1:] +%}
-    {#- {% set found = False %} -#}
-    {%- for q in topo.ports.values() if p != q +%}
-      {%- if net in q.networks +%}
-        {#- {% set found = True %} #}
-echo '  '{{q.name}}: >> links.yml
-echo '    - '$(get_iface_for_subnet {{p.name}} {{net.subnet16}}) >> links.yml
-      {%- endif %}
-      {#- assert found, "need to search nodes also?" -#}
-    {%- endfor %}
+  {%- for p in topo.ports.values() +%}
+  apply_networking {{p.name}} &
   {%- endfor %}
-{%- endfor %}
+  wait
+fi
+timing "install routes"
+
@@ -41,15 +41,15 @@ nodes["{{n}}"] = create_toposim_node(request, "{{n}}")
 nodes["{{p.name}}"] = create_toposim_node(request, "{{p.name}}", ["--dummy"])
 {%- endfor %}
 
-def getip(addr):
-    return rspec.IPv4Address(addr, "255.255.0.0")
+def getip(addr, netmask):
+    return rspec.IPv4Address(addr, netmask)
 
 
 {%- for net in topo.networks +%}
 # NET {{net.name}}
 {{net.name}}_ifaces = [
     {%- for dev in net.devices %}
-    nodes["{{dev}}"].addInterface(name="{{net.name}}{{dev}}", address=getip("{{net.devices[dev]}}")),
+    nodes["{{dev}}"].addInterface(name="{{net.name}}{{dev}}", address=getip("{{net.devices[dev]}}", "{{net.subnet.netmask}}")),
     {%- endfor %}
 ]
 assert len({{net.name}}_ifaces) < 3
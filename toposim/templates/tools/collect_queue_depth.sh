@@ -9,7 +9,9 @@ start_collection() {
   mkdir -p ${args["outdir"]}
   while true; do
 {%- for n in topo.nodes +%}
-  run_in_ns {{n}} tc -s -d qdisc ls dev eth0 >> ${args["outdir"]}/{{n}}.txt
+  {%- for iface in topo.node_ifaces(n) +%}
+  run_in_ns {{n}} tc -s -d qdisc ls dev {{iface}} >> ${args["outdir"]}/{{n}}.txt
+  {%- endfor %}
 {%- endfor %}
     sleep ${args["interval"]}
   done
@@ -4,7 +4,7 @@ stats() {
   date
   {%- for n in topo.nodes +%}
   echo -n {{n}} " "
-  docker exec -t {{n}} cat /proc/net/dev | awk '/eth0/{print "TX Bytes " $10}'
+  docker exec -t {{n}} cat /proc/net/dev | awk '/^ *({{topo.node_ifaces(n) | join("|")}}):/{tx += $10} END {print "TX Bytes " tx}'
   {%- endfor %}
 }
 
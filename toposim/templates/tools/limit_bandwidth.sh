@@ -5,9 +5,19 @@ parser=$({
   argparsh new $0 -d "limit bandwidth on all links"
   argparsh add_arg --type int --default 1024 -- "-b" "--bandwidth"
   argparsh add_arg --action store_true -- "-c" "--clear"
+  argparsh add_arg --action store_true --helptext "Apply all changes from a single toposim process (uses tbf instead of wondershaper)" -- "--native"
 })
 eval $(argparsh parse $parser -- "$@")
 
+if [ "$native" == "True" ]; then
+  if [ "$clear" == "True" ]; then
+    sudo "$(command -v toposim)" net apply $(dirname $0)/.. --clear-bandwidth
+  else
+    sudo "$(command -v toposim)" net apply $(dirname $0)/.. --bandwidth $bandwidth
+  fi
+  exit $?
+fi
+
 
 {% include 'run_in_ns_fn.sh' %}
 
@@ -27,7 +37,9 @@ install_ifb() {
 clear_limits() {
 # clear existing limit if set
 {%- for n in topo.nodes +%}
-run_in_ns {{n}} wondershaper -a eth0 -c &
+  {%- for iface in topo.node_ifaces(n) +%}
+run_in_ns {{n}} wondershaper -a {{iface}} -c &
+  {%- endfor %}
 {%- endfor %}
 wait
 }
@@ -48,6 +60,8 @@ clear_limits
 
 # set limit
 {%- for n in topo.nodes +%}
-run_in_ns {{n}} wondershaper -a eth0 -d $bandwidth -u $bandwidth &
+  {%- for iface in topo.node_ifaces(n) +%}
+run_in_ns {{n}} wondershaper -a {{iface}} -d $bandwidth -u $bandwidth &
+  {%- endfor %}
 {%- endfor %}
 wait
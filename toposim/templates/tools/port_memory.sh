@@ -0,0 +1,32 @@
+# Report the memory used by every port and the total over all ports
+
+parser=$({
+  argparsh new $0 -d "Memory used by every port (forwarding container)"
+  argparsh add_arg --action store_true --helptext "Only print the total" -- "-q" "--quiet"
+})
+eval $(argparsh parse $parser -- "$@")
+
+{% if topo.ports -%}
+docker stats --no-stream --format '{% raw %}{{.Name}} {{.MemUsage}}{% endraw %}' \
+{%- for p in topo.ports.values() +%}
+  {{p.name}} \
+{%- endfor +%}
+  | awk -v quiet=$quiet '
+    # docker prints sizes like 1.5MiB, convert them to KiB
+    function kib(size) {
+      if (size ~ /GiB$/) return size * 1024 * 1024
+      if (size ~ /MiB$/) return size * 1024
+      if (size ~ /KiB$/) return size + 0
+      return size / 1024
+    }
+    {
+      used = kib($2)
+      total += used
+      if (quiet != "True") printf "%-30s %10.1f KiB\n", $1, used
+    }
+    END {
+      printf "%d ports: %.1f MiB total, %.1f KiB per port\n", NR, total / 1024, NR ? total / NR : 0
+    }'
+{%- else -%}
+echo "0 ports"
+{%- endif %}
@@ -7,17 +7,11 @@ start_tcpdump() {
   local output_dir="${args["outdir"]}"
   mkdir -p $output_dir
 
-{%- for n in topo.nodes +%}
-  output_file=$output_dir/{{n}}_eth0
-  run_in_ns {{n}} tcpdump -e -i eth0 -w $output_file &
-{%- endfor %}
-
-
-{%- for p in topo.ports.values() +%}
-  {%- for i in range(p.networks | length) +%}
+{%- for name in topo.containers +%}
+  {%- for iface in topo.ifaces(name) +%}
 
-  output_file=$output_dir/{{p.name}}_eth{{i}}
-  run_in_ns {{p.name}} tcpdump -e -i eth{{i}} -w $output_file &
+  output_file=$output_dir/{{name}}_{{iface}}
+  run_in_ns {{name}} tcpdump -e -i {{iface}} -w $output_file &
   {%- endfor %}
 {%- endfor %}
 }
@@ -1,6 +1,13 @@
 import sys
 from dataclasses import dataclass, field
-from typing import Dict, List, Set, Tuple, Union
+from ipaddress import IPv4Network
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from . import utils
+from .forwarder import DEFAULT_FORWARDER, Forwarder, forwarder_presets
+from .graph import TopologyGraph
 
 
 def log(*args, **kwargs):
@@ -25,22 +32,48 @@ def log(*args, **kwargs):
 # (B)-(2)     (3)-(C)
 #      |
 # (D)-(4)
+#
+# With "direct" forwarding, nodes are connected to each other and route on
+# their own interfaces instead, so only dummy nodes get a port. Every node still
+# keeps its own network, whose address the other nodes reach it by.
 
+# How nodes are connected to links: through their port or directly
+FORWARDING_MODES = ("port", "direct")
 
-@dataclass
+# How links are realized: as docker bridge networks, or as veth pairs between
+# the two containers. Networks of nodes are always docker networks, since every
+# container needs one to start with.
+BACKENDS = ("bridge", "veth")
+
+
+# Every network is a /29: the network address, docker's gateway, up to two
+# devices and the broadcast address.
+NETWORK_PREFIXLEN = 29
+
+
+# Networks are compared by identity: comparing every field is slow and two
+# networks are never interchangeable
+@dataclass(eq=False)
 class Network:
     name: str
-    subnet16: str
+    subnet: IPv4Network
     _counter: int = 2
     devices: Dict[str, str] = field(default_factory=lambda: {})
+    # Realized as a veth pair instead of a docker network
+    veth: bool = False
+
+    @property
+    def gateway(self) -> str:
+        return str(self.subnet[1])
 
     def vend_ip(self) -> str:
-        ip = f"{self.subnet16}.0.{self._counter}"
+        assert self._counter < self.subnet.num_addresses - 1, f"{self.name} is full"
+        ip = str(self.subnet[self._counter])
         self._counter += 1
         return ip
 
-    def add_dev(self, device: Union["Port", "Node"]):
-        ip = device.attach(self)
+    def add_dev(self, device: Union["Port", "Node"], ip: str = ""):
+        ip = device.attach(self, ip)
         self.devices[device.name] = ip
 
 
@@ -50,9 +83,9 @@ class Port:
     networks: List[Network] = field(default_factory=lambda: [])
     ips: List[str] = field(default_factory=lambda: [])
 
-    def attach(self, net: Network) -> str:
+    def attach(self, net: Network, ip: str = "") -> str:
         self.networks.append(net)
-        ip = net.vend_ip()
+        ip = ip or net.vend_ip()
         self.ips.append(ip)
         return ip
 
@@ -65,115 +98,559 @@ class Node:
     # node to interface to communicate on (every node get it's own subnet)
     routes: Dict[str, int] = field(default_factory=lambda: {})
     networks: List[Network] = field(default_factory=lambda: [])
+    # Address on the node's own network, which other nodes reach it by
     ip: str = ""
+    # Addresses on every network, in the same order as `networks`
+    ips: List[str] = field(default_factory=lambda: [])
 
-    def attach(self, net: Network) -> str:
-        assert self.ip == ""
+    def attach(self, net: Network, ip: str = "") -> str:
+        # Nodes only join link networks when forwarding directly
         self.networks.append(net)
-        self.ip = net.vend_ip()
-        return self.ip
+        ip = ip or net.vend_ip()
+        self.ips.append(ip)
+        if not self.ip:
+            self.ip = ip
+        return ip
+
+
+class SubnetAllocator:
+    """Carve /29 networks out of a supernet.
+
+    Node networks come first, in a contiguous block whose size is a power of
+    two, so that a single route to the block covers every node. Link networks
+    are allocated after the block, skipping any subnet in `reserved`.
+    """
+
+    def __init__(
+        self, supernet: IPv4Network, num_nodes: int, reserved: Set[IPv4Network]
+    ):
+        self.supernet = supernet
+        self.size = 2 ** (32 - NETWORK_PREFIXLEN)
+        node_bits = max(num_nodes - 1, 0).bit_length()
+        if NETWORK_PREFIXLEN - node_bits < supernet.prefixlen:
+            raise Exception(f"{supernet} is too small for {num_nodes} nodes")
+        self.node_block = IPv4Network(
+            (supernet.network_address, NETWORK_PREFIXLEN - node_bits)
+        )
+        self._next = 1 << node_bits
+        self._reserved = reserved
+
+    def subnet(self, index: int) -> IPv4Network:
+        if (index + 1) * self.size > self.supernet.num_addresses:
+            raise Exception(f"Ran out of subnets in {self.supernet}")
+        start = int(self.supernet.network_address) + index * self.size
+        return IPv4Network((start, NETWORK_PREFIXLEN))
+
+    def node_subnet(self, index: int) -> IPv4Network:
+        return self.subnet(index)
+
+    def link_subnet(self) -> IPv4Network:
+        while (res := self.subnet(self._next)) in self._reserved:
+            self._next += 1
+        self._next += 1
+        return res
+
+
+def compute_routes(graph: TopologyGraph) -> Dict[str, Dict[str, str]]:
+    """Compute `route_table[src][dst] = first_hop` for every pair of nodes.
+
+    Runs one BFS per source, so the whole table costs O(V*E). When several
+    shortest paths exist, the first hop that appears earliest in `src.links` is
+    chosen, which keeps the generated routes stable across runs.
+    """
+    adj = graph.adjacency()
+    names = graph.names
+    route_table: Dict[str, Dict[str, str]] = {}
+    for src in range(graph.num_nodes):
+        first_hop = [-1] * graph.num_nodes
+        first_hop[src] = src
+        # Nodes in the order they are discovered, which doubles as the queue.
+        # Nodes are discovered in order of their first hop's position in
+        # `src.links`, so the first parent to reach a node carries the
+        # preferred first hop.
+        order = []
+        for l in adj[src]:
+            first_hop[l] = l
+            order.append(l)
+        i = 0
+        while i < len(order):
+            curr = order[i]
+            i += 1
+            hop = first_hop[curr]
+            for l in adj[curr]:
+                if first_hop[l] < 0:
+                    first_hop[l] = hop
+                    order.append(l)
+        if len(order) != graph.num_nodes - 1:
+            unreachable = sorted(names[n] for n, h in enumerate(first_hop) if h < 0)
+            raise Exception(f"{names[src]} cannot reach {unreachable}")
+        route_table[names[src]] = {names[n]: names[first_hop[n]] for n in order}
+    return route_table
+
+
+def compute_multipath_routes(graph: TopologyGraph) -> Dict[str, Dict[str, List[str]]]:
+    """Compute `route_table[src][dst] = [first_hop, ...]` with every first hop
+    that lies on a shortest path from src to dst.
+
+    First hops are ordered by their position in `src.links`, so the first entry
+    always matches the choice made by `compute_routes`.
+    """
+    adj = graph.adjacency()
+    names = graph.names
+    route_table: Dict[str, Dict[str, List[str]]] = {}
+    for src in range(graph.num_nodes):
+        dist = [-1] * graph.num_nodes
+        dist[src] = 0
+        # Bit k is set if the k-th link of src is a first hop
+        first_hops = [0] * graph.num_nodes
+        for k, l in enumerate(adj[src]):
+            dist[l] = 1
+            first_hops[l] = 1 << k
+        frontier = list(adj[src])
+        order = list(frontier)
+        # Walk the BFS one level at a time so that every parent of a node is
+        # finalized before the node's own successors are visited.
+        while frontier:
+            next_frontier = []
+            for curr in frontier:
+                d = dist[curr] + 1
+                hops = first_hops[curr]
+                for l in adj[curr]:
+                    if dist[l] < 0:
+                        dist[l] = d
+                        first_hops[l] = hops
+                        next_frontier.append(l)
+                    elif dist[l] == d:
+                        first_hops[l] |= hops
+            order += next_frontier
+            frontier = next_frontier
+        if len(order) != graph.num_nodes - 1:
+            unreachable = sorted(names[n] for n, d in enumerate(dist) if d < 0)
+            raise Exception(f"{names[src]} cannot reach {unreachable}")
+
+        # Many destinations share the same first hops, decode every set once
+        links = [names[l] for l in adj[src]]
+        decoded: Dict[int, List[str]] = {}
+        routes: Dict[str, List[str]] = {}
+        for n in order:
+            mask = first_hops[n]
+            if mask not in decoded:
+                decoded[mask] = [l for k, l in enumerate(links) if mask >> k & 1]
+            routes[names[n]] = decoded[mask]
+        route_table[names[src]] = routes
+    return route_table
+
+
+def routing_table(graph: TopologyGraph, ecmp: bool) -> Dict[str, Dict[str, List[str]]]:
+    """`route_table[src][dst] = [first_hop, ...]`: every equal-cost first hop
+    with ECMP, otherwise only the preferred one"""
+    if ecmp:
+        return compute_multipath_routes(graph)
+    routes = compute_routes(graph)
+    return {src: {dst: [hop] for dst, hop in r.items()} for src, r in routes.items()}
+
+
+def locality_order(graph: TopologyGraph) -> List[str]:
+    """Order nodes so that nodes that are close in the graph are adjacent.
+
+    Walks a BFS tree rooted at the node with the most links depth-first,
+    visiting leaves before subtrees, so that e.g. all hosts behind a switch
+    (and all switches of a pod) end up next to each other. Allocating node networks in this order lets ports
+    summarize destinations behind the same next hop with few prefixes.
+    """
+    if not graph.num_nodes:
+        return []
+    adj = graph.adjacency()
+    root = int(np.argmax(graph.degrees()))
+    children: List[Optional[List[int]]] = [None] * graph.num_nodes
+    children[root] = []
+    frontier = [root]
+    while frontier:
+        next_frontier = []
+        for curr in frontier:
+            for l in adj[curr]:
+                if children[l] is None:
+                    children[l] = []
+                    children[curr].append(l)
+                    next_frontier.append(l)
+        frontier = next_frontier
+
+    order = []
+    stack = [root]
+    while stack:
+        curr = stack.pop()
+        order.append(graph.names[curr])
+        kids = sorted(children[curr], key=lambda c: len(children[c]))
+        stack.extend(reversed(kids))
+    # compute_routes reports disconnected graphs, just keep them allocatable
+    order += [graph.names[n] for n, c in enumerate(children) if c is None]
+    return order
+
+
+def aggregate_routes(
+    block: IPv4Network, slots: Dict[int, Tuple[str, ...]]
+) -> Dict[IPv4Network, Tuple[str, ...]]:
+    """Compute the smallest set of prefixes forwarding like `slots`.
+
+    `slots` maps the index of a /NETWORK_PREFIXLEN network inside `block` to
+    the next hops for that network. Networks without an entry are don't-care
+    (unused or directly connected) and may be covered by any route. This is
+    the Optimal Routing Table Constructor (Draves et al.) over the binary
+    trie of `block`:
+      1. bottom-up, every trie node gets the set of next hops that would let
+         its children inherit a route from it (intersection if non-empty,
+         otherwise union);
+      2. top-down, a node only gets a route if the next hop it inherits is
+         not in its set.
+    """
+    depth = NETWORK_PREFIXLEN - block.prefixlen
+    # levels[0] are the leaves, levels[depth] is the root. None means any next
+    # hop is acceptable.
+    leaves: List[Optional[FrozenSet[Tuple[str, ...]]]] = [None] * (1 << depth)
+    for slot, hops in slots.items():
+        leaves[slot] = frozenset([hops])
+    levels = [leaves]
+    for _ in range(depth):
+        prev = levels[-1]
+        level = []
+        for i in range(0, len(prev), 2):
+            a, b = prev[i], prev[i + 1]
+            if a is None or b is None:
+                level.append(b if a is None else a)
+            else:
+                level.append((a & b) or (a | b))
+        levels.append(level)
+
+    routes: Dict[IPv4Network, Tuple[str, ...]] = {}
+    base = int(block.network_address)
+    # The next hop inherited by every trie node of the current level
+    inherited: List[Optional[Tuple[str, ...]]] = [None]
+    for height in range(depth, -1, -1):
+        size = 1 << (32 - NETWORK_PREFIXLEN + height)
+        chosen: List[Optional[Tuple[str, ...]]] = []
+        for i, options in enumerate(levels[height]):
+            hop = inherited[i >> 1] if height < depth else None
+            if options is not None and hop not in options:
+                hop = min(options)
+                routes[IPv4Network((base + i * size, NETWORK_PREFIXLEN - height))] = hop
+            chosen.append(hop)
+        inherited = chosen
+    return routes
 
 
 class Topology:
     prefix: str
     nodes: Dict[str, Node]
     dummies: Dict[str, Node]
+    # Links between nodes and dummies, by integer node id
+    graph: TopologyGraph
+    forwarding: str
+    backend: str
+    # Image and limits of every port
+    forwarder: Forwarder
     ports: Dict[str, Port]
+    # node -> the container that forwards its traffic: its port, or the node
+    # itself with direct forwarding
+    forwarders: Dict[str, Union[Port, Node]]
+    # container name -> port or node
+    containers: Dict[str, Union[Port, Node]]
+    # container -> network name -> interface of the container on the network
+    iface_names: Dict[str, Dict[str, str]]
+    # container -> number of interfaces docker has created in the container
+    _num_eth: Dict[str, int]
     # [n1, n2] -> net
     link_to_network: Dict[str, Dict[str, Network]]
     # [n1, n2] -> ip n1 should forward traffic to to reach n2
     link_to_fwd_ip: Dict[str, Dict[str, str]]
+    # [n1, n2] -> all equal-cost ips n1 can forward traffic to to reach n2. If
+    # ecmp is disabled, this only contains the ip from link_to_fwd_ip.
+    link_to_fwd_ips: Dict[str, Dict[str, List[str]]]
     networks: List[Network]
+    ecmp: bool
+    # Value for net.ipv4.fib_multipath_hash_policy (0 = L3, 1 = L4, ...)
+    ecmp_hash_policy: int
+
+    supernet: IPv4Network
+    # Block of addresses containing every node network
+    node_block: IPv4Network
 
-    _subnet32: str
-    _subnet = 1
+    _allocator: SubnetAllocator
+    _net_id = 1
+    # Names of networks reused from a previous topology
+    _reserved: Set[str]
 
-    def create_network(self) -> Network:
-        global _subnet
-        res = Network(f"net{self._subnet}", f"{self._subnet32}.{self._subnet}")
+    def create_network(self, subnet: IPv4Network) -> Network:
+        while f"net{self._net_id}" in self._reserved:
+            self._net_id += 1
+        res = Network(f"net{self._net_id}", subnet)
         self.networks.append(res)
-        self._subnet += 1
+        self._net_id += 1
         return res
 
-    def build_routing_table(self) -> Dict[str, Dict[str, str]]:
-        route_table = {n: {} for n in self.nodes}
-        messages = {n: [[]] for n in self.nodes}
-        while any(len(r) != (len(self.nodes) - 1) for r in route_table.values()):
-            # propogate all messages
-            new_messages = {}
-            for name, routes in messages.items():
-                new_routes = []
-                node = self.nodes[name]
-                for r in routes:
-                    if len(r):
-                        dst = r[-1]
-                        if dst != name and dst not in route_table[name]:
-                            route_table[name][dst] = r[0]
-                    new_routes.append([name] + r)
-                for l in node.links:
-                    if l not in new_messages:
-                        new_messages[l] = []
-                    new_messages[l] += new_routes
-            messages = new_messages
-        return route_table
-
-    def __init__(self, prefix: str, nodes: Dict[str, Node], subnet32: str = "174"):
+    def reuse_network(self, prev: Network, devices: List[Union[Port, Node]]) -> Network:
+        """Recreate `prev` with the same name, subnet and addresses"""
+        res = Network(prev.name, prev.subnet)
+        self.networks.append(res)
+        for dev in devices:
+            res.add_dev(dev, prev.devices[dev.name])
+        return res
+
+    def build_routing_table(self) -> Dict[str, Dict[str, List[str]]]:
+        return routing_table(self.graph, self.ecmp)
+
+    def __init__(
+        self,
+        prefix: str,
+        nodes: Dict[str, Node],
+        supernet: str = "174.0.0.0/8",
+        ecmp: bool = False,
+        ecmp_hash_policy: int = 1,
+        previous: Optional["Topology"] = None,
+        forwarding: str = "port",
+        forwarder: Optional[Forwarder] = None,
+        backend: str = "bridge",
+    ):
+        """Build a topology from `nodes`.
+
+        If `previous` is given, networks for links that already existed in
+        `previous` keep their name, subnet and addresses, so that a running
+        cluster can be reconfigured in place. `previous` must have the same set
+        of nodes, the same forwarding mode and the same backend.
+        """
+        if forwarding not in FORWARDING_MODES:
+            raise Exception(f"Invalid forwarding mode {forwarding}")
+        if backend not in BACKENDS:
+            raise Exception(f"Invalid backend {backend}")
         self.prefix = prefix
         self.networks = []
         self.nodes = nodes
         self.dummies = {}
-        self._subnet32 = subnet32
+        self.supernet = IPv4Network(supernet)
+        self.ecmp = ecmp
+        self.ecmp_hash_policy = ecmp_hash_policy
+        self.forwarding = forwarding
+        self.backend = backend
+        self.forwarder = forwarder or forwarder_presets[DEFAULT_FORWARDER]
+
+        self._reserved = set()
+        prev_links: Dict[Tuple[str, str], Network] = {}
+        if previous is not None:
+            prev_nodes = {**previous.nodes, **previous.dummies}
+            if {(n.name, n.is_dummy) for n in prev_nodes.values()} != {
+                (n.name, n.is_dummy) for n in nodes.values()
+            }:
+                raise Exception("Reconfiguration can not add or remove nodes")
+            if previous.forwarding != forwarding:
+                raise Exception("Reconfiguration can not change the forwarding mode")
+            if previous.backend != backend:
+                raise Exception("Reconfiguration can not change the backend")
+            for n in prev_nodes.values():
+                for l in n.links:
+                    prev_links[(n.name, l)] = previous.link_to_network[n.name][l]
+            self._reserved = {net.name for net in previous.networks}
+        self._allocator = SubnetAllocator(
+            self.supernet,
+            len(nodes),
+            {net.subnet for net in (previous.networks if previous else [])},
+        )
+        self.node_block = self._allocator.node_block
 
+        self.graph = TopologyGraph.from_links(
+            {n: node.links for n, node in nodes.items()},
+            [n for n, node in nodes.items() if node.is_dummy],
+        )
         routes = self.build_routing_table()
-        for name, r in routes.items():
-            log(name, r)
+        if utils.verbose:
+            for name, r in routes.items():
+                log(name, r)
 
         ports: Dict[str, Port] = {}
+        forwarders: Dict[str, Union[Port, Node]] = {}
         for i, n in enumerate(nodes):
-            if nodes[n].is_dummy:
+            if forwarding == "direct" and not nodes[n].is_dummy:
+                forwarders[n] = nodes[n]
+                continue
+            if previous is not None:
+                ports[n] = Port(previous.ports[n].name)
+            elif nodes[n].is_dummy:
                 ports[n] = Port(n)
             else:
                 ports[n] = Port(f"{prefix}_port{i}")
+            forwarders[n] = ports[n]
 
-        num_networks = sum(len(n.links) for n in nodes.values()) // 2
-        log(f"Requires {num_networks} networks between ports")
+        num_networks = self.graph.num_links
+        between = "nodes" if forwarding == "direct" else "ports"
+        log(f"Requires {num_networks} networks between {between}")
 
-        for n in nodes:
-            net = self.create_network()
-            net.add_dev(nodes[n])
-            net.add_dev(ports[n])
+        # Allocate node networks so that nearby nodes get adjacent subnets, which
+        # lets routes be aggregated
+        for i, n in enumerate(locality_order(self.graph)):
+            devices: List[Union[Port, Node]] = [nodes[n]]
+            if n in ports:
+                devices.append(ports[n])
+            if previous is not None:
+                self.reuse_network(previous.forwarders[n].networks[0], devices)
+                continue
+            net = self.create_network(self._allocator.node_subnet(i))
+            for dev in devices:
+                net.add_dev(dev)
 
-        unique_links: Set[Tuple[str, str]] = set()
-        for n in nodes.values():
-            for l in n.links:
-                if (l, n.name) in unique_links:
-                    continue
-                unique_links.add((n.name, l))
+        # Networks are always assigned in the same order for the same config
+        names = self.graph.names
+        unique_links = [(names[u], names[v]) for u, v in self.graph.edges().tolist()]
 
         link_to_network: Dict[str, Dict[str, Network]] = {n: {} for n in nodes}
         link_to_fwd_ip: Dict[str, Dict[str, str]] = {n: {} for n in nodes}
+        link_to_fwd_ips: Dict[str, Dict[str, List[str]]] = {n: {} for n in nodes}
         for node1, node2 in unique_links:
-            net = self.create_network()
-            net.add_dev(ports[node1])
-            net.add_dev(ports[node2])
+            fwd1, fwd2 = forwarders[node1], forwarders[node2]
+            if prev := prev_links.get((node1, node2)):
+                net = self.reuse_network(prev, [fwd1, fwd2])
+            else:
+                net = self.create_network(self._allocator.link_subnet())
+                net.add_dev(fwd1)
+                net.add_dev(fwd2)
+            net.veth = backend == "veth"
 
             link_to_network[node1][node2] = net
-            link_to_fwd_ip[node1][node2] = ports[node2].ips[-1]
+            link_to_fwd_ip[node1][node2] = fwd2.ips[-1]
             link_to_network[node2][node1] = net
-            link_to_fwd_ip[node2][node1] = ports[node1].ips[-1]
+            link_to_fwd_ip[node2][node1] = fwd1.ips[-1]
+            link_to_fwd_ips[node1][node2] = [link_to_fwd_ip[node1][node2]]
+            link_to_fwd_ips[node2][node1] = [link_to_fwd_ip[node2][node1]]
 
         for src in routes:
-            for dst in routes[src]:
-                if routes[src][dst] == dst:
+            for dst, hops in routes[src].items():
+                if hops[0] == dst:
                     continue
-                link_to_network[src][dst] = link_to_network[src][routes[src][dst]]
-                link_to_fwd_ip[src][dst] = link_to_fwd_ip[src][routes[src][dst]]
+                link_to_network[src][dst] = link_to_network[src][hops[0]]
+                link_to_fwd_ip[src][dst] = link_to_fwd_ip[src][hops[0]]
+                link_to_fwd_ips[src][dst] = [link_to_fwd_ip[src][h] for h in hops]
 
         self.ports = ports
+        self.forwarders = forwarders
         self.link_to_network = link_to_network
         self.link_to_fwd_ip = link_to_fwd_ip
+        self.link_to_fwd_ips = link_to_fwd_ips
 
         dummies = [n for n in self.nodes if self.nodes[n].is_dummy]
         for d in dummies:
             self.dummies[d] = self.nodes[d]
             del self.nodes[d]
+
+        self.containers = {
+            **self.nodes,
+            **{p.name: p for p in self.ports.values()},
+        }
+
+        # Docker names interfaces eth0, eth1, ... in the order networks are
+        # connected (docker-compose.yml and `toposim up` connect them in the
+        # order of `networks`), and never reuses a name. Networks connected by
+        # a reconfiguration therefore come after every network the container
+        # was ever connected to.
+        self.iface_names = {}
+        self._num_eth = {}
+        for name, dev in self.containers.items():
+            prev_names = previous.iface_names.get(name, {}) if previous else {}
+            num_eth = previous._num_eth.get(name, 0) if previous else 0
+            names = {}
+            for net in dev.networks:
+                if net.veth:
+                    names[net.name] = self.veth_iface(net)
+                elif net.name in prev_names:
+                    names[net.name] = prev_names[net.name]
+                else:
+                    names[net.name] = f"eth{num_eth}"
+                    num_eth += 1
+            self.iface_names[name] = names
+            self._num_eth[name] = num_eth
+
+    def container_routes(self) -> Dict[str, Dict[str, List[str]]]:
+        """Routes every container needs: container -> destination -> next hops"""
+        routes: Dict[str, Dict[str, List[str]]] = {}
+        # Every node network is inside node_block, so nodes behind a port only
+        # need a single route to reach all other nodes (their own network is
+        # more specific).
+        for n in self.nodes:
+            if n in self.ports:
+                routes[n] = {str(self.node_block): [self.ports[n].ips[0]]}
+        # Forwarders route per destination node network, aggregated into the
+        # fewest prefixes that forward the same way.
+        base = int(self.node_block.network_address)
+        size = 2 ** (32 - NETWORK_PREFIXLEN)
+        num_routes = 0
+        num_aggregated = 0
+        for n, fwd in self.forwarders.items():
+            slots = {}
+            for dst, forward_ips in self.link_to_fwd_ips[n].items():
+                subnet = self.forwarders[dst].networks[0].subnet
+                slots[(int(subnet.network_address) - base) // size] = tuple(forward_ips)
+            aggregated = aggregate_routes(self.node_block, slots)
+            routes[fwd.name] = {
+                str(net): list(hops) for net, hops in aggregated.items()
+            }
+            num_routes += len(slots)
+            num_aggregated += len(aggregated)
+        log(f"Aggregated {num_routes} forwarding routes into {num_aggregated}")
+        return routes
+
+    def route_source(self, container: str) -> str:
+        """Source address for routes of `container`, if it needs one.
+
+        Nodes that forward directly send from their link interfaces, whose
+        addresses are only reachable from their neighbors, so their own traffic
+        must use the address of their own network instead.
+        """
+        if self.forwarding == "direct" and container in self.nodes:
+            return self.nodes[container].ip
+        return ""
+
+    @staticmethod
+    def veth_iface(net: Network) -> str:
+        # Both ends of the pair are named after the network, which keeps the
+        # name stable when other links are added or removed
+        return f"v{net.name}"
+
+    def ifaces(self, container: str) -> List[str]:
+        """Interface of `container` on each of its networks"""
+        names = self.iface_names[container]
+        return [names[net.name] for net in self.containers[container].networks]
+
+    def links(self) -> Dict[str, Dict[str, List[str]]]:
+        """container -> peer -> interfaces of the container facing the peer"""
+        res: Dict[str, Dict[str, List[str]]] = {}
+        for name, dev in self.containers.items():
+            res[name] = {}
+            for net in dev.networks:
+                iface = self.iface_names[name][net.name]
+                for peer in net.devices:
+                    if peer != name:
+                        res[name].setdefault(peer, []).append(iface)
+        return res
+
+    @property
+    def bridge_networks(self) -> List[Network]:
+        """Networks created by docker"""
+        return [net for net in self.networks if not net.veth]
+
+    @property
+    def veth_networks(self) -> List[Network]:
+        return [net for net in self.networks if net.veth]
+
+    def bridge_endpoints(self, dev: Union[Port, Node]) -> List[Tuple[Network, str]]:
+        """(network, address) of every docker network `dev` is connected to"""
+        return [(net, ip) for net, ip in zip(dev.networks, dev.ips) if not net.veth]
+
+    def forwarding_ifaces(self, n: str) -> List[str]:
+        """Interfaces of the forwarder of node `n` that traffic is forwarded on"""
+        fwd = self.forwarders[n]
+        if isinstance(fwd, Port):
+            return self.ifaces(fwd.name)
+        # Skip the node's own network, which only the node is on
+        return self.ifaces(fwd.name)[1:]
+
+    def node_ifaces(self, n: str) -> List[str]:
+        """Interfaces node `n` sends and receives traffic on"""
+        if n in self.ports:
+            return ["eth0"]
+        return self.forwarding_ifaces(n)